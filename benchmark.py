@@ -0,0 +1,262 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import time
+import platform
+import argparse
+import resource
+import statistics
+import tracemalloc
+import subprocess
+
+from multiprocessing import Pool
+
+from knowledge_opts import load_json, save_json
+from pipeline import Pipeline, PipelineError
+
+# models of the default suite, a problog model can have an evidence file (model.pl:evidence.pl)
+DEFAULT_MODELS = [
+    'bif/cancer.bif',
+    'bif/bulglary.bif',
+    'bif/alarm.bif',
+    'problog/cancer.pl',
+    'problog/montyhall.pl',
+    'problog/coins.pl',
+    'problog/cancer.pl:problog/cancer_ev1000.pl'
+]
+
+DEFAULT_OUTPUT = "benchmark.json"
+
+# stage times below this (in seconds) are too noisy to flag as regressions
+MIN_TIME = 0.01
+
+def configurations(models, encs, cnf_types):
+    """
+        Returns all (name, model, evidence file, enc, cnf type) combinations,
+        the encoding only applies to bif models and evidence files need the c2d cnf type
+    """
+    configs = []
+    for model in models:
+        pl_file, _, evidence_file = model.partition(":")
+        is_bif = pl_file.endswith(".bif")
+        name = os.path.basename(pl_file)
+        if evidence_file:
+            name += "+" + os.path.splitext(os.path.basename(evidence_file))[0]
+        for enc in (encs if is_bif else [None]):
+            for cnf_type in cnf_types:
+                if evidence_file and cnf_type != "c2d":
+                    continue
+                label = " ".join([name] + (["enc{}".format(enc)] if enc is not None else []) + [cnf_type])
+                configs.append((label, pl_file, evidence_file or None, enc, cnf_type))
+    return configs
+
+def run_once(config, options, trace_memory=False):
+    """
+        Runs all stages of the pipeline for the configuration in a temporary directory,
+        returns (stage -> wall time, stage -> peak traced memory in MB or None, sizes)
+    """
+    _, model, evidence_file, enc, cnf_type = config
+    if not model.endswith(".bif"):
+        # the network vtree only applies to bif models
+        options = dict(options, network_vtree=None)
+    pipe = Pipeline(enc=enc or 1, cnf_type=cnf_type, **options)
+    try:
+        if model.endswith(".bif"):
+            pipe.load(bif_file=model)
+        else:
+            pipe.load(pl_file=model, evidence_file=evidence_file)
+
+        times = {}
+        memory = {}
+        results = {}
+        for name, stage in pipe.stages():
+            if trace_memory:
+                tracemalloc.reset_peak()
+            start_time = time.perf_counter()
+            results[name] = stage()
+            times[name] = time.perf_counter() - start_time
+            memory[name] = tracemalloc.get_traced_memory()[1] / 2**20 if trace_memory else None
+    finally:
+        pipe.close()
+
+    sizes = {}
+    encoded = results.get('preprocess', results.get('encode', {}))
+    sizes['variables'] = encoded.get('preprocessed_variables', encoded.get('variables'))
+    sizes['clauses'] = encoded.get('preprocessed_clauses', encoded.get('clauses'))
+    if 'compile' in results:
+        sizes['sdd_nodes'] = results['compile'].get('node_count')
+        sizes['sdd_size'] = results['compile'].get('size')
+    return times, memory, sizes
+
+def summarize(samples):
+    """ Returns min / median / mean / max of a list of numbers """
+    return {
+        'min': min(samples),
+        'median': statistics.median(samples),
+        'mean': statistics.mean(samples),
+        'max': max(samples)
+    }
+
+def benchmark(config, options, warmup, repetitions):
+    """
+        Benchmarks one configuration: warmup runs, timed repetitions and one run with tracemalloc
+        for the peak memory per stage (python allocations only, tracing slows the run down so it isn't timed).
+        Runs in its own worker process, peak_rss_mb is the peak resident size of that process.
+        Returns the result dict of the configuration
+    """
+    result = {'model': config[1], 'evidence_file': config[2], 'enc': config[3], 'cnf_type': config[4]}
+    # the output of miniC2D and pySDD isn't part of the results
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    stdout = os.dup(1)
+    os.dup2(devnull, 1)
+    try:
+        for _ in range(warmup):
+            run_once(config, options)
+        runs = [run_once(config, options) for _ in range(repetitions)]
+
+        tracemalloc.start()
+        _, memory, sizes = run_once(config, options, trace_memory=True)
+        tracemalloc.stop()
+    except PipelineError as e:
+        result['error'] = str(e)
+        return result
+    finally:
+        os.dup2(stdout, 1)
+        os.close(stdout)
+        os.close(devnull)
+
+    stages = list(runs[0][0])
+    result['stages'] = dict((stage, summarize([times[stage] for times, _, _ in runs])) for stage in stages)
+    result['total'] = summarize([sum(times.values()) for times, _, _ in runs])
+    result['peak_mb'] = memory
+    result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    result.update(sizes)
+    return result
+
+def _benchmark_task(args):
+    return benchmark(*args)
+
+def git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+    return out.stdout.decode().strip() or None
+
+def run_suite(configs, options, warmup, repetitions, jobs=1):
+    """
+        Benchmarks all configurations, every configuration runs in a fresh worker process.
+        Returns the report: {'meta': ..., 'results': {configuration name: result}}
+    """
+    tasks = [(config, options, warmup, repetitions) for config in configs]
+    with Pool(jobs, maxtasksperchild=1) as pool:
+        results = pool.map(_benchmark_task, tasks, chunksize=1)
+    return {
+        'meta': {
+            'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'warmup': warmup,
+            'repetitions': repetitions,
+            'jobs': jobs,
+            'options': options
+        },
+        'results': dict((config[0], result) for config, result in zip(configs, results))
+    }
+
+def compare(old, new, threshold, min_time=MIN_TIME):
+    """
+        Compares two reports, returns (configuration, metric, old value, new value, ratio) for every
+        median stage time, total time, peak memory and sdd size that grew by more than threshold
+        (a fraction, 0.1 is 10%). Times below min_time in both reports are skipped
+    """
+    regressions = []
+
+    def check(name, metric, a, b, floor=0):
+        if a is None or b is None or max(a, b) < floor:
+            return
+        ratio = b / a if a > 0 else float('inf')
+        if ratio > 1 + threshold:
+            regressions.append((name, metric, a, b, ratio))
+
+    for name, new_result in new['results'].items():
+        old_result = old['results'].get(name)
+        if old_result is None or 'error' in old_result or 'error' in new_result:
+            continue
+        for stage, stats in new_result['stages'].items():
+            if stage in old_result['stages']:
+                check(name, stage + " time", old_result['stages'][stage]['median'], stats['median'], min_time)
+        check(name, "total time", old_result['total']['median'], new_result['total']['median'], min_time)
+        for stage, peak in new_result['peak_mb'].items():
+            check(name, stage + " peak MB", old_result['peak_mb'].get(stage), peak, 1)
+        for metric in ('variables', 'clauses', 'sdd_nodes', 'sdd_size'):
+            check(name, metric, old_result.get(metric), new_result.get(metric))
+    return regressions
+
+def print_report(report):
+    for name, result in report['results'].items():
+        if 'error' in result:
+            print("{:<36} error: {}".format(name, result['error']))
+            continue
+        stages = " ".join(["{} {:.3f}".format(stage, stats['median']) for stage, stats in result['stages'].items()])
+        print("{:<36} total {:.3f}s  {}".format(name, result['total']['median'], stages))
+        sizes = "variables {} clauses {}".format(result['variables'], result['clauses'])
+        if 'sdd_size' in result:
+            sizes += " sdd nodes {} size {}".format(result['sdd_nodes'], result['sdd_size'])
+        print("{:<36} {} peak rss {:.0f}MB".format("", sizes, result['peak_rss_mb']))
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="benchmark of the pipeline stages")
+    arg_parser.add_argument("models", nargs="*", default=DEFAULT_MODELS,
+        help="The bif / problog models, problog models can have evidence sets as model.pl:evidence.pl")
+    arg_parser.add_argument("--enc", "-e", nargs="+", default=[1, 2], type=int, help="The bif encodings")
+    arg_parser.add_argument("--cnf-type", "-c", nargs="+", default=["c2d", "cachet"], choices=["c2d", "cachet"],
+        help="The cnf types")
+    arg_parser.add_argument("--warmup", default=1, help="Untimed runs per configuration", type=int)
+    arg_parser.add_argument("--repetitions", "-r", default=3, help="Timed runs per configuration", type=int)
+    arg_parser.add_argument("--jobs", "-j", default=1, help="Configurations run in parallel (this disturbs the timings)", type=int)
+    arg_parser.add_argument("--output", "-o", default=DEFAULT_OUTPUT, help="The json results")
+
+    arg_parser.add_argument("--evaluator", default="pysdd", choices=["pysdd", "numpy"], help="See pipeline.py")
+    arg_parser.add_argument("--local-structure", default=0, choices=[0, 1, 2], type=int, help="See pipeline.py")
+    arg_parser.add_argument("--preprocess", default=False, action="store_true", help="See pipeline.py")
+    arg_parser.add_argument("--compiler", default="minic2d", choices=["minic2d", "apply"], help="See pipeline.py")
+    arg_parser.add_argument("--network-vtree", choices=["balanced", "right"], help="See pipeline.py (bif models only)")
+
+    arg_parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+        help="Compare two result files instead of running, exits with 1 if there are regressions")
+    arg_parser.add_argument("--threshold", default=0.1, help="Relative increase that counts as a regression", type=float)
+
+    args = arg_parser.parse_args()
+
+    if args.compare is not None:
+        old, new = load_json(args.compare[0]), load_json(args.compare[1])
+        if not old or not new:
+            print("missing result file")
+            return -1
+        regressions = compare(old, new, args.threshold)
+        for name, metric, a, b, ratio in regressions:
+            print("{:<36} {:<20} {:.4g} -> {:.4g} ({:+.0f}%)".format(name, metric, a, b, (ratio - 1) * 100))
+        print("regressions:", len(regressions))
+        return 1 if regressions else 0
+
+    # the vtree report and cache would make the results depend on earlier runs
+    options = {
+        'evaluator': args.evaluator,
+        'local_structure': args.local_structure,
+        'preprocess': args.preprocess,
+        'compiler': args.compiler,
+        'network_vtree': args.network_vtree,
+        'vtree_report': None
+    }
+    configs = configurations(args.models, args.enc, args.cnf_type)
+    report = run_suite(configs, options, args.warmup, args.repetitions, args.jobs)
+    save_json(args.output, report)
+
+    print_report(report)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
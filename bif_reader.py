@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+
+import re
+import sys
+import time
+
+import numpy as np
+
+from deps.bif_parser.Node import Node
+
+# comments are removed before tokenizing
+COMMENT_RE = re.compile(r'//[^\n]*|/\*.*?\*/', re.S)
+
+# whole property statements, quoted strings, punctuation and words
+TOKEN_RE = re.compile(r'property\b(?:"[^"]*"|[^;"])*;|"[^"]*"|[{}\[\]();,|]|[^\s{}\[\]();,|"]+')
+
+class BIFError(Exception):
+    pass
+
+def tokenize(contents):
+    """ Returns the list of tokens of the bif contents """
+    return TOKEN_RE.findall(COMMENT_RE.sub(" ", contents))
+
+class BIFReader:
+    """
+        Single pass bif reader, the contents are tokenized once and
+        the nodes are looked up by name in a dict.
+        Builds the same Node graph (parents, children, dist) as BIFParser.parseBIF
+        with the cpts stored as arrays (see Node.setCPT),
+        newlines and whitespace carry no meaning so tables may span multiple lines.
+    """
+
+    def __init__(self, contents):
+        self.tokens = tokenize(contents)
+        self.pos = 0
+        self.nodes = []
+        self.by_name = {}
+        self.name = None
+
+    def next(self):
+        if self.pos >= len(self.tokens):
+            raise BIFError("unexpected end of bif file")
+        tok = self.tokens[self.pos]
+        self.pos += 1
+        return tok
+
+    def expect(self, expected):
+        tok = self.next()
+        if tok != expected:
+            raise BIFError("expected '{}' but got '{}'".format(expected, tok))
+
+    def until(self, stop):
+        """ Returns the tokens up to stop (skipping commas), stop is consumed """
+        try:
+            end = self.tokens.index(stop, self.pos)
+        except ValueError:
+            raise BIFError("unexpected end of bif file")
+        toks = [tok for tok in self.tokens[self.pos:end] if tok != ","]
+        self.pos = end + 1
+        return toks
+
+    def skip_block(self):
+        """ Skips a {} block of which the opening brace has been read """
+        depth = 1
+        while depth > 0:
+            tok = self.next()
+            if tok == "{":
+                depth += 1
+            elif tok == "}":
+                depth -= 1
+
+    def read(self):
+        """ Returns the list of nodes in declaration order """
+        while self.pos < len(self.tokens):
+            tok = self.next()
+            if tok == "network":
+                self.name = self.next()
+                self.expect("{")
+                self.skip_block()
+            elif tok == "variable":
+                self.read_variable()
+            elif tok == "probability":
+                self.read_probability()
+            else:
+                raise BIFError("unexpected token '{}'".format(tok))
+        return self.nodes
+
+    def read_variable(self):
+        name = self.next()
+        self.expect("{")
+        the_type = None
+        num_states = 0
+        states = ()
+        prop = ""
+        tok = self.next()
+        while tok != "}":
+            if tok == "type":
+                the_type = self.next()
+                self.expect("[")
+                num_states = int(self.next())
+                self.expect("]")
+                self.expect("{")
+                states = tuple(self.until("}"))
+                self.expect(";")
+                if len(states) != num_states:
+                    raise BIFError("variable {} declares {} states but lists {}".format(
+                        name, num_states, len(states)))
+            elif tok.startswith("property"):
+                # the property is kept as text, with normalized whitespace
+                prop = " ".join(tok[len("property"):].split())
+            else:
+                raise BIFError("unexpected token '{}' in variable {}".format(tok, name))
+            tok = self.next()
+
+        if name in self.by_name:
+            raise BIFError("duplicate variable " + name)
+        node = Node(name, the_type, num_states, states, prop)
+        self.nodes.append(node)
+        self.by_name[name] = node
+
+    def lookup(self, name):
+        node = self.by_name.get(name)
+        if node is None:
+            raise BIFError("unknown variable " + name)
+        return node
+
+    def read_probability(self):
+        self.expect("(")
+        names = self.until(")")
+        node = self.lookup(names[0])
+        parents = []
+        if len(names) > 1:
+            if names[1] != "|":
+                raise BIFError("expected '|' in probability of " + names[0])
+            parents = [self.lookup(n) for n in names[2:]]
+        for parent in parents:
+            node.addParent([parent])
+            parent.addChildren([node])
+
+        # the cpt is filled in directly, shaped (parent cardinalities..., own cardinality)
+        shape = node.cptShape()
+        cpt = np.full(shape, np.nan)
+        default = None
+        self.expect("{")
+        tok = self.next()
+        while tok != "}":
+            if tok == "table":
+                values = [float(v) for v in self.until(";")]
+                if len(values) != cpt.size:
+                    raise BIFError("wrong table size for " + node.getName())
+                # the node is the slowest changing variable of the table
+                cpt[...] = np.moveaxis(np.reshape(values, shape[-1:] + shape[:-1]), 0, -1)
+            elif tok == "default":
+                default = [float(v) for v in self.until(";")]
+            elif tok == "(":
+                row = self.until(")")
+                values = [float(v) for v in self.until(";")]
+                if len(row) != len(parents) or len(values) != shape[-1]:
+                    raise BIFError("wrong table row size for " + node.getName())
+                try:
+                    index = tuple([parent.stateIndex[s] for parent, s in zip(parents, row)])
+                except KeyError as e:
+                    raise BIFError("unknown state {} in probability of {}".format(e, node.getName()))
+                cpt[index] = values
+            else:
+                raise BIFError("unexpected token '{}' in probability of {}".format(tok, node.getName()))
+            tok = self.next()
+
+        missing = np.isnan(cpt[..., 0])
+        if default is not None:
+            cpt[missing] = default
+        elif missing.any():
+            raise BIFError("incomplete probability table for " + node.getName())
+        node.setCPT(cpt)
+
+def read_bif(contents):
+    """ Parses the bif contents and returns the list of nodes """
+    return BIFReader(contents).read()
+
+def main():
+    with open(sys.argv[1], "r") as f:
+        contents = f.read()
+    start = time.time()
+    nodes = read_bif(contents)
+    print("nodes:", len(nodes))
+    print("edges:", sum([n.numParents() for n in nodes]))
+    print("time: {:.3f}s".format(time.time() - start))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
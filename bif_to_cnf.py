@@ -5,8 +5,11 @@ import argparse
 import itertools
 
 import sympy
+import numpy as np
 
-from deps.bif_parser import BIFParser as BIFP
+from bif_reader import read_bif
+from symbols import SymbolTable
+from profiling import span
 
 from sympy.logic.boolalg import Not, And, Or, Equivalent, Implies, to_cnf
 
@@ -26,27 +29,37 @@ def get_combinations(list_of_lists):
     """
     return itertools.product(*list_of_lists)
 
+def var_name(node, state):
+    """
+        Returns the name of the variable representing that the given node is in the given state
+    """
+    if LATEX_NAMES:
+        return "\\lambda_{" + node.getName() + "\\_" + state  + "}"
+    return node.getName() + '_' + state
+
+def conditional_var_name(node, state, conds, parents):
+    """
+        Returns the name of the conditional probability variable of the node in the given state
+        assumings all conds states of parents
+    """
+    if LATEX_NAMES:
+        cond_names = ",".join([b.getName() + "\\_" + a for a, b in zip(conds, parents)])
+        return "\\theta_{" + node.getName() + "\\_" + state + "|" + cond_names+ "}"
+    return node.getName() + "_" + state + "|" + "_".join(conds)
+
 def create_var(node, state):
     """
         Creates a variable representing that the given node is in the given state
     """
-    if LATEX_NAMES:
-        var_name = "\\lambda_{" + node.getName() + "\\_" + state  + "}"
-    else:
-        var_name = node.getName() + '_' + state
-    return (sympy.Symbol(var_name), node.getName(), state)
+    return (sympy.Symbol(var_name(node, state)), node.getName(), state)
 
 def create_conditional_var(node, state, conds, parents):
     """
         Creates a conditional probability variable of the node in the given state
         assumings all conds states of parents
     """
-    if LATEX_NAMES:
-        cond_names = ",".join([b.getName() + "\\_" + a for a, b in zip(conds, parents)])
-        var_name = "\\theta_{" + node.getName() + "\\_" + state + "|" + cond_names+ "}"
-    else:
-        var_name = node.getName() + "_" + state + "|" + "_".join(conds)
-    return (sympy.Symbol(var_name), node.getName(), state, tuple(conds))
+    name = conditional_var_name(node, state, conds, parents)
+    return (sympy.Symbol(name), node.getName(), state, tuple(conds))
 
 def get_state_vars(node):
     """ Creates all state variables of the given node """
@@ -61,37 +74,104 @@ def get_all_cond_vars(node):
     pairs = get_combinations(cond_list)
     return [create_conditional_var(node, p[0], p[1:], parents) for p in pairs]
 
-def create_variables(nodes, enc1):
-    """ creates required all variables """
+def parameter_variables(node, enc1):
+    """ Returns the names of the parameter variables of the node (ENC 2: all states but the last) """
+    states = node.getStates()
+    parents = node.getParents()
+    # per state and state of each parent -> one variable
+    if enc1:
+        cond_list = [states]
+    else:
+        cond_list = [states[:-1]]
+
+    for parent in parents:
+        cond_list.append(parent.getStates())
+
+    pairs = get_combinations(cond_list)
+    return [conditional_var_name(node, p[0], p[1:], parents) for p in pairs]
+
+def create_variables(nodes, enc1, local_structure=False):
+    """
+        creates required all variables and the weights of the parameter variables,
+        with local_structure set the parameter variables are those of local_parameters.
+        Also returns the parameters per node name as (name, weight, cells), see local_parameters
+    """
     variables = []
     queries = []
+    weights = {}
+    params = {}
     for node in nodes:
         states = node.getStates()
 
         # each state gets one variable
-        svars = get_state_vars(node)
+        svars = [var_name(node, s) for s in states]
 
-        parents = node.getParents()
-        # per state and state of each parent -> one variable
-        if enc1:
-            cond_list = [states]
+        if local_structure:
+            params[node.getName()] = local_parameters(node, enc1)
+            pvars = [name for name, _, _ in params[node.getName()]]
+            weights.update([(name, weight) for name, weight, _ in params[node.getName()]])
         else:
-            cond_list = [states[:-1]]
+            pvars = parameter_variables(node, enc1)
+            # the parameter weights are in the same order as the variables
+            pweights = assign_weights_enc1(node) if enc1 else assign_weights_enc2(node)
+            weights.update(zip(pvars, pweights.tolist()))
 
-        for parent in parents:
-            cond_list.append(parent.getStates())
-
-        pairs = get_combinations(cond_list)
-        pvars = [create_conditional_var(node, p[0], p[1:], parents) for p in pairs]
-
-        for v in svars:
-            queries.append(v[0].name)
+        queries += svars
 
         # add all variables
-        for v in svars + pvars:
-            variables.append(v[0].name)
+        variables += svars + pvars
+
+    return variables, queries, weights, params
 
-    return variables, queries
+def local_parameters(node, enc1):
+    """
+        Returns the parameter variables of the node for the local structure encodings
+        as a list of (name, weight, cells), cells are the (row, state index) entries of the
+        (ENC 2: chance) weights the variable stands for, the rows are the parent instantiations
+        in product order. Weights 0 and 1 get no variable, they become hard clauses.
+        ENC 1 merges the equal weights of a row: the states are exclusive, so one variable
+        implied by any of these states has the weight of the one that holds.
+        ENC 2 shares a chance variable between rows: only the chance variables of the row
+        of the parent instantiation are constrained and the weights of the others sum to 1.
+        The chance variables of one row stay distinct.
+    """
+    states = node.getStates()
+    parents = node.getParents()
+    conds = list(get_combinations([p.getStates() for p in parents]))
+    if enc1:
+        table = node.getCPT().reshape(len(conds), len(states))
+    else:
+        table = enc2_chance_weights(node.getCPT()).reshape(len(conds), len(states))[:, :-1]
+
+    params = []
+    index = {}
+    for r, row in enumerate(table.tolist()):
+        seen = {}
+        for i, weight in enumerate(row):
+            if weight == 0 or weight == 1:
+                continue
+            if enc1:
+                key = (r, weight)
+            else:
+                # the n-th occurrence of a weight in a row
+                seen[weight] = seen.get(weight, -1) + 1
+                key = (weight, seen[weight])
+            if key not in index:
+                index[key] = len(params)
+                params.append((weight, []))
+            params[index[key]][1].append((r, i))
+
+    named = []
+    for k, (weight, cells) in enumerate(params):
+        r, i = cells[0]
+        if len(cells) == 1:
+            name = conditional_var_name(node, states[i], conds[r], parents)
+        elif enc1:
+            name = node.getName() + "_" + "=".join([states[j] for _, j in cells]) + "|" + "_".join(conds[r])
+        else:
+            name = node.getName() + "|q" + str(k)
+        named.append((name, weight, cells))
+    return named
 
 def create_indicator_cnf(node):
     """ Creates the indicator clauses """
@@ -115,25 +195,26 @@ def toEnc1(nodes):
     cnf = []
 
     for node in nodes:
-        cnf += create_indicator_cnf(node)
+        with span("node", node=node.getName()):
+            cnf += create_indicator_cnf(node)
 
-        parents = node.getParents()
+            parents = node.getParents()
 
-        cond_list = [node.getStates()]
-        for parent in parents:
-            cond_list.append(parent.getStates())
-        pairs = get_combinations(cond_list)
+            cond_list = [node.getStates()]
+            for parent in parents:
+                cond_list.append(parent.getStates())
+            pairs = get_combinations(cond_list)
 
-        nodes = [node] + parents
+            nodes = [node] + parents
 
-        # create parameter clauses
-        for pair in pairs:
-            par_var = create_conditional_var(node, pair[0], pair[1:], parents)
+            # create parameter clauses
+            for pair in pairs:
+                par_var = create_conditional_var(node, pair[0], pair[1:], parents)
 
-            rl = par_var[0]
-            ll = And(*[create_var(nodes[i], s)[0] for i, s in enumerate(pair)])
+                rl = par_var[0]
+                ll = And(*[create_var(nodes[i], s)[0] for i, s in enumerate(pair)])
 
-            cnf.append(Equivalent(ll, rl))
+                cnf.append(Equivalent(ll, rl))
     return And(*cnf)
 
 
@@ -141,73 +222,244 @@ def toEnc2(nodes):
     """ Creates the ENC 2 encoding of the given nodes """
     cnf = []
     for node in nodes:
-        states = node.getStates()
+        with span("node", node=node.getName()):
+            states = node.getStates()
 
-        cnf += create_indicator_cnf(node)
+            cnf += create_indicator_cnf(node)
+
+            cond_list = [states]
+            parents = node.getParents()
+            for parent in parents:
+                cond_list.append(parent.getStates())
+            pairs = itertools.product(*cond_list)
+
+            nodes = [node] + parents
+
+            for pair in pairs:
+                # pair[0] is the state of the node
+                # pair[1:] are the state of all conditionals
+                ll = [create_var(nodes[i+1], s)[0] for i, s in enumerate(pair[1:])]
+                ll += [~(create_conditional_var(node, s, pair[1:], parents)[0]) for s in states[:states.index(pair[0])]]
+                if pair[0] != states[-1]:
+                    ll += [create_conditional_var(node, pair[0], pair[1:], parents)[0]]
+
+                ll = And(*ll)
+
+                rl = create_var(node, pair[0])[0]
+                #print(ll, '=>', rl)
+                cnf.append(Implies(ll, rl))
+
+    return And(*cnf)
+
+def create_indicator_clauses(node, ids):
+    """ Creates the indicator clauses as lists of integer literals """
+    svars = [ids[var_name(node, s)] for s in node.getStates()]
+    # the disjunction of all states:
+    clauses = [svars]
+
+    # negation:
+    l = len(svars)
+    for j in range(l):
+        for i in range(j):
+            clauses.append([-svars[j], -svars[i]])
+    return clauses
+
+def enc1_clauses(nodes, ids):
+    """
+        Creates the ENC 1 clauses of the given nodes directly as lists of integer literals,
+        ids maps variable names to their DIMACS id
+    """
+    clauses = []
+    for node in nodes:
+        clauses += create_indicator_clauses(node, ids)
 
-        cond_list = [states]
         parents = node.getParents()
+
+        cond_list = [node.getStates()]
         for parent in parents:
             cond_list.append(parent.getStates())
-        pairs = itertools.product(*cond_list)
+        pairs = get_combinations(cond_list)
 
-        nodes = [node] + parents
+        family = [node] + parents
 
+        # parameter clauses: lambda_1 & ... & lambda_n <=> theta
         for pair in pairs:
-            # pair[0] is the state of the node
-            # pair[1:] are the state of all conditionals
-            ll = [create_var(nodes[i+1], s)[0] for i, s in enumerate(pair[1:])]
-            ll += [~(create_conditional_var(node, s, pair[1:], parents)[0]) for s in states[:states.index(pair[0])]]
-            if pair[0] != states[-1]:
-                ll += [create_conditional_var(node, pair[0], pair[1:], parents)[0]]
+            par = ids[conditional_var_name(node, pair[0], pair[1:], parents)]
+            lits = [ids[var_name(family[i], s)] for i, s in enumerate(pair)]
 
-            ll = And(*ll)
+            clauses.append([-l for l in lits] + [par])
+            for l in lits:
+                clauses.append([l, -par])
+    return clauses
 
-            rl = create_var(node, pair[0])[0]
-            #print(ll, '=>', rl)
-            cnf.append(Implies(ll, rl))
+def enc2_clauses(nodes, ids):
+    """
+        Creates the ENC 2 clauses of the given nodes directly as lists of integer literals,
+        ids maps variable names to their DIMACS id
+    """
+    clauses = []
+    for node in nodes:
+        states = node.getStates()
 
-    return And(*cnf)
+        clauses += create_indicator_clauses(node, ids)
 
-def assign_weights_enc1(nodes):
-    weights = {}
-    for node in nodes:
-        cpd = node.getDist()
-        cvars = get_all_cond_vars(node)
+        cond_list = [states]
+        parents = node.getParents()
+        for parent in parents:
+            cond_list.append(parent.getStates())
+        pairs = get_combinations(cond_list)
 
-        for cvar in cvars:
-            # cpd[state_of_node + state_of_conditionals]
-            prob = cpd[(cvar[2],) + cvar[3]]
-            weights[cvar[0].name] = prob
-    return weights
+        # lambda_u & ~theta_1 & ... & ~theta_{i-1} & theta_i => lambda_i
+        for pair in pairs:
+            conds = pair[1:]
+            clause = [-ids[var_name(parents[i], s)] for i, s in enumerate(conds)]
+            clause += [ids[conditional_var_name(node, s, conds, parents)] for s in states[:states.index(pair[0])]]
+            if pair[0] != states[-1]:
+                clause.append(-ids[conditional_var_name(node, pair[0], conds, parents)])
+            clause.append(ids[var_name(node, pair[0])])
+            clauses.append(clause)
+    return clauses
 
-def assign_weights_enc2(nodes):
-    weights = {}
+def merge_clauses(clauses, cards):
+    """
+        Merges the clauses of one cpt in the local structure style. A clause is (conds, rest):
+        conds is a sorted tuple of (family position, state index) of negated indicators and
+        rest a tuple of other literals. Clauses that only differ in the state of one position
+        and together cover all its states are replaced by the clause without that position,
+        as every variable is in exactly one state. Clauses subsumed by a merged clause are removed.
+    """
+    clauses = set(clauses)
+    changed = True
+    while changed:
+        changed = False
+        for pos, card in enumerate(cards):
+            groups = {}
+            for clause in clauses:
+                conds, rest = clause
+                for j, (p, _) in enumerate(conds):
+                    if p == pos:
+                        groups.setdefault((conds[:j] + conds[j+1:], rest), []).append(clause)
+            merged = [key for key, group in groups.items() if len(group) == card]
+            for key in merged:
+                clauses.difference_update(groups[key])
+            for conds, rest in merged:
+                subset = set(conds)
+                clauses = set([c for c in clauses if c[1] != rest or not subset.issubset(c[0])])
+                clauses.add((conds, rest))
+                changed = True
+    return sorted(clauses)
+
+def local_clauses(clauses, family, ind, simplify):
+    """ Returns the (conds, rest) clauses as lists of integer literals, merged if simplify is set """
+    if simplify:
+        clauses = merge_clauses(clauses, [len(v.getStates()) for v in family])
+    return [[-ind[j][s] for j, s in conds] + list(rest) for conds, rest in clauses]
+
+def enc1_local_clauses(nodes, ids, params, simplify=False):
+    """
+        Creates the ENC 1 clauses with the parameters of local_parameters:
+        lambda_u & (lambda_i | lambda_j ...) <=> theta for merged parameters,
+        ~(lambda_u & lambda_i) for zero parameters and nothing for parameters 1.
+        With simplify set the zero clauses are merged (see merge_clauses)
+    """
+    clauses = []
+    for node in nodes:
+        clauses += create_indicator_clauses(node, ids)
+
+        parents = node.getParents()
+        family = parents + [node]
+        ind = [[ids[var_name(v, s)] for s in v.getStates()] for v in family]
+        own = ind[-1]
+        rows = list(get_combinations([range(len(p.getStates())) for p in parents]))
+
+        for name, _, cells in params[node.getName()]:
+            par = ids[name]
+            lits = [ind[j][s] for j, s in enumerate(rows[cells[0][0]])]
+            for _, i in cells:
+                clauses.append([-l for l in lits] + [-own[i], par])
+            for l in lits:
+                clauses.append([l, -par])
+            clauses.append([own[i] for _, i in cells] + [-par])
+
+        cpt = node.getCPT().reshape(len(rows), len(own))
+        zeros = [(tuple(enumerate(rows[r] + (i,))), ()) for r, i in np.argwhere(cpt == 0).tolist()]
+        clauses += local_clauses(zeros, family, ind, simplify)
+    return clauses
+
+def enc2_local_clauses(nodes, ids, params, simplify=False):
+    """
+        Creates the ENC 2 clauses with the (shared) chance variables of local_parameters,
+        chance variables with weight 0 or 1 are replaced by false or true.
+        With simplify set the clauses of the rows are merged (see merge_clauses)
+    """
+    clauses = []
     for node in nodes:
         states = node.getStates()
-        cpd = node.getDist()
-        cvars = get_all_cond_vars(node)
-
-        for cvar in cvars:
-            prob = cpd[(cvar[2],) + cvar[3]]
-            # index of state
-            idx = states.index(cvar[2])
-            divisor = 1
-            for i in range(idx):
-                divisor -= cpd[(states[i],) + cvar[3]]
-            # TODO: 0 or 1 if divisor == 0
-            weights[cvar[0].name] = prob / divisor if divisor > 0 else 0
+        clauses += create_indicator_clauses(node, ids)
+
+        parents = node.getParents()
+        ind = [[ids[var_name(v, s)] for s in v.getStates()] for v in parents]
+        own = [ids[var_name(node, s)] for s in states]
+        rows = list(get_combinations([range(len(p.getStates())) for p in parents]))
+        weights = enc2_chance_weights(node.getCPT()).reshape(len(rows), len(states)).tolist()
+
+        chance = {}
+        for name, _, cells in params[node.getName()]:
+            for cell in cells:
+                chance[cell] = ids[name]
+
+        # lambda_u & ~theta_1 & ... & ~theta_{i-1} & theta_i => lambda_i
+        rules = []
+        for r, row in enumerate(rows):
+            for i in range(len(states)):
+                earlier = [j for j in range(i) if weights[r][j] != 0]
+                if any([weights[r][j] == 1 for j in earlier]):
+                    continue
+                rest = [chance[(r, j)] for j in earlier]
+                if i < len(states) - 1:
+                    if weights[r][i] == 0:
+                        continue
+                    if weights[r][i] != 1:
+                        rest.append(-chance[(r, i)])
+                rest.append(own[i])
+                rules.append((tuple(enumerate(row)), tuple(rest)))
+        clauses += local_clauses(rules, parents, ind, simplify)
+    return clauses
+
+def assign_weights_enc1(node):
+    """
+        Returns the weights of the ENC 1 parameter variables of the node in variable order
+        (the state of the node changes slowest), these are the cpt entries
+    """
+    return np.moveaxis(node.getCPT(), -1, 0).ravel()
+
+def enc2_chance_weights(cpt):
+    """
+        Returns the ENC 2 weights shaped like the cpt, the weight of state i is
+        P(i | u) / (1 - P(1 | u) - ... - P(i-1 | u)) or 0 if the divisor is 0, the last state has none
+    """
+    weights = np.zeros(cpt.shape)
+    divisor = np.ones(cpt.shape[:-1])
+    for i in range(cpt.shape[-1] - 1):
+        # TODO: 0 or 1 if divisor == 0
+        np.divide(cpt[..., i], divisor, out=weights[..., i], where=divisor > 0)
+        divisor = divisor - cpt[..., i]
     return weights
 
-def weights_to_dict(weights, variables, enc1):
-    ws = {}
+def assign_weights_enc2(node):
+    """ Returns the weights of the ENC 2 parameter variables of the node in variable order """
+    return np.moveaxis(enc2_chance_weights(node.getCPT())[..., :-1], -1, 0).ravel()
+
+def create_symbol_table(variables, weights, enc1):
+    """ Creates the symbol table of all variables with their (positive, negative) weights """
+    symbols = SymbolTable()
     for var in variables:
         if var in weights:
             weight = weights[var]
-            ws[var] = (weight, 1 if enc1 else (1 - weight))
+            symbols.add(var, (weight, 1 if enc1 else (1 - weight)))
         else:
-            ws[var] = (1, 1)
-    return ws
+            symbols.add(var)
+    return symbols
 
 
 def latex_print(s):
@@ -224,16 +476,17 @@ def latex_print(s):
     else:
         return s.name
 
-def parse_bif(contents, enc1, verbose):
-    nodes = None
-
-    bif_w = contents.splitlines()
-    bif = BIFP.fixWhiteSpace(bif_w)
-    nodes = BIFP.parseBIF(bif)
-
-    if nodes is None:
-        print("error parsing bif")
-        return -1
+def parse_bif(contents, enc1, verbose, direct=False, local_structure=0):
+    """
+        Parses the bif contents and encodes it as cnf,
+        if direct is set the clauses are returned as lists of integer literals
+        instead of a sympy cnf expression.
+        local_structure 1 drops the parameters 0 and 1 and merges equal parameters
+        (see local_parameters), 2 also merges the clauses (see merge_clauses),
+        the local structure encodings are always direct
+    """
+    with span("read bif"):
+        nodes = read_bif(contents)
 
     if verbose:
         print(">bif info:")
@@ -242,15 +495,37 @@ def parse_bif(contents, enc1, verbose):
 
     # create variables
     # map from name to int
-    variables, queries = create_variables(nodes, enc1)
+    variables, queries, weights, params = create_variables(nodes, enc1, local_structure > 0)
 
     if verbose:
         print("variables:")
         for v in variables:
             print(v)
 
+    symbols = create_symbol_table(variables, weights, enc1)
+
+    if local_structure > 0:
+        simplify = local_structure > 1
+        with span("local clauses"):
+            if enc1:
+                ints = enc1_local_clauses(nodes, symbols, params, simplify)
+            else:
+                ints = enc2_local_clauses(nodes, symbols, params, simplify)
+    elif direct:
+        with span("clauses"):
+            ints = enc1_clauses(nodes, symbols) if enc1 else enc2_clauses(nodes, symbols)
+
+    if direct or local_structure > 0:
+        if verbose:
+            print("cnf:")
+            for clause in ints:
+                print(clause)
+
+        return symbols, ints, queries
+
     # create cnf
-    cnf = toEnc1(nodes) if enc1 else toEnc2(nodes)
+    with span("toEnc1" if enc1 else "toEnc2"):
+        cnf = toEnc1(nodes) if enc1 else toEnc2(nodes)
 
     if verbose:
         print("enc:")
@@ -264,20 +539,17 @@ def parse_bif(contents, enc1, verbose):
             print(p)
             print()
 
-    cnf = to_cnf(cnf)
+    with span("to_cnf"):
+        cnf = to_cnf(cnf)
 
     if verbose:
         print("cnf:")
         print(cnf)
 
-    # assign weights
-    weights = assign_weights_enc1(nodes) if enc1 else assign_weights_enc2(nodes)
-    weights = weights_to_dict(weights, variables, enc1)
-
 #    if verbose:
 #        print("weights:")
 #        keys = weights.keys()
 #        for key in keys:
 #            print("$ " + key + " $ & " + str(weights[key][0])  + "&" + str(weights[key][1]) + " \\\\")
 
-    return variables, cnf, weights, queries
\ No newline at end of file
+    return symbols, cnf, queries
\ No newline at end of file
@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+
+import sys
+import time
+import argparse
+
+from bif_reader import read_bif
+from bif_to_cnf import parse_bif, var_name, parameter_variables, local_parameters
+from ve import cpt_factors, moral_graph, min_fill_order
+
+# balanced: the dtree of the elimination order, right: right-linear in the same variable order
+VTREE_SHAPES = ("balanced", "right")
+
+ELIMINATION_HEURISTICS = ("min-fill", "min-degree")
+
+def family_variables(nodes, enc1, local_structure=False):
+    """ Returns per node (names of its indicator variables, names of its parameter variables) """
+    families = []
+    for node in nodes:
+        indicators = [var_name(node, s) for s in node.getStates()]
+        if local_structure:
+            parameters = [name for name, _, _ in local_parameters(node, enc1)]
+        else:
+            parameters = parameter_variables(node, enc1)
+        families.append((indicators, parameters))
+    return families
+
+def elimination_order(nodes, heuristic="min-fill"):
+    """ Returns the node indices in greedy elimination order of the moral graph of the network """
+    index = dict((node.getName(), i) for i, node in enumerate(nodes))
+    cards = [len(node.getStates()) for node in nodes]
+    adj = moral_graph(cpt_factors(nodes, index), len(nodes))
+    return min_fill_order(adj, cards, min_degree=heuristic == "min-degree")
+
+def balanced_tree(items):
+    """ Returns the items as a balanced binary tree of nested pairs """
+    if len(items) == 1:
+        return items[0]
+    half = len(items) // 2
+    return (balanced_tree(items[:half]), balanced_tree(items[half:]))
+
+def right_linear_tree(items):
+    """ Returns the items as a right-linear binary tree of nested pairs """
+    tree = items[-1]
+    for item in reversed(items[:-1]):
+        tree = (item, tree)
+    return tree
+
+def dtree(nodes, order):
+    """
+        Returns a dtree of the network along the elimination order as nested pairs, the leaves
+        are ('parameters', node index) and ('indicators', node index). Every tree starts as the cpt
+        of one node, eliminating a node joins the trees that contain it (balanced) and puts its
+        indicators on the left, so they are decided before the cpts that mention them
+    """
+    index = dict((node.getName(), i) for i, node in enumerate(nodes))
+    trees = [(('parameters', i), set([i] + [index[p.getName()] for p in node.getParents()]))
+        for i, node in enumerate(nodes)]
+    for v in order:
+        joined = [tree for tree in trees if v in tree[1]]
+        trees = [tree for tree in trees if v not in tree[1]]
+        variables = set().union(*[tree[1] for tree in joined]) - {v}
+        trees.append(((('indicators', v), balanced_tree([tree for tree, _ in joined])), variables))
+    return balanced_tree([tree for tree, _ in trees])
+
+def variable_order(tree):
+    """ Returns the leaves of a tree of nested pairs from left to right """
+    order = []
+    todo = [tree]
+    while todo:
+        tree = todo.pop()
+        if type(tree) is tuple:
+            todo.append(tree[1])
+            todo.append(tree[0])
+        else:
+            order.append(tree)
+    return order
+
+def network_vtree(nodes, symbols, enc1, local_structure=False, shape="balanced", heuristic="min-fill"):
+    """
+        Returns a vtree over the variables of the symbol table as nested pairs of variable ids.
+        balanced is the dtree of the elimination order of the moral graph (see dtree) with the
+        indicators of a node as a right-linear subtree and the parameters of its cpt as a balanced one,
+        right is the right-linear vtree of the variables in the same order. Variables that aren't
+        in the symbol table (removed by preprocessing) are skipped, variables of the symbol table
+        that aren't in the network are added at the end
+    """
+    subtrees = {}
+    seen = set()
+    for i, (indicators, parameters) in enumerate(family_variables(nodes, enc1, local_structure)):
+        for kind, names, make_tree in (('indicators', indicators, right_linear_tree),
+                ('parameters', parameters, balanced_tree)):
+            ids = [symbols.id(name) for name in names if name in symbols]
+            seen.update(ids)
+            if ids:
+                subtrees[(kind, i)] = make_tree(ids)
+    rest = [idx for idx in range(1, len(symbols) + 1) if idx not in seen]
+
+    def replace(tree):
+        """ Replaces the dtree leaves by their subtrees, pairs with an empty side become the other side """
+        # post order: (tree, whether its children are replaced), the replaced subtrees are on results
+        todo = [(tree, False)]
+        results = []
+        while todo:
+            tree, expanded = todo.pop()
+            if type(tree[0]) is str:
+                results.append(subtrees.get(tree))
+            elif not expanded:
+                todo.append((tree, True))
+                todo.append((tree[1], False))
+                todo.append((tree[0], False))
+            else:
+                right = results.pop()
+                left = results.pop()
+                if left is None or right is None:
+                    results.append(left if right is None else right)
+                else:
+                    results.append((left, right))
+        return results[0]
+
+    tree = replace(dtree(nodes, elimination_order(nodes, heuristic)))
+    if rest:
+        tree = (tree, right_linear_tree(rest)) if tree is not None else right_linear_tree(rest)
+    if shape == "right":
+        tree = right_linear_tree(variable_order(tree))
+    return tree
+
+def vtree_lines(tree):
+    """
+        Returns the lines of the vtree file (the format of Vtree.from_file) of a tree of nested pairs
+        of variable ids. The vtree node ids are the in-order positions, children come before parents
+    """
+    lines = []
+    count = 0
+    # post order: (tree, position of the node or None if its left subtree isn't visited yet)
+    todo = [(tree, None)]
+    ids = []
+    while todo:
+        tree, position = todo.pop()
+        if type(tree) is not tuple:
+            lines.append("L {} {}".format(count, tree))
+            ids.append(count)
+            count += 1
+        elif position is None:
+            todo.append((tree, -1))
+            todo.append((tree[0], None))
+        elif position == -1:
+            todo.append((tree, count))
+            count += 1
+            todo.append((tree[1], None))
+        else:
+            right = ids.pop()
+            left = ids.pop()
+            lines.append("I {} {} {}".format(position, left, right))
+            ids.append(position)
+    return ["c vtree of bif_vtree.py", "vtree {}".format(count)] + lines
+
+def save_vtree(fname, tree):
+    with open(fname, "w") as f:
+        f.write("\n".join(vtree_lines(tree)) + "\n")
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="vtree of the cnf of a bif network from its elimination order")
+    arg_parser.add_argument("bif_file", help="The bif network")
+    arg_parser.add_argument("vtree_file", help="The output vtree file")
+    arg_parser.add_argument("--enc", "-e", default=1, choices=[1, 2], type=int, help="The enc type 1 or 2")
+    arg_parser.add_argument("--shape", default="balanced", choices=list(VTREE_SHAPES),
+        help="The dtree of the elimination order (balanced) or right-linear in that order (right)")
+    arg_parser.add_argument("--elimination", default="min-fill", choices=list(ELIMINATION_HEURISTICS),
+        help="The elimination order heuristic on the moral graph")
+    arg_parser.add_argument("--local-structure", default=0, choices=[0, 1, 2], type=int,
+        help="The local structure level of the cnf (see pipeline.py)")
+    args = arg_parser.parse_args()
+
+    with open(args.bif_file, "r") as f:
+        contents = f.read()
+    enc1 = args.enc == 1
+    start = time.time()
+    nodes = read_bif(contents)
+    symbols, _, _ = parse_bif(contents, enc1, False, True, args.local_structure)
+    save_vtree(args.vtree_file, network_vtree(nodes, symbols, enc1, args.local_structure > 0,
+        args.shape, args.elimination))
+    print("variables:", len(symbols))
+    print("time: {:.3f}s".format(time.time() - start))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+#!/usr/bin/python3
+
+import sys
+import time
+
+import numpy as np
+
+from bif_reader import read_bif
+from ve import BayesNet
+
+def normalize(msgs):
+    """ Normalizes the messages over the last axis, all zero messages stay zero """
+    total = msgs.sum(axis=-1, keepdims=True)
+    return np.divide(msgs, total, out=np.zeros(msgs.shape), where=total > 0)
+
+class LoopyBP(BayesNet):
+    """
+        Loopy belief propagation on the factor graph of the cpts with a flooding schedule.
+        Every edge between a cpt and one of its variables has a message in both directions,
+        all messages are kept in arrays of shape (edges, batch, max cardinality),
+        the states past the cardinality of a variable are zero.
+        Cpts with the same shape are stacked, so every iteration is one einsum per
+        cpt shape and variable position for all of these cpts and all evidence sets at once.
+        Evidence is clamped as a likelihood vector on the variable.
+    """
+
+    def __init__(self, nodes, damping=0.0, tolerance=1e-6, max_iterations=100):
+        BayesNet.__init__(self, nodes)
+        self.damping = damping
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+
+        n = len(nodes)
+        self.max_card = max(self.cards) if n > 0 else 1
+        self.mask = np.zeros((n, self.max_card))
+        for v, card in enumerate(self.cards):
+            self.mask[v, :card] = 1
+
+        # edges are numbered per cpt, groups are (stacked cpts, edge ids per position)
+        edge_var = []
+        groups = {}
+        for variables, table in self.factors:
+            edges = list(range(len(edge_var), len(edge_var) + len(variables)))
+            edge_var += variables
+            groups.setdefault(table.shape, []).append((table, edges))
+        self.edge_var = np.array(edge_var, dtype=np.int64)
+        self.groups = [(np.stack([table for table, _ in group]), np.array([edges for _, edges in group]).T)
+            for group in groups.values()]
+
+        # reduceat over the edges sorted by variable, every variable is in its own cpt
+        self.by_var = np.argsort(self.edge_var, kind='stable')
+        self.degree = np.bincount(self.edge_var, minlength=n)
+        self.var_start = np.zeros(n, dtype=np.int64)
+        np.cumsum(self.degree[:-1], out=self.var_start[1:])
+
+        self.paths = {}
+        self.iterations = 0
+        self.converged = False
+
+    def evidence_array(self, evidence_sets):
+        """ Returns the likelihoods of the evidence sets, shaped (variables, batch, max cardinality) """
+        ev = np.repeat(self.mask[:, None, :], len(evidence_sets), axis=1)
+        for b, evidence in enumerate(evidence_sets):
+            for (v,), vec in self.evidence_factors(evidence):
+                ev[v, b, :self.cards[v]] *= vec
+        return ev
+
+    def incoming(self, fv):
+        """
+            Returns (log product, zero count) of the factor to variable messages per variable,
+            zeros are counted separately so products that leave out one message don't divide by zero
+        """
+        zero = fv == 0
+        logs = np.log(np.where(zero, 1, fv))
+        sum_logs = np.add.reduceat(logs[self.by_var], self.var_start, axis=0)
+        zeros = np.add.reduceat(zero[self.by_var].astype(np.int64), self.var_start, axis=0)
+        return logs, zero, sum_logs, zeros
+
+    def var_to_factor(self, fv, log_ev):
+        """ The message of every variable to a cpt is the evidence times the messages of its other cpts """
+        logs, zero, sum_logs, zeros = self.incoming(fv)
+        out = sum_logs[self.edge_var] - logs + log_ev[self.edge_var]
+        out[zeros[self.edge_var] - zero > 0] = -np.inf
+        return self.exp_normalize(out)
+
+    def exp_normalize(self, logs):
+        m = logs.max(axis=-1, keepdims=True)
+        m[~np.isfinite(m)] = 0
+        return normalize(np.exp(logs - m))
+
+    def factor_to_var(self, vf):
+        """ The message of a cpt to every variable sums out the product of the cpt and the other incoming messages """
+        fv = np.zeros(vf.shape)
+        # root cpts have no other incoming messages, the batch axis comes from this vector
+        batch = np.ones(vf.shape[1])
+        for g, (tables, edges) in enumerate(self.groups):
+            shape = tables.shape[1:]
+            positions = range(len(shape))
+            inputs = [vf[edges[i], :, :shape[i]] for i in positions]
+            for j in positions:
+                args = [tables, [0] + [2 + i for i in positions], batch, [1]]
+                for i in positions:
+                    if i != j:
+                        args += [inputs[i], [0, 1, 2 + i]]
+                args.append([0, 1, 2 + j])
+                # the contraction path only depends on the shapes, it is searched once per batch size
+                key = (g, j, len(batch))
+                if key not in self.paths:
+                    self.paths[key] = np.einsum_path(*args, optimize='greedy')[0]
+                fv[edges[j], :, :shape[j]] = np.einsum(*args, optimize=self.paths[key])
+        return normalize(fv)
+
+    def run(self, evidence_sets):
+        """
+            Runs belief propagation until no message changes more than the tolerance or max_iterations is reached,
+            returns the factor to variable messages, the variable to factor messages and the evidence array
+        """
+        ev = self.evidence_array(evidence_sets)
+        with np.errstate(divide='ignore'):
+            log_ev = np.log(ev)
+
+        fv = normalize(np.repeat(self.mask[self.edge_var][:, None, :], len(evidence_sets), axis=1))
+        vf = None
+        self.converged = False
+        self.iterations = 0
+        while self.iterations < self.max_iterations and not self.converged:
+            vf = self.var_to_factor(fv, log_ev)
+            new_fv = self.factor_to_var(vf)
+            if self.damping > 0:
+                new_fv = (1 - self.damping) * new_fv + self.damping * fv
+            self.converged = np.abs(new_fv - fv).max(initial=0) < self.tolerance
+            fv = new_fv
+            self.iterations += 1
+        vf = self.var_to_factor(fv, log_ev)
+        return fv, vf, ev
+
+    def bethe_log_z(self, vf, beliefs, ev):
+        """
+            Returns the Bethe approximation of log P(evidence) per evidence set,
+            exact if the network is a polytree
+        """
+        log_z = np.zeros(ev.shape[1])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for tables, edges in self.groups:
+                shape = tables.shape[1:]
+                positions = range(len(shape))
+                args = [tables, [0] + [2 + i for i in positions]]
+                for i in positions:
+                    args += [vf[edges[i], :, :shape[i]], [0, 1, 2 + i]]
+                args.append([0, 1] + [2 + i for i in positions])
+                b = np.einsum(*args)
+                b = b / b.reshape(b.shape[:2] + (-1,)).sum(axis=-1).reshape(b.shape[:2] + (1,) * len(shape))
+                terms = np.where(b > 0, b * (np.log(tables[:, None]) - np.log(b)), 0)
+                log_z += terms.reshape(terms.shape[:2] + (-1,)).sum(axis=-1).sum(axis=0)
+
+            b = beliefs
+            terms = np.where(b > 0, b * (np.log(ev) + (self.degree[:, None, None] - 1) * np.log(b)), 0)
+            log_z += terms.sum(axis=-1).sum(axis=0)
+        return log_z
+
+    def marginals_batch(self, evidence_sets):
+        """
+            Returns (P(evidence), marginals) for a list of evidence sets (see BayesNet.evidence_factors),
+            P(evidence) is the Bethe approximation with shape (batch,) and marginals[i] has
+            shape (batch, cardinality of node i). Sets with inconsistent evidence have
+            P(evidence) 0 and nan marginals
+        """
+        fv, vf, ev = self.run(evidence_sets)
+
+        _, _, sum_logs, zeros = self.incoming(fv)
+        with np.errstate(divide='ignore'):
+            log_b = sum_logs + np.log(ev)
+        log_b[zeros > 0] = -np.inf
+        beliefs = self.exp_normalize(log_b)
+
+        inconsistent = (beliefs.sum(axis=-1) == 0).any(axis=0)
+        p_evidence = np.exp(self.bethe_log_z(vf, beliefs, ev))
+        p_evidence[inconsistent] = 0
+        beliefs[:, inconsistent] = np.nan
+        return p_evidence, [beliefs[v, :, :card] for v, card in enumerate(self.cards)]
+
+    def marginals(self, evidence=None):
+        """ Same as JunctionTree.marginals with approximate marginals and P(evidence) """
+        p_evidence, marginals = self.marginals_batch([evidence])
+        return float(p_evidence[0]), [m[0] for m in marginals]
+
+def main():
+    with open(sys.argv[1], "r") as f:
+        nodes = read_bif(f.read())
+    start = time.time()
+    bp = LoopyBP(nodes)
+    _, marginals = bp.marginals()
+    print("iterations:", bp.iterations, "converged:", bp.converged)
+    for node, marginal in zip(nodes, marginals):
+        print(node.getName(), ", ".join(["{}: {}".format(s, p) for s, p in zip(node.getStates(), marginal)]))
+    print("time: {:.3f}s".format(time.time() - start))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
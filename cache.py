@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+
+import os
+import json
+import shutil
+import hashlib
+
+DEFAULT_CACHE_SIZE = 512 * 1024 * 1024
+
+def hash_key(*parts):
+    """ Returns the content hash of the given parts (strings or bytes) """
+    h = hashlib.sha256()
+    for part in parts:
+        if type(part) is not bytes:
+            part = str(part).encode()
+        h.update(hashlib.sha256(part).digest())
+    return h.hexdigest()
+
+class ArtifactCache:
+    """
+        Content addressed on-disk cache of pipeline artifacts,
+        every key is a directory root/key containing the named artifacts of that key.
+        The least recently used keys are evicted when the cache grows beyond max_bytes.
+    """
+
+    def __init__(self, root, max_bytes=DEFAULT_CACHE_SIZE):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key, name):
+        """ Returns the path of the artifact, whether it exists or not """
+        return os.path.join(self.root, key, name)
+
+    def get(self, key, name):
+        """ Returns the path of the artifact if it is cached, None otherwise """
+        path = self.path(key, name)
+        if not os.path.exists(path):
+            return None
+        # directory mtime is the lru timestamp
+        os.utime(os.path.join(self.root, key))
+        return path
+
+    def get_text(self, key, name):
+        path = self.get(key, name)
+        if path is None:
+            return None
+        with open(path, 'r') as f:
+            return f.read()
+
+    def get_json(self, key, name):
+        text = self.get_text(key, name)
+        return json.loads(text) if text is not None else None
+
+    def reserve(self, key, name):
+        """ Returns the path the artifact should be written to, the directory is created """
+        os.makedirs(os.path.join(self.root, key), exist_ok=True)
+        return self.path(key, name) + ".tmp"
+
+    def commit(self, key, name):
+        """ Moves the reserved artifact in place and evicts old keys if needed """
+        path = self.path(key, name)
+        os.replace(path + ".tmp", path)
+        os.utime(os.path.join(self.root, key))
+        self.evict()
+        return path
+
+    def put_file(self, key, name, src):
+        shutil.copyfile(src, self.reserve(key, name))
+        return self.commit(key, name)
+
+    def put_text(self, key, name, text):
+        with open(self.reserve(key, name), 'w') as f:
+            f.write(text)
+        return self.commit(key, name)
+
+    def put_json(self, key, name, data):
+        return self.put_text(key, name, json.dumps(data))
+
+    def evict(self):
+        """ Removes the least recently used keys until the cache is below max_bytes """
+        entries = []
+        total = 0
+        for key in os.listdir(self.root):
+            key_dir = os.path.join(self.root, key)
+            if not os.path.isdir(key_dir):
+                continue
+            size = sum([os.path.getsize(os.path.join(key_dir, f)) for f in os.listdir(key_dir)])
+            entries.append((os.path.getmtime(key_dir), key_dir, size))
+            total += size
+
+        # the most recently used key is always kept
+        entries.sort()
+        for _, key_dir, size in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(key_dir, ignore_errors=True)
+            total -= size
@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+
+import gzip
+import lzma
+import shutil
+import hashlib
+
+# number of clauses / weights joined per write call
+CHUNK_SIZE = 8192
+
+# write buffer size for uncompressed files
+BUFFER_SIZE = 1 << 20
+
+def is_compressed(fname):
+    """ Returns True if the file name has a .gz or .xz extension """
+    return fname.endswith(".gz") or fname.endswith(".xz")
+
+def strip_compression(fname):
+    """ Returns the file name without .gz or .xz extension """
+    return fname[:-3] if is_compressed(fname) else fname
+
+def open_cnf(fname, mode="r"):
+    """ Opens a cnf file in text mode, .gz and .xz files are (de)compressed transparently """
+    if fname.endswith(".gz"):
+        return gzip.open(fname, mode + "t", compresslevel=6)
+    if fname.endswith(".xz"):
+        return lzma.open(fname, mode + "t")
+    return open(fname, mode, buffering=BUFFER_SIZE)
+
+def decompress_cnf(fname, out_name):
+    """ Streams the (compressed) cnf file fname to the plain file out_name """
+    with open_cnf(fname) as src, open(out_name, "w", buffering=BUFFER_SIZE) as dst:
+        shutil.copyfileobj(src, dst, BUFFER_SIZE)
+
+def cnf_hash(fname):
+    """
+        Returns a hash of the problem line and clauses of the cnf file,
+        comments (including c2d weights) and cachet weight lines are ignored
+    """
+    h = hashlib.sha256()
+    with open_cnf(fname) as f:
+        for line in f:
+            if line.startswith("c") or line.startswith("w"):
+                continue
+            h.update(line.encode())
+    return h.hexdigest()
+
+def write_chunked(f, items, fmt):
+    """ Writes fmt(item) for all items, joining CHUNK_SIZE items per write """
+    chunk = []
+    for item in items:
+        chunk.append(fmt(item))
+        if len(chunk) >= CHUNK_SIZE:
+            f.write("".join(chunk))
+            chunk = []
+    if chunk:
+        f.write("".join(chunk))
+
+def format_clause(clause):
+    return "".join([str(lit) + " " for lit in clause]) + "0\n"
+
+def save_cnf(fname, ints, symbols, c2d, nclauses=None):
+    """
+        Streams the cnf to fname using the c2d (c weights line) or cachet (w lines) weight layout,
+        ints can be any iterable of clauses if nclauses is given
+    """
+    if nclauses is None:
+        nclauses = len(ints)
+    nvars = len(symbols)
+
+    with open_cnf(fname, "w") as f:
+        f.write("c {}\n".format(fname))
+        f.write("c\n")
+        if c2d:
+            f.write("c weights ")
+            write_chunked(f, symbols.weights,
+                lambda w_tuple: "{} {} ".format(w_tuple[0], w_tuple[1]))
+            f.write("\n")
+
+        f.write("p cnf {} {}\n".format(nvars, nclauses))
+
+        if not c2d:
+            write_chunked(f, symbols.items(),
+                lambda item: "w {} {} {}\n".format(item[0], item[2][0], item[2][1]))
+
+        write_chunked(f, ints, format_clause)
+
+def load_cnf(fname):
+    """
+        Reads a cnf file written by save_cnf (or any dimacs cnf), returns (number of variables, clauses, weights).
+        weights is a list of (positive weight, negative weight) per variable from the c2d weights line or
+        the cachet w lines, a w line with one weight w gives (w, 1 - w) and variables without a weight get (1, 1)
+    """
+    nvars = 0
+    ints = []
+    weights = None
+    c2d_weights = None
+    clause = []
+    with open_cnf(fname) as f:
+        for line in f:
+            if line.startswith("c weights"):
+                values = line.split()[2:]
+                c2d_weights = [(float(values[i]), float(values[i+1])) for i in range(0, len(values) - 1, 2)]
+            elif line.startswith("c") or not line.strip():
+                continue
+            elif line.startswith("p"):
+                nvars = int(line.split()[2])
+                weights = [(1, 1)] * nvars
+            elif line.startswith("w"):
+                values = line.split()[1:]
+                w_pos = float(values[1])
+                weights[int(values[0]) - 1] = (w_pos, float(values[2]) if len(values) > 2 else 1 - w_pos)
+            else:
+                # clauses can span lines, 0 ends a clause
+                for lit in line.split():
+                    lit = int(lit)
+                    if lit == 0:
+                        ints.append(clause)
+                        clause = []
+                    else:
+                        clause.append(lit)
+    if weights is None:
+        raise ValueError("{} has no problem line".format(fname))
+    if c2d_weights is not None:
+        weights[:len(c2d_weights)] = c2d_weights[:nvars]
+    return nvars, ints, weights
@@ -11,6 +11,7 @@ received by the constructor is the same as the number of variables given to the
 
 '''
 from __future__ import division
+import numpy as np
 
 __author__ = "Antoine Bosselut"
 __version__ = "1.0.4"
@@ -24,9 +25,10 @@ class Node:
         self.myType = theType
         self.numStates = numberStates
         self.states = theStates
+        self.stateIndex = dict((state, i) for i, state in enumerate(theStates))
+        self.cpt = None
         self.parents = []
         self.children = []
-        self.information = []
         self.dist = None
         self.myProperty = theProperty
         self.marginal = None
@@ -62,6 +64,10 @@ class Node:
     def getStates(self):
         return self.states
 
+    #Return the index of the given state in the states of the node
+    def getStateIndex(self, state):
+        return self.stateIndex[state]
+
     #Return the number of states this node has
     def numStates(self):
         return self.numStates
@@ -89,6 +95,13 @@ class Node:
             else:
                 for i, state in enumerate(key):
                     self.dist[(state,)] = distribution[key][i] 
+
+        #Store the same distribution as an array, missing entries are nan
+        cpt = np.full(self.cptShape(), np.nan)
+        for key, value in self.dist.items():
+            index = [parent.getStateIndex(s) for parent, s in zip(self.parents, key[1:])]
+            cpt[tuple(index) + (self.getStateIndex(key[0]),)] = value
+        self.cpt = cpt
        
         #If this is a root value, set the distribution to be the marginal
         if self.isRoot():
@@ -98,82 +111,40 @@ class Node:
                 while i<len(value):
                     self.marginal[(key[i],)] = value[i]
                     i+=1
-    
-    #Return the probability distribution of thise node
-    def getDist(self):
-        return self.dist
 
-    #receive the information from a factor based on new information. 
-    #Organize this information where it belongs in the information vector
-    def receiveMarginal(self, message, factor):
-        if not self.information:
-            self.information = [0]*(self.numChildren()+(not self.isRoot()))
-        #If this node is the child in the CPD for the factor, set the information index to 0.
-        if factor.getIndex(self.getName()) == 0:
-            self.information[0] = message
-        else:
-            childName = factor.getFields()[0].getName()
-            i=0
-            while i<len(self.children):
-                if childName == self.children[i].getName():
-                    break
-                i+=1
-            self.information[i+(not self.isRoot())] = message
-
-    def updateMarginal(self):
+    #Return the shape of the CPT array: the cardinalities of the parents followed by the own cardinality
+    def cptShape(self):
+        return tuple([len(parent.getStates()) for parent in self.parents]) + (len(self.states),)
+
+    #Set the CPT array of this node, indexed by the state indices of the parents followed by the own state index.
+    #The dict distribution is only built when it is requested by getDist
+    def setCPT(self, cpt):
+        cpt = np.asarray(cpt, dtype=np.float64)
+        if cpt.shape != self.cptShape():
+            raise ValueError("cpt of %s has shape %s instead of %s" % (self.name, cpt.shape, self.cptShape()))
+        self.cpt = cpt
+        self.dist = None
         if self.isRoot():
-            pass
-        else:
-            thesum=0
-            vals = {(state,): 1 for state in self.states}
-            #For each factor we receive information from
-            for a in self.information:
-                #For this evidence in the message
-                for ev in a.keys():
-                    vals[ev] = vals[ev]*a[ev]
+            self.marginal = dict(((state,), p) for state, p in zip(self.states, cpt.tolist()))
 
-            for val in vals.itervalues():
-                thesum+=val
-
-            for key in vals.keys():
-                if thesum != 0:
-                    vals[key] = vals[key]/thesum
-            self.marginal = vals
+    #Return the CPT array of this node
+    def getCPT(self):
+        return self.cpt
 
+    #Return the probability distribution of thise node
+    def getDist(self):
+        if self.dist is None and self.cpt is not None:
+            self.dist = {}
+            parentStates = [parent.getStates() for parent in self.parents]
+            for index, p in zip(np.ndindex(*self.cpt.shape), self.cpt.ravel().tolist()):
+                conds = tuple([states[i] for states, i in zip(parentStates, index[:-1])])
+                self.dist[(self.states[index[-1]],) + conds] = p
+        return self.dist
 
     #Return marginal distribution of node variable in node 
     def getMarginal(self):
         return self.marginal
 
-    def sendMarginal(self, targetFactor):
-        index = -1
-        cacheQuery = targetFactor.getFields()[0].getName()
-        if self.isRoot():
-            return self.marginal
-
-        if (cacheQuery == self.name):
-            index=0
-        else:
-            j=0
-            while j < len(self.children):
-                if cacheQuery == self.getChildren()[j].getName():
-                    index = j + (not self.isRoot())
-                j+=1
-        thesum=0
-        vals = {(state,): 1 for state in self.states}
-        i=0
-        while i<len(self.information):
-            if (i != index):
-                for ev in self.information[i].keys():
-                    vals[ev] = vals[ev]*self.information[i][ev]
-            i+=1
-        for val in vals.itervalues():
-            thesum+=val
-
-        for key in vals.keys():
-            vals[key] = vals[key]/thesum
-        return vals
-
     #Print the characteristics of this node
     def printNode(self):
         print(self.getName())
@@ -1,57 +1,209 @@
 #!/usr/bin/python3
 
+import os
 import sys
+import csv
+import glob
+import json
+import time
+import argparse
 import subprocess
 
+from concurrent.futures import ProcessPoolExecutor
+
+from cnf_io import cnf_hash, is_compressed, decompress_cnf
+
 MINIC2D_PATH = "../miniC2D-1.0.0/bin/linux/miniC2D"
 
-cnf_paths = [
-    'enc1_c2d_cancer',
-    'enc2_c2d_cancer',
-    'c2d_montyhall'
+# report read by pipeline.py
+DEFAULT_REPORT = "vtree/report.json"
+DEFAULT_CACHE = "vtree/sweep_cache.json"
+
+DEFAULT_CNFS = [
+    'cnf/enc1_c2d_cancer.cnf',
+    'cnf/enc2_c2d_cancer.cnf',
+    'cnf/c2d_montyhall.cnf'
 ]
 
 opts_1 = ['p', 'i']
+opts_2 = range(5)
+
+def run_minic2d(cnf_path, opt, m, vtree_path, timeout):
+    """
+        Runs miniC2D with vtree options -t opt -m m and parses the Nodes / Edges of the output,
+        returns a result dict, nodes and edges are None if miniC2D failed or timed out
+    """
+    result = {
+        'opt': opt,
+        'm': m,
+        'vtree': vtree_path,
+        'nodes': None,
+        'edges': None,
+        'error': None
+    }
+    start_time = time.time()
+    try:
+        mc2d = subprocess.run([MINIC2D_PATH,
+            '-t', opt,
+            '-m', str(m),
+            '-c', cnf_path,
+            '-o', vtree_path],
+            stdout=subprocess.PIPE, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        result['error'] = "timeout"
+        return result
+    result['time'] = time.time() - start_time
+
+    if mc2d.returncode != 0:
+        result['error'] = "miniC2D exit code {}".format(mc2d.returncode)
+        return result
+
+    for line in mc2d.stdout.decode().splitlines():
+        spl = line.split()
+        if len(spl) != 2:
+            continue
+        if spl[0] == 'Nodes':
+            result['nodes'] = int(spl[1])
+        elif spl[0] == 'Edges':
+            result['edges'] = int(spl[1])
+            break
+    return result
+
+def expand_cnfs(patterns):
+    """ Expands the globs in the list of cnf paths """
+    cnfs = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        cnfs += matches if len(matches) > 0 else [pattern]
+    return list(dict.fromkeys(cnfs))
+
+def load_json(path):
+    if path is None or not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def save_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp_path, path)
+
+def best_run(runs, key):
+    """ Returns the run with the smallest key (nodes or edges) """
+    valid = [r for r in runs if r[key] is not None]
+    return min(valid, key=lambda r: r[key]) if len(valid) > 0 else None
+
+def sweep(cnfs, vtree_dir, cache, jobs, timeout, verbose=False):
+    """
+        Runs all vtree option combinations on all cnfs in a process pool,
+        results are cached by cnf content hash so unchanged cnfs aren't recompiled.
+        The vtree files are named by that hash and the options, cnfs with equal contents are swept once.
+        Returns the report: cnf hash -> {cnf, best_nodes, best_edges, runs}
+    """
+    report = {}
+    pending = [] # (hash, cache key, future)
+    temp_files = []
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for cnf_path in cnfs:
+            h = cnf_hash(cnf_path)
+            # a cnf with the same problem and clauses has the same vtrees
+            if h in report:
+                continue
+            report[h] = {'cnf': cnf_path, 'runs': []}
+
+            # miniC2D only reads plain cnf files
+            run_path = cnf_path
+            if is_compressed(cnf_path):
+                run_path = os.path.join(vtree_dir, h + ".cnf")
+                decompress_cnf(cnf_path, run_path)
+                temp_files.append(run_path)
+
+            for opt in opts_1:
+                for m in opts_2:
+                    key = "{}_{}_{}".format(h, opt, m)
+                    cached = cache.get(key)
+                    if cached is not None and (cached['vtree'] is None or os.path.exists(cached['vtree'])):
+                        report[h]['runs'].append(cached)
+                        continue
+                    # named by the content hash, cnfs with the same file name don't share vtrees
+                    vtree_path = os.path.join(vtree_dir, key + '.vtree')
+                    future = pool.submit(run_minic2d, run_path, opt, m, vtree_path, timeout)
+                    pending.append((h, key, future))
+
+        for h, key, future in pending:
+            result = future.result()
+            if result['error'] is not None:
+                if verbose:
+                    print(report[h]['cnf'], result['opt'], result['m'], result['error'])
+                # failed runs aren't cached so they are retried
+                result['vtree'] = None
+            else:
+                cache[key] = result
+            report[h]['runs'].append(result)
+
+    for temp_file in temp_files:
+        os.remove(temp_file)
+
+    for h in report:
+        runs = report[h]['runs']
+        runs.sort(key=lambda r: (r['opt'], r['m']))
+        report[h]['best_nodes'] = best_run(runs, 'nodes')
+        report[h]['best_edges'] = best_run(runs, 'edges')
+    return report
+
+def write_csv(path, report):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['cnf', 'hash', 'opt', 'm', 'nodes', 'edges', 'time', 'vtree', 'error'])
+        for h, entry in report.items():
+            for r in entry['runs']:
+                writer.writerow([entry['cnf'], h, r['opt'], r['m'], r['nodes'], r['edges'],
+                    r.get('time'), r['vtree'], r['error']])
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="miniC2D vtree option sweep")
+    arg_parser.add_argument("cnfs", nargs="*", default=DEFAULT_CNFS, help="The cnf files or globs to sweep")
+    arg_parser.add_argument("--vtree-dir", default="vtree", help="The directory for the generated vtrees")
+    arg_parser.add_argument("--jobs", "-j", default=os.cpu_count(), help="Number of parallel miniC2D runs", type=int)
+    arg_parser.add_argument("--timeout", "-t", default=None, help="Timeout in seconds per miniC2D run", type=float)
+    arg_parser.add_argument("--cache", default=DEFAULT_CACHE, help="The result cache file")
+    arg_parser.add_argument("--report", default=DEFAULT_REPORT, help="The json report with the best vtree per cnf")
+    arg_parser.add_argument("--csv", help="Also write all runs as csv")
+    arg_parser.add_argument("--verbose", "-v", default=False, help="Verbose output", action="store_true")
+
+    args = arg_parser.parse_args()
+
+    os.makedirs(args.vtree_dir, exist_ok=True)
+
+    cnfs = expand_cnfs(args.cnfs)
+    cache = load_json(args.cache)
+
+    report = sweep(cnfs, args.vtree_dir, cache, args.jobs, args.timeout, args.verbose)
+
+    save_json(args.cache, cache)
+
+    # keep the entries of cnfs that weren't part of this sweep
+    full_report = load_json(args.report)
+    full_report.update(report)
+    save_json(args.report, full_report)
+
+    if args.csv is not None:
+        write_csv(args.csv, report)
+
+    for h, entry in report.items():
+        best_nodes = entry['best_nodes']
+        best_edges = entry['best_edges']
+        print(entry['cnf'])
+        if best_nodes is None:
+            print("no successful miniC2D run")
+        else:
+            print("min nodes:", best_nodes['nodes'], "opts:", (best_nodes['opt'], best_nodes['m']))
+            print("min edges:", best_edges['edges'], "opts:", (best_edges['opt'], best_edges['m']))
+        print("----")
+
+    return 0
 
-for cnf_path in cnf_paths:
-    min_nodes = 100000
-    min_edges = 100000
-    min_nodes_opts = None
-    min_edges_opts = None
-    for opt in opts_1:
-        for m in range(5):
-            cnf_tot_path = 'cnf/' + cnf_path + '.cnf'
-            vtree_path = 'vtree/' + cnf_path + '_' + opt + '_' + str(m) + '.vtree'
-
-            mc2d = subprocess.run([MINIC2D_PATH,
-                '-t', opt,
-                '-m', str(m),
-                '-c', cnf_tot_path,
-                '-o', vtree_path],
-                stdout=subprocess.PIPE)
-
-            if mc2d.returncode != 0:
-                print("error running miniC2D")
-                sys.exit(-1)
-
-            output = mc2d.stdout.decode().splitlines()
-
-            for line in output:
-                spl = line.split()
-                if len(spl) != 2:
-                    continue
-                if spl[0] == 'Nodes':
-                    nodes = int(spl[1])
-                    if nodes < min_nodes:
-                        min_nodes = nodes
-                        min_nodes_opts = (opt, m)
-                elif spl[0] == 'Edges':
-                    edges = int(spl[1])
-                    if edges < min_edges:
-                        min_edges = edges
-                        min_edges_opts = (opt, m)
-                    break
-    print(cnf_path)
-    print("min nodes:", min_nodes, "opts:", min_nodes_opts)
-    print("min edges:", min_edges, "opts:", min_edges_opts)
-    print("----")
\ No newline at end of file
+if __name__ == '__main__':
+    sys.exit(main())
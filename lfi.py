@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+
+import re
+import math
+import time
+
+import profiling
+
+from srl_to_cnf import unique_evidence_sets
+
+# t(_) or t(0.3) annotations of learnable probabilities
+LEARNABLE_RE = re.compile(r"\bt\(\s*([^()]*?)\s*\)\s*::")
+
+class LearnableParameters:
+    """
+        The learnable parameters of a problog program,
+        parameter k is the k-th t(_) annotation which is renamed to lfi_t(k) before grounding.
+        parse_srl registers the variables of every grounded parameter:
+        facts (weights (p, 1 - p)), choices of annotated disjunctions (weights (p, 1))
+        with the variable of their body and the rest variables of annotated disjunctions.
+    """
+
+    def __init__(self, initial):
+        self.values = dict(initial) # param -> probability, None if not given
+        self.facts = [] # (var_name, param)
+        self.choices = [] # (var_name, param, body var_name or None)
+        self.rests = [] # (var_name, [choice var_names])
+
+    def param(self, prob):
+        """ Returns the parameter of a probability term, None if it isn't learnable """
+        if prob is not None and hasattr(prob, 'functor') and prob.functor == 'lfi_t':
+            return int(prob.args[0])
+        return None
+
+    def value(self, param, default):
+        """ Returns the current value of the parameter, default is used if no initial value was given """
+        if self.values.get(param) is None:
+            self.values[param] = default
+        return self.values[param]
+
+    def add_fact(self, var_name, param):
+        self.facts.append((var_name, param))
+
+    def add_choice(self, var_name, param, body_name):
+        self.choices.append((var_name, param, body_name))
+
+    def add_rest(self, var_name, choice_names):
+        self.rests.append((var_name, choice_names))
+
+    def weights(self):
+        """ Returns the current (positive, negative) weight of all learnable variables """
+        ws = {}
+        for var_name, param in self.facts:
+            p = self.values[param]
+            ws[var_name] = (p, 1 - p)
+        choice_params = {}
+        for var_name, param, _ in self.choices:
+            ws[var_name] = (self.values[param], 1)
+            choice_params[var_name] = param
+        for var_name, choice_names in self.rests:
+            rest = 1 - sum([self.values[choice_params[c]] for c in choice_names])
+            ws[var_name] = (max(rest, 0), 1)
+        return ws
+
+def mark_learnable(contents):
+    """
+        Renames every t(...):: annotation to lfi_t(k)::,
+        returns the new program and the initial value of every parameter (None for t(_))
+    """
+    initial = {}
+
+    def rename(match):
+        param = len(initial)
+        try:
+            initial[param] = float(match.group(1))
+        except ValueError:
+            initial[param] = None
+        return "lfi_t({})::".format(param)
+
+    return LEARNABLE_RE.sub(rename, contents), initial
+
+def learned_program(marked, params):
+    """
+        Returns the program with all lfi_t(k) annotations replaced by the learned values,
+        parameters that weren't grounded stay t(_)
+    """
+    def value(match):
+        v = params.values[int(match.group(1))]
+        return "{}::".format(v) if v is not None else "t(_)::"
+    return re.sub(r"lfi_t\((\d+)\)::", value, marked)
+
+def set_weights(sdd, wmc, symbols, weights):
+    for name, (w_pos, w_neg) in weights.items():
+        symbols.set_weight(name, (w_pos, w_neg))
+        idx = symbols.id(name)
+        wmc.set_literal_weight(sdd.literal(idx), w_pos)
+        wmc.set_literal_weight(sdd.literal(-idx), w_neg)
+
+def learn(sdd, wmc, symbols, params, evidence_sets, max_iter=100, threshold=1e-5, verbose=False):
+    """
+        Expectation maximization of the learnable parameters on the compiled sdd,
+        each iteration only updates the learnable literal weights and evaluates
+        every distinct interpretation by zeroing the weights of the contradicting literals.
+        Returns a list of (iteration, log likelihood, max parameter change, time) per iteration
+        and whether the log likelihood converged
+    """
+    unique = unique_evidence_sets(evidence_sets)
+
+    # all learned probabilities / variables depending on them:
+    queried = set([v for v, _ in params.facts] + [v for v, _, _ in params.choices] +
+        [b for _, _, b in params.choices if b is not None])
+    lits = {name: sdd.literal(symbols.id(name)) for name in queried}
+
+    stats = []
+    prev_ll = None
+    converged = False
+    for iteration in range(max_iter):
+        start_time = time.time()
+        set_weights(sdd, wmc, symbols, params.weights())
+        total = wmc.propagate()
+
+        ll = 0
+        consistent = 0
+        expected = {name: 0 for name in queried}
+        for ev_set, count in unique:
+            zeroed = []
+            for ev_name, ev_val in ev_set:
+                lit = sdd.literal(symbols.literal(ev_name, not ev_val))
+                zeroed.append((lit, wmc.literal_weight(lit)))
+                wmc.set_literal_weight(lit, 0)
+
+            w = wmc.propagate()
+            if w > 0:
+                ll += count * math.log(w / total)
+                consistent += count
+                for name in queried:
+                    expected[name] += count * wmc.literal_pr(lits[name])
+            elif verbose:
+                print("skipping inconsistent interpretation:", ev_set)
+
+            for lit, weight in reversed(zeroed):
+                wmc.set_literal_weight(lit, weight)
+
+        # maximization: expected counts of the parameters
+        num = {}
+        den = {}
+        for var_name, param in params.facts:
+            num[param] = num.get(param, 0) + expected[var_name]
+            den[param] = den.get(param, 0) + consistent
+        for var_name, param, body_name in params.choices:
+            num[param] = num.get(param, 0) + expected[var_name]
+            body = expected[body_name] if body_name is not None else consistent
+            den[param] = den.get(param, 0) + body
+
+        delta = 0
+        for param in num:
+            if den[param] > 0:
+                value = num[param] / den[param]
+                delta = max(delta, abs(value - params.values[param]))
+                params.values[param] = value
+
+        stats.append((iteration + 1, ll, delta, time.time() - start_time))
+        profiling.count("em iterations")
+        profiling.count("wmc propagations", len(unique) + 1)
+
+        if prev_ll is not None and abs(ll - prev_ll) < threshold:
+            converged = True
+            break
+        prev_ll = ll
+
+    set_weights(sdd, wmc, symbols, params.weights())
+    return stats, converged
@@ -0,0 +1,363 @@
+#!/usr/bin/python3
+
+import sys
+import time
+import argparse
+
+from cnf_io import load_cnf
+
+class ModelCounter:
+    """
+        Interface of the weighted model counters of the counter backends (see COUNTERS).
+        A counter is created once for the clauses of a cnf and counts them for any weights
+        and assumed literals
+    """
+
+    def __init__(self, ints, nvars):
+        self.ints = ints
+        self.nvars = nvars
+
+    def count(self, weights, assumptions=()):
+        """
+            Returns the weighted model count of the clauses with the assumed literals set,
+            weights has a (positive weight, negative weight) tuple per variable like SymbolTable.weights
+        """
+        raise NotImplementedError
+
+    def marginals(self, weights, assumptions=()):
+        """
+            Returns (count, literal -> count of the models with the literal) for all literals,
+            this counts every literal separately unless the counter has something better
+        """
+        counts = {}
+        for var in range(1, self.nvars + 1):
+            for lit in (var, -var):
+                counts[lit] = self.count(weights, list(assumptions) + [lit])
+        return self.count(weights, assumptions), counts
+
+    def statistics(self):
+        """ Returns a dict of statistics of the counts so far """
+        return {}
+
+class _Frame:
+    """ A component on the search stack of ComponentCounter.count_component """
+    __slots__ = ('clauses', 'variables', 'branches', 'total', 'product', 'pending', 'trace')
+
+    def __init__(self, clauses, occurrences):
+        self.clauses = clauses
+        self.variables = occurrences.keys()
+        # branch on the variable that occurs most
+        var = max(occurrences, key=lambda v: (occurrences[v], -v))
+        self.branches = [-var, var]
+        self.total = 0
+        self.product = 0
+        self.pending = []
+        # (assigned literals, free variables, child components) per branch that isn't a conflict or of weight 0
+        self.trace = []
+
+def components(clauses):
+    """
+        Splits the clauses into connected components (clauses that share variables),
+        returns (frozenset of clauses, variable -> number of occurrences) per component
+    """
+    var_clauses = {}
+    for i, clause in enumerate(clauses):
+        for lit in clause:
+            var = abs(lit)
+            entry = var_clauses.get(var)
+            if entry is None:
+                var_clauses[var] = [i]
+            else:
+                entry.append(i)
+
+    result = []
+    done = bytearray(len(clauses))
+    seen = set()
+    for start in var_clauses:
+        if start in seen:
+            continue
+        seen.add(start)
+        todo = [start]
+        group = []
+        occurrences = {}
+        while todo:
+            var = todo.pop()
+            indices = var_clauses[var]
+            occurrences[var] = len(indices)
+            for i in indices:
+                if done[i]:
+                    continue
+                done[i] = 1
+                clause = clauses[i]
+                group.append(clause)
+                for lit in clause:
+                    other = abs(lit)
+                    if other not in seen:
+                        seen.add(other)
+                        todo.append(other)
+        result.append((frozenset(group), occurrences))
+    return result
+
+def propagate(clauses, lits):
+    """
+        Sets the literals and unit propagates the clauses,
+        returns (set of assigned literals, remaining clauses) or None if there is a conflict
+    """
+    assigned = set()
+    units = list(lits)
+    while True:
+        for lit in units:
+            if -lit in assigned:
+                return None
+            assigned.add(lit)
+        false = set([-lit for lit in assigned])
+        units = []
+        remaining = []
+        for clause in clauses:
+            if not assigned.isdisjoint(clause):
+                continue
+            if false.isdisjoint(clause):
+                remaining.append(clause)
+                continue
+            reduced = tuple([lit for lit in clause if lit not in false])
+            if not reduced:
+                return None
+            if len(reduced) == 1:
+                units.append(reduced[0])
+            else:
+                remaining.append(reduced)
+        clauses = remaining
+        if not units:
+            return assigned, clauses
+
+class ComponentCounter(ModelCounter):
+    """
+        Exact weighted model counter: a dpll search with unit propagation that splits the remaining
+        clauses into connected components, counts every component separately and caches it by its
+        (hashed) set of clauses. Variables that no clause mentions anymore are summed out with their
+        positive plus negative weight. Counts are plain sums of products of the weights (no log space),
+        only branches with a zero literal weight are skipped, so negative weights are counted exactly.
+        The cache holds while the weights stay the same, counts with other assumptions reuse the
+        components they share. It is cleared before a count when it has more than cache_size entries.
+        Every cached component keeps its branches, which makes the search a decision-DNNF that
+        marginals differentiates in one downward pass
+    """
+
+    def __init__(self, ints, nvars, cache_size=1000000):
+        super().__init__(ints, nvars)
+        # tautologies don't constrain anything
+        self.clauses = [tuple(sorted(set(clause), key=abs)) for clause in ints
+            if not any([-lit in clause for lit in clause])]
+        # an empty clause has no variables to propagate or split on
+        self.unsatisfiable = () in self.clauses
+        self.cache_size = cache_size
+        # component -> (count, [(assigned literals, free variables, child components)])
+        self.cache = {}
+        self.weights = None
+        self.literal_weights = None
+        self.decisions = 0
+        self.cache_hits = 0
+
+    def set_weights(self, weights):
+        """ Sets the weights of the literals, the cache is cleared if they changed """
+        weights = [tuple(w) for w in weights]
+        if weights == self.weights:
+            return
+        self.weights = weights
+        self.literal_weights = {}
+        for i, (w_pos, w_neg) in enumerate(weights, 1):
+            self.literal_weights[i] = w_pos
+            self.literal_weights[-i] = w_neg
+        self.cache = {}
+
+    def branch(self, variables, propagated):
+        """
+            Returns (weight, (assigned literals, free variables, child components with their occurrences))
+            of a propagation over the variables, or None if the weight of the assigned literals is 0.
+            The free variables are neither assigned nor in the remaining clauses
+        """
+        assigned, remaining = propagated
+        literal_weights = self.literal_weights
+        product = 1
+        for lit in assigned:
+            product *= literal_weights[lit]
+        if product == 0:
+            return None
+        children = components(remaining)
+        free = set(variables)
+        free.difference_update([abs(lit) for lit in assigned])
+        for _, occurrences in children:
+            free.difference_update(occurrences)
+        for var in free:
+            product *= literal_weights[var] + literal_weights[-var]
+        return product, (tuple(assigned), tuple(free), children)
+
+    def search(self, weights, assumptions):
+        """ Counts all components, returns (count, top branch) where the top branch is None if the count is 0 """
+        self.set_weights(weights)
+        if len(self.cache) > self.cache_size:
+            self.cache = {}
+        propagated = propagate(self.clauses, assumptions) if not self.unsatisfiable else None
+        if propagated is None:
+            return 0, None
+        branched = self.branch(range(1, self.nvars + 1), propagated)
+        if branched is None:
+            return 0, None
+        result, (assigned, free, children) = branched
+        for component, occurrences in children:
+            result *= self.count_component(component, occurrences)
+        return result, (assigned, free, [component for component, _ in children])
+
+    def count(self, weights, assumptions=()):
+        return self.search(weights, assumptions)[0]
+
+    def count_component(self, component, occurrences):
+        """
+            Returns the weighted count of a component (a frozenset of clauses without unit clauses, occurrences
+            maps its variables to their number of occurrences). The search runs on an explicit stack: a frame
+            branches on its variable, propagates and counts the components of the remaining clauses one by one,
+            their product times the weight of the propagation is added to the total of the frame
+        """
+        cached = self.cache.get(component)
+        if cached is not None:
+            self.cache_hits += 1
+            return cached[0]
+
+        stack = [_Frame(component, occurrences)]
+        result = None
+        while True:
+            frame = stack[-1]
+            if result is not None:
+                frame.product *= result
+                result = None
+
+            if frame.pending:
+                child, occurrences = frame.pending.pop()
+                cached = self.cache.get(child)
+                if cached is not None:
+                    self.cache_hits += 1
+                    frame.product *= cached[0]
+                else:
+                    stack.append(_Frame(child, occurrences))
+                continue
+
+            frame.total += frame.product
+            frame.product = 0
+            if frame.branches:
+                lit = frame.branches.pop()
+                self.decisions += 1
+                propagated = propagate(frame.clauses, [lit])
+                branched = self.branch(frame.variables, propagated) if propagated is not None else None
+                if branched is not None:
+                    frame.product, (assigned, free, children) = branched
+                    frame.pending = children
+                    frame.trace.append((assigned, free, [child for child, _ in children]))
+                continue
+
+            stack.pop()
+            self.cache[frame.clauses] = (frame.total, frame.trace)
+            result = frame.total
+            if not stack:
+                return result
+
+    def marginals(self, weights, assumptions=()):
+        """
+            Counts the models and differentiates the count to the count of every component, from the top
+            down in topological order. A branch adds its weight to the literals it assigns and passes the
+            product of its other factors on to its free variables and child components
+        """
+        total, top = self.search(weights, assumptions)
+        counts = {}
+        for var in range(1, self.nvars + 1):
+            counts[var] = 0
+            counts[-var] = 0
+        if top is None:
+            return total, counts
+
+        # post order of the components below the top branch
+        order = []
+        visited = set()
+        todo = [(root, False) for root in top[2]]
+        while todo:
+            component, expanded = todo.pop()
+            if expanded:
+                order.append(component)
+                continue
+            if component in visited:
+                continue
+            visited.add(component)
+            todo.append((component, True))
+            for _, _, children in self.cache[component][1]:
+                for child in children:
+                    if child not in visited:
+                        todo.append((child, False))
+
+        derivatives = {}
+        self.differentiate(top, 1, counts, derivatives)
+        for component in reversed(order):
+            derivative = derivatives.get(component, 0)
+            if derivative != 0:
+                for branch in self.cache[component][1]:
+                    self.differentiate(branch, derivative, counts, derivatives)
+        return total, counts
+
+    def differentiate(self, branch, derivative, counts, derivatives):
+        """ Adds the derivative of one branch to the literal counts and the derivatives of its child components """
+        assigned, free, children = branch
+        literal_weights = self.literal_weights
+        factors = [literal_weights[lit] for lit in assigned]
+        factors += [literal_weights[var] + literal_weights[-var] for var in free]
+        factors += [self.cache[child][0] for child in children]
+
+        # products of all factors but one from prefix and suffix products, factors can be 0
+        n = len(factors)
+        prefix = [1] * (n + 1)
+        for i, factor in enumerate(factors):
+            prefix[i + 1] = prefix[i] * factor
+        others = [0] * n
+        suffix = 1
+        for i in range(n - 1, -1, -1):
+            others[i] = prefix[i] * suffix
+            suffix *= factors[i]
+
+        for lit in assigned:
+            counts[lit] += derivative * prefix[n]
+        offset = len(assigned)
+        for i, var in enumerate(free, offset):
+            counts[var] += derivative * others[i] * literal_weights[var]
+            counts[-var] += derivative * others[i] * literal_weights[-var]
+        offset += len(free)
+        for i, child in enumerate(children, offset):
+            derivatives[child] = derivatives.get(child, 0) + derivative * others[i]
+
+    def statistics(self):
+        return {
+            'decisions': self.decisions,
+            'cache_entries': len(self.cache),
+            'cache_hits': self.cache_hits
+        }
+
+# the counters of the counter backends of the pipeline
+COUNTERS = {
+    "dpll": ComponentCounter
+}
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="weighted model counting of a cnf file (c2d or cachet weights)")
+    arg_parser.add_argument("cnf_file", help="The cnf file, .gz and .xz files are decompressed")
+    arg_parser.add_argument("--counter", default="dpll", choices=list(COUNTERS), help="The model counter")
+    arg_parser.add_argument("--assume", nargs="*", default=[], type=int, help="Literals that are set before counting")
+    args = arg_parser.parse_args()
+
+    start = time.time()
+    nvars, ints, weights = load_cnf(args.cnf_file)
+    counter = COUNTERS[args.counter](ints, nvars)
+    print("model count:", counter.count([(1, 1)] * nvars, args.assume))
+    print("weighted count:", counter.count(weights, args.assume))
+    for name, value in counter.statistics().items():
+        print(name + ":", value)
+    print("time: {:.3f}s".format(time.time() - start))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,378 @@
+#!/usr/bin/python3
+
+import numpy as np
+
+# node types
+LITERAL = 0
+AND = 1
+OR = 2
+
+class Circuit:
+    """
+        d-DNNF circuit stored as topologically sorted node arrays,
+        node i only has children with a smaller index and the last node is the root.
+        Weighted model counts are evaluated level by level with numpy
+        for a batch of weight vectors at once.
+
+        The circuit doesn't have to be smooth: the literal weights of every variable are
+        normalized to sum to 1, which makes the weighted count of the variables missing
+        below an OR node 1, and the root is scaled back afterwards.
+        Weight vectors with pos + neg = 0 for some variable are evaluated
+        on a smoothed copy of the circuit instead.
+    """
+
+    def __init__(self, nodes, nvars):
+        """
+            nodes is a topologically sorted list of (LITERAL, lit) / (AND, children) / (OR, children),
+            a childless AND node is true and a childless OR node is false
+        """
+        self.nvars = nvars
+        self.nodes = nodes
+        self.smoothed = None
+        n = len(nodes)
+
+        self.types = np.array([t for t, _ in nodes], dtype=np.int8)
+        self.lits = np.array([arg if t == LITERAL else 0 for t, arg in nodes], dtype=np.int64)
+        sizes = [len(arg) if t != LITERAL else 0 for t, arg in nodes]
+        self.child_ptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(sizes, out=self.child_ptr[1:])
+        self.children = np.array([c for t, arg in nodes if t != LITERAL for c in arg], dtype=np.int64)
+
+        # literal leaves index the concatenated [positive weights, negative weights]
+        self.lit_nodes = np.flatnonzero(self.types == LITERAL)
+        lits = self.lits[self.lit_nodes]
+        self.lit_index = np.where(lits > 0, lits - 1, nvars - lits - 1)
+
+        self.true_nodes = np.flatnonzero((self.types == AND) & (self.child_ptr[1:] == self.child_ptr[:-1]))
+        self.false_nodes = np.flatnonzero((self.types == OR) & (self.child_ptr[1:] == self.child_ptr[:-1]))
+
+        # level of a node = longest path to a leaf, all nodes of a level are evaluated at once
+        level = np.zeros(n, dtype=np.int64)
+        for i, (t, arg) in enumerate(nodes):
+            if t != LITERAL and len(arg) > 0:
+                level[i] = max([level[c] for c in arg]) + 1
+
+        # [(AND group, OR group)], group = (nodes, children, offsets, sizes, order, targets, target_offsets) or None
+        self.levels = []
+        for l in range(1, int(level.max()) + 1 if n > 0 else 1):
+            at_level = level == l
+            self.levels.append((self._group(at_level & (self.types == AND)),
+                self._group(at_level & (self.types == OR))))
+
+    def _group(self, mask):
+        group_nodes = np.flatnonzero(mask)
+        if len(group_nodes) == 0:
+            return None
+        starts = self.child_ptr[group_nodes]
+        sizes = self.child_ptr[group_nodes + 1] - starts
+        children = np.concatenate([self.children[s:s + k] for s, k in zip(starts, sizes)])
+        offsets = np.zeros(len(group_nodes), dtype=np.int64)
+        np.cumsum(sizes[:-1], out=offsets[1:])
+        # the downward pass sums the edges of every distinct child
+        order = np.argsort(children, kind='stable')
+        targets, target_offsets = np.unique(children[order], return_index=True)
+        return group_nodes, children, offsets, sizes, order, targets, target_offsets
+
+    def __len__(self):
+        return len(self.types)
+
+    def size(self):
+        """ Returns the number of edges """
+        return len(self.children)
+
+    @staticmethod
+    def from_sdd(root, nvars):
+        """ Converts a pysdd sdd, every decision node becomes an OR of (prime AND sub) """
+        nodes = []
+        index = {}
+
+        # iterative post order traversal
+        stack = [(root, False)]
+        while len(stack) > 0:
+            node, expanded = stack.pop()
+            if node.id in index:
+                continue
+            if node.is_true():
+                index[node.id] = len(nodes)
+                nodes.append((AND, []))
+            elif node.is_false():
+                index[node.id] = len(nodes)
+                nodes.append((OR, []))
+            elif node.is_literal():
+                index[node.id] = len(nodes)
+                nodes.append((LITERAL, node.literal))
+            elif not expanded:
+                stack.append((node, True))
+                for prime, sub in node.elements():
+                    stack.append((prime, False))
+                    stack.append((sub, False))
+            else:
+                elements = []
+                for prime, sub in node.elements():
+                    elements.append(len(nodes))
+                    nodes.append((AND, [index[prime.id], index[sub.id]]))
+                index[node.id] = len(nodes)
+                nodes.append((OR, elements))
+        return Circuit(nodes, nvars)
+
+    def evaluate(self, pos, neg, log=False):
+        """
+            Returns the weighted model count for the positive and negative literal weights,
+            pos and neg have shape (nvars,) or (batch, nvars) and give weights of variables 1..nvars.
+            With log=True the circuit is evaluated in log space and the log of the count is returned,
+            the weights stay in linear space (0 becomes -inf) and can't be negative.
+            Returns a float or an array of shape (batch,)
+        """
+        single = np.ndim(pos) == 1
+        pos, neg, z, normalizable = split_weights(pos, neg)
+
+        result = np.empty(pos.shape[0], dtype=np.float64)
+        if normalizable.any():
+            z_n = z[normalizable]
+            root = self.node_values(pos[normalizable] / z_n, neg[normalizable] / z_n, log)[-1]
+            scale = np.sum(np.log(np.abs(z_n)), axis=1)
+            if log:
+                result[normalizable] = root + scale
+            else:
+                result[normalizable] = root * np.exp(scale) * np.prod(np.sign(z_n), axis=1)
+        if not normalizable.all():
+            rest = ~normalizable
+            result[rest] = self.smooth_circuit().node_values(pos[rest], neg[rest], log)[-1]
+
+        return result[0] if single else result
+
+    def marginals(self, pos, neg):
+        """
+            Returns (counts, marginals): the weighted model counts and the probability of every
+            variable being true, marginals[..., i-1] is the marginal of variable i.
+            One upward pass computes the node values and one downward pass the derivatives
+            of the count to the literal weights, P(v) = w(v) * dF/dw(v) / F.
+            Evaluated in linear space, rows with a zero count have nan marginals
+        """
+        single = np.ndim(pos) == 1
+        pos, neg, z, normalizable = split_weights(pos, neg)
+
+        counts = np.empty(pos.shape[0], dtype=np.float64)
+        marginals = np.empty(pos.shape, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if normalizable.any():
+                z_n = z[normalizable]
+                p = pos[normalizable] / z_n
+                n = neg[normalizable] / z_n
+                values = self.node_values(p, n)
+                d_pos, d_neg = self.literal_derivatives(values)
+                f = values[-1][:, None]
+                # derivative through the (v OR -v) nodes a smooth circuit would have (p + n = 1)
+                d_missing = f - p * d_pos - n * d_neg
+                marginals[normalizable] = p * (d_pos + d_missing) / f
+                scale = np.sum(np.log(np.abs(z_n)), axis=1)
+                counts[normalizable] = values[-1] * np.exp(scale) * np.prod(np.sign(z_n), axis=1)
+            if not normalizable.all():
+                rest = ~normalizable
+                smoothed = self.smooth_circuit()
+                values = smoothed.node_values(pos[rest], neg[rest])
+                d_pos, _ = smoothed.literal_derivatives(values)
+                marginals[rest] = pos[rest] * d_pos / values[-1][:, None]
+                counts[rest] = values[-1]
+
+        if single:
+            return counts[0], marginals[0]
+        return counts, marginals
+
+    def smooth_circuit(self):
+        """ Returns the smoothed circuit, used for weights that can't be normalized """
+        if self.smoothed is None:
+            self.smoothed = Circuit(smooth(self.nodes, self.nvars), self.nvars)
+        return self.smoothed
+
+    def literal_derivatives(self, values):
+        """
+            Downward pass: returns the derivatives of the root to the positive and negative
+            literal weights, both of shape (batch, nvars), values is the output of node_values
+        """
+        deriv = np.zeros_like(values)
+        deriv[-1] = 1
+
+        for and_group, or_group in reversed(self.levels):
+            if or_group is not None:
+                group_nodes, children, offsets, sizes, order, targets, target_offsets = or_group
+                edges = np.repeat(deriv[group_nodes], sizes, axis=0)
+                deriv[targets] += np.add.reduceat(edges[order], target_offsets, axis=0)
+            if and_group is not None:
+                group_nodes, children, offsets, sizes, order, targets, target_offsets = and_group
+                # product of the other children, without dividing by zero
+                child_values = values[children]
+                zero = child_values == 0
+                nonzero = np.where(zero, 1, child_values)
+                nonzero_prod = np.repeat(np.multiply.reduceat(nonzero, offsets, axis=0), sizes, axis=0)
+                zeros = np.repeat(np.add.reduceat(zero, offsets, axis=0), sizes, axis=0)
+                others = np.where(zero, np.where(zeros == 1, nonzero_prod, 0),
+                    np.where(zeros == 0, nonzero_prod / nonzero, 0))
+                edges = np.repeat(deriv[group_nodes], sizes, axis=0) * others
+                deriv[targets] += np.add.reduceat(edges[order], target_offsets, axis=0)
+
+        lit_deriv = np.zeros((2 * self.nvars, values.shape[1]), dtype=np.float64)
+        np.add.at(lit_deriv, self.lit_index, deriv[self.lit_nodes])
+        return lit_deriv[:self.nvars].T, lit_deriv[self.nvars:].T
+
+    def node_values(self, pos, neg, log=False):
+        """
+            Returns the values of all nodes for the given literal weights, shape (len(self), batch),
+            this is only the weighted model count of smooth circuits or normalized weights
+        """
+        weights = np.concatenate([np.atleast_2d(pos), np.atleast_2d(neg)], axis=1).astype(np.float64)
+        if log:
+            with np.errstate(divide='ignore'):
+                weights = np.log(weights)
+        batch = weights.shape[0]
+
+        values = np.empty((len(self), batch), dtype=np.float64)
+        values[self.lit_nodes] = weights[:, self.lit_index].T
+        values[self.true_nodes] = 0 if log else 1
+        values[self.false_nodes] = -np.inf if log else 0
+
+        for and_group, or_group in self.levels:
+            if and_group is not None:
+                group_nodes, children, offsets = and_group[:3]
+                if log:
+                    values[group_nodes] = np.add.reduceat(values[children], offsets, axis=0)
+                else:
+                    values[group_nodes] = np.multiply.reduceat(values[children], offsets, axis=0)
+            if or_group is not None:
+                group_nodes, children, offsets, sizes = or_group[:4]
+                if log:
+                    values[group_nodes] = logsumexp_reduceat(values[children], offsets, sizes)
+                else:
+                    values[group_nodes] = np.add.reduceat(values[children], offsets, axis=0)
+        return values
+
+def split_weights(pos, neg):
+    """ Returns the 2d weight arrays, their sums and the rows where no sum is 0 """
+    pos = np.atleast_2d(np.asarray(pos, dtype=np.float64))
+    neg = np.atleast_2d(np.asarray(neg, dtype=np.float64))
+    z = pos + neg
+    return pos, neg, z, np.all(z != 0, axis=1)
+
+def logsumexp_reduceat(x, offsets, sizes):
+    """ log(sum(exp(x))) over the row segments starting at offsets """
+    m = np.maximum.reduceat(x, offsets, axis=0)
+    m_safe = np.where(np.isfinite(m), m, 0)
+    with np.errstate(divide='ignore'):
+        s = np.add.reduceat(np.exp(x - np.repeat(m_safe, sizes, axis=0)), offsets, axis=0)
+        return np.log(s) + m_safe
+
+def smooth(nodes, nvars):
+    """
+        Returns an equivalent smooth circuit: every child of an OR node that misses
+        variables of the OR node is conjoined with (v OR -v) for each missing v,
+        the root is smoothed over all variables 1..nvars
+    """
+    out = []
+    out_vars = [] # variable bitset per output node
+    new_index = []
+    var_nodes = {} # var -> node (v OR -v)
+    set_nodes = {} # missing variables -> node
+    lit_nodes = {}
+
+    def add(node, node_vars):
+        out.append(node)
+        out_vars.append(node_vars)
+        return len(out) - 1
+
+    def literal(lit):
+        if lit not in lit_nodes:
+            lit_nodes[lit] = add((LITERAL, lit), 1 << abs(lit))
+        return lit_nodes[lit]
+
+    def missing_node(missing):
+        # the conjunction of (v OR -v) is shared by all children missing the same variables
+        if missing not in set_nodes:
+            conj = []
+            v = 0
+            rest = missing
+            while rest:
+                if rest & 1:
+                    if v not in var_nodes:
+                        var_nodes[v] = add((OR, [literal(v), literal(-v)]), 1 << v)
+                    conj.append(var_nodes[v])
+                rest >>= 1
+                v += 1
+            set_nodes[missing] = conj[0] if len(conj) == 1 else add((AND, conj), missing)
+        return set_nodes[missing]
+
+    def smoothed(child, node_vars):
+        missing = node_vars & ~out_vars[child]
+        if missing == 0:
+            return child
+        return add((AND, [child, missing_node(missing)]), node_vars | out_vars[child])
+
+    for t, arg in nodes:
+        if t == LITERAL:
+            new_index.append(literal(arg))
+            continue
+        children = [new_index[c] for c in arg]
+        node_vars = 0
+        for c in children:
+            node_vars |= out_vars[c]
+        if t == OR:
+            children = [smoothed(c, node_vars) for c in children]
+        new_index.append(add((t, children), node_vars))
+
+    all_vars = ((1 << (nvars + 1)) - 1) & ~1
+    if len(new_index) == 0:
+        new_index.append(add((AND, []), 0))
+    root = smoothed(new_index[-1], all_vars)
+    if root != len(out) - 1:
+        # the root has to be the last node
+        add((AND, [root]), out_vars[root])
+    return out
+
+def load_nnf(fname, nvars=None):
+    """
+        Loads a d-DNNF in the c2d / miniC2D .nnf format:
+        header "nnf nodes edges vars" and one node per line,
+        "L lit", "A c child..." or "O var c child..." with children given by line index
+    """
+    with open(fname, 'r') as f:
+        header = f.readline().split()
+        if len(header) != 4 or header[0] != "nnf":
+            raise ValueError("invalid nnf header: {}".format(" ".join(header)))
+        if nvars is None:
+            nvars = int(header[3])
+
+        nodes = []
+        for line in f:
+            spl = line.split()
+            if len(spl) == 0:
+                continue
+            if spl[0] == "L":
+                nodes.append((LITERAL, int(spl[1])))
+            elif spl[0] == "A":
+                nodes.append((AND, [int(c) for c in spl[2:]]))
+            elif spl[0] == "O":
+                nodes.append((OR, [int(c) for c in spl[3:]]))
+            else:
+                raise ValueError("invalid nnf node: {}".format(line.strip()))
+    return Circuit(nodes, nvars)
+
+def weight_arrays(symbols):
+    """ Returns the (pos, neg) weight arrays of the symbol table """
+    pos = np.array([w[0] for w in symbols.weights], dtype=np.float64)
+    neg = np.array([w[1] for w in symbols.weights], dtype=np.float64)
+    return pos, neg
+
+def evidence_weights(pos, neg, symbols, evidence_sets):
+    """
+        Returns (batch, nvars) weight arrays with one row per evidence set,
+        the weights of the literals that contradict the evidence are 0
+    """
+    batch_pos = np.tile(pos, (len(evidence_sets), 1))
+    batch_neg = np.tile(neg, (len(evidence_sets), 1))
+    for row, ev_set in enumerate(evidence_sets):
+        for ev_name, ev_val in ev_set:
+            idx = symbols.id(ev_name) - 1
+            if ev_val:
+                batch_neg[row, idx] = 0
+            else:
+                batch_pos[row, idx] = 0
+    return batch_pos, batch_neg
@@ -1,198 +1,1295 @@
 #!/usr/bin/python3
 
+import os
 import sys
 import argparse
 import subprocess
+import tempfile
+import shutil
 
 import time
 
-from bif_to_cnf import parse_bif #, latex_print
-from srl_to_cnf import parse_srl
+import numpy as np
 
-from sympy.logic.boolalg import Not
+from concurrent.futures import ProcessPoolExecutor
+
+from bif_to_cnf import parse_bif, var_name, create_variables, create_symbol_table #, latex_print
+from bif_reader import BIFError, read_bif
+from srl_to_cnf import parse_srl, parse_evidence_sets, unique_evidence_sets, ground_program
+from symbols import SymbolTable
+from cache import ArtifactCache, hash_key
+from nnf import Circuit, weight_arrays, evidence_weights
+from ve import JunctionTree
+from bp import LoopyBP
+from lfi import LearnableParameters, mark_learnable, learned_program, learn
+from preprocess import preprocess_cnf
+from sdd_compiler import VTREE_TYPES, compile_clauses
+from bif_vtree import VTREE_SHAPES, ELIMINATION_HEURISTICS, network_vtree, save_vtree
+from model_counter import COUNTERS
+import profiling
+from cnf_io import save_cnf, is_compressed, strip_compression, decompress_cnf, cnf_hash
+from knowledge_opts import DEFAULT_REPORT, load_json
+
+from sympy import true, false
+from sympy.logic.boolalg import Not, And, Or
 
 from pysdd.sdd import SddManager, Vtree, WmcManager
 
 MINIC2D_PATH = "../miniC2D-1.0.0/bin/linux/miniC2D"
 
-def cnf_to_ints(cnf, variables):
+# backends that run inference on the bif network instead of compiling the cnf
+NETWORK_BACKENDS = ("ve", "bp")
+
+# backends that count the cnf with a model counter of model_counter.py instead of compiling it to an sdd
+COUNTER_BACKENDS = tuple(COUNTERS)
+
+# minic2d compiles the cnf file with a miniC2D vtree, apply compiles the clauses in-process
+COMPILERS = ("minic2d", "apply")
+
+def cnf_to_ints(cnf, symbols):
+    """
+        Converts a sympy cnf to integer clauses. to_cnf leaves a single clause as an Or and
+        a single literal as a Symbol / Not, and true / false for a cnf without clauses / an empty one
+    """
+    if cnf == true:
+        return []
+    if cnf == false:
+        return [[]]
     ints = []
-    clauses = cnf.args
+    ids = symbols.ids
+    clauses = cnf.args if type(cnf) is And else (cnf,)
     for clause in clauses:
         disj = []
-        for lit in clause.args:
+        for lit in (clause.args if type(clause) is Or else (clause,)):
             if type(lit) is Not:
-                name = lit.args[0].name
-                i = variables.index(name)+1
-                disj.append(-i)
+                disj.append(-ids[lit.args[0].name])
             else:
-                name = lit.name
-                i = variables.index(name)+1
-                disj.append(i)
-        ints.append(disj)
+                disj.append(ids[lit.name])
+        ints.append(sorted(disj, key=abs))
+    # sympy orders the clauses by hash, sorting makes the cnf independent of the hash seed
+    ints.sort(key=lambda clause: [abs(lit) for lit in clause] + clause)
     return ints
 
-def save_cnf(fname, ints, variables, weights, c2d):
-    nclauses = len(ints)
-    nvars = len(variables)
-
-    with open(fname, "w") as f:
-        f.write("c {}\n".format(fname))
-        f.write("c\n")
-        if c2d:
-            w_str = ""
-            for var in variables:
-                w_tuple = weights[var]
-                w_str += str(w_tuple[0]) + " " + str(w_tuple[1]) + " "
-            f.write("c weights {}\n".format(w_str))
-
-        f.write("p cnf {} {}\n".format(nvars, nclauses))
-
-        if not c2d:
-            for idx, var in enumerate(variables):
-                w_tuple = weights[var]
-                f.write("w {} {} {}\n".format(idx+1, w_tuple[0], w_tuple[1]))
-
-        cnf_str = ""
-        i = 0
-        for clause in ints:
-            i += 1
-            for lit in clause:
-                cnf_str += str(lit) + " "
-            cnf_str += "0\n"
-        f.write(cnf_str)
+def structure_fingerprint(nodes):
+    """ Returns a hash of the graph and the state spaces of the network """
+    return hash_key(*[(node.getName(), tuple(node.getStates()), tuple([p.getName() for p in node.getParents()]))
+        for node in nodes])
+
+def parameter_fingerprint(nodes):
+    """ Returns a hash of the cpts of the network """
+    return hash_key(*[node.getCPT().tobytes() for node in nodes])
+
+def sdd_statistics(sdd, root):
+    """ Returns the node counts and sizes of the sdd manager and of the root sdd """
+    return {
+        'variables': sdd.var_count(),
+        'root_count': root.count(),
+        'root_size': root.size(),
+        'live_count': sdd.live_count(),
+        'live_size': sdd.live_size(),
+        'dead_count': sdd.dead_count(),
+        'dead_size': sdd.dead_size(),
+        'auto_minimize': bool(sdd.is_auto_gc_and_minimize_on())
+    }
+
+def evaluate_evidence_sets(sdd, wmc, symbols, evidence_sets, queries):
+    """
+        Evaluates the queries for every evidence set on the compiled sdd by zeroing
+        the weights of the literals that contradict the evidence,
+        identical evidence sets are evaluated once.
+        Returns a list of (evidence, count, P(evidence), [(query, P(query | evidence))])
+    """
+    unique = unique_evidence_sets(evidence_sets)
+
+    total = wmc.propagate()
+
+    results = []
+    for ev_set, count in unique:
+        # literals that contradict the evidence get weight 0
+        zeroed = []
+        for ev_name, ev_val in ev_set:
+            lit = sdd.literal(symbols.literal(ev_name, not ev_val))
+            zeroed.append((lit, wmc.literal_weight(lit)))
+            wmc.set_literal_weight(lit, 0)
+
+        w = wmc.propagate()
+        profiling.count("wmc propagations")
+        probs = []
+        if w != 0:
+            for query in queries:
+                probs.append((query, wmc.literal_pr(sdd.literal(symbols.id(query)))))
+
+        for lit, weight in reversed(zeroed):
+            wmc.set_literal_weight(lit, weight)
+
+        results.append((ev_set, count, w / total, probs))
+    return results
+
+def evaluate_evidence_sets_circuit(circuit, symbols, evidence_sets, queries):
+    """
+        Same as evaluate_evidence_sets on a numpy circuit, all evidence sets are evaluated
+        as one batch and the marginals of all queries come from one downward pass
+    """
+    unique = unique_evidence_sets(evidence_sets)
+
+    pos, neg = weight_arrays(symbols)
+    total = circuit.evaluate(pos, neg)
+    batch_pos, batch_neg = evidence_weights(pos, neg, symbols, [ev_set for ev_set, _ in unique])
+    counts, marginals = circuit.marginals(batch_pos, batch_neg)
+
+    query_ids = [symbols.id(query) - 1 for query in queries]
+    results = []
+    for row, (ev_set, count) in enumerate(unique):
+        w = counts[row]
+        probs = []
+        if w != 0:
+            probs = [(query, float(marginals[row, i])) for query, i in zip(queries, query_ids)]
+        results.append((ev_set, count, float(w / total), probs))
+    return results
+
+def evaluate_evidence_sets_counter(counter, symbols, evidence_sets, queries):
+    """
+        Same as evaluate_evidence_sets with a model counter of model_counter.py, the evidence literals are
+        assumed (the counter propagates them instead of counting zero weights) and the counts of all queries
+        come from one marginals call per evidence set
+    """
+    unique = unique_evidence_sets(evidence_sets)
+
+    weights = symbols.weights
+    total = counter.count(weights)
+    if total == 0:
+        raise PipelineError("the weighted model count is 0")
+
+    results = []
+    for ev_set, count in unique:
+        evidence = [symbols.literal(ev_name, ev_val) for ev_name, ev_val in ev_set]
+        w, counts = counter.marginals(weights, evidence)
+        probs = []
+        if w != 0:
+            probs = [(query, counts[symbols.id(query)] / w) for query in queries]
+        results.append((ev_set, count, w / total, probs))
+    return results
+
+
+def network_evidence(ev_set, state_vars, cards):
+    """
+        Converts an evidence set of (state variable name, value) to likelihood vectors per node,
+        a true state variable observes the state and a false one excludes it
+    """
+    evidence = {}
+    for ev_name, ev_val in ev_set:
+        name, i = state_vars[ev_name]
+        vec = evidence.setdefault(name, np.ones(cards[name]))
+        if ev_val:
+            observed = vec[i]
+            vec[:] = 0
+            vec[i] = observed
+        else:
+            vec[i] = 0
+    return evidence
+
+def evaluate_evidence_sets_network(engine, state_vars, evidence_sets, queries):
+    """
+        Same as evaluate_evidence_sets on the bif network with a JunctionTree or LoopyBP engine,
+        all unique evidence sets are passed to the engine as one batch
+    """
+    unique = unique_evidence_sets(evidence_sets)
+
+    cards = dict((node.getName(), len(node.getStates())) for node in engine.nodes)
+    # the first row is the model without evidence
+    batch = [{}] + [network_evidence(ev_set, state_vars, cards) for ev_set, _ in unique]
+    p_evidence, marginals = engine.marginals_batch(batch)
+    total = p_evidence[0]
+
+    results = []
+    for row, (ev_set, count) in enumerate(unique, 1):
+        w = p_evidence[row]
+        probs = []
+        if w != 0:
+            for query in queries:
+                name, i = state_vars[query]
+                probs.append((query, float(marginals[engine.index[name]][row, i])))
+        results.append((ev_set, count, float(w / total), probs))
+    return results
+
+
+class PipelineError(Exception):
+    pass
+
+class Pipeline:
+    """
+        The pipeline as separately callable stages: parse, encode, preprocess (optional), write, vtree, compile, count and query
+        (and learn for lfi). Every stage runs the stages it depends on if they haven't run yet
+        and returns a dict with its results, the time of every stage is kept in timings.
+        The ve and bp backends skip the cnf stages: compile builds a junction tree (ve) or
+        a loopy belief propagation engine (bp) for the bif network and query runs it.
+        The counter backends (dpll) skip the vtree: compile creates the model counter of the
+        integer clauses and count / query count them with the weights and evidence.
+
+            pipe = Pipeline(enc=2)
+            pipe.load(bif_file="bif/cancer.bif")
+            probs = pipe.query()['probabilities']
+
+        The model is compiled once, query can be called repeatedly with other evidence sets.
+    """
+
+    def __init__(self, enc=1, cnf_type="c2d", sympy_cnf=False, tseitin=False, evaluator="pysdd",
+            vtree_report=DEFAULT_REPORT, cache_dir=None, cache_size=512, ground_subprocess=False,
+            backend="sdd", bp_damping=0.0, bp_tolerance=1e-6, bp_iterations=100, local_structure=0, preprocess=False,
+            compiler="minic2d", vtree_type="balanced", minimize=None, network_vtree=None, elimination="min-fill", verbose=False):
+        if cnf_type not in ("c2d", "cachet"):
+            raise PipelineError("unknown cnf type: {}".format(cnf_type))
+        if evaluator not in ("pysdd", "numpy"):
+            raise PipelineError("unknown evaluator: {}".format(evaluator))
+        if backend not in ("sdd",) + NETWORK_BACKENDS + COUNTER_BACKENDS:
+            raise PipelineError("unknown backend: {}".format(backend))
+        if local_structure not in (0, 1, 2):
+            raise PipelineError("unknown local structure level: {}".format(local_structure))
+        if local_structure > 0 and sympy_cnf:
+            raise PipelineError("the local structure encodings don't support sympy cnf")
+        if compiler not in COMPILERS:
+            raise PipelineError("unknown compiler: {}".format(compiler))
+        if vtree_type not in VTREE_TYPES:
+            raise PipelineError("unknown vtree type: {}".format(vtree_type))
+        if network_vtree is not None and network_vtree not in VTREE_SHAPES:
+            raise PipelineError("unknown network vtree shape: {}".format(network_vtree))
+        if elimination not in ELIMINATION_HEURISTICS:
+            raise PipelineError("unknown elimination heuristic: {}".format(elimination))
+
+        self.enc = enc
+        self.cnf_type = cnf_type
+        self.c2d = cnf_type == "c2d"
+        self.sympy_cnf = sympy_cnf
+        self.tseitin = tseitin
+        self.local_structure = local_structure
+        self.preprocessing = preprocess
+        self.compiler = compiler
+        self.vtree_type = vtree_type
+        # a network vtree is good as it is, minimizing it mostly costs time
+        self.minimize = minimize if minimize is not None else network_vtree is None
+        self.network_vtree = network_vtree
+        self.elimination = elimination
+        self.evaluator = evaluator
+        self.vtree_report = vtree_report
+        self.ground_subprocess = ground_subprocess
+        self.backend = backend
+        self.network_backend = backend in NETWORK_BACKENDS
+        self.counter_backend = backend in COUNTER_BACKENDS
+        self.bp_options = {'damping': bp_damping, 'tolerance': bp_tolerance, 'max_iterations': bp_iterations}
+        self.verbose = verbose
+
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = ArtifactCache(cache_dir, cache_size * 1024 * 1024)
+
+        self.work_dir = None
+        self.set_model(None, False)
+
+    def load(self, bif_file=None, pl_file=None, evidence_file=None, lfi_file=None):
+        """ Reads the model (bif or problog) and the optional evidence sets or lfi interpretations """
+        if (bif_file is None) == (pl_file is None):
+            raise PipelineError("one input file required")
+
+        with open(bif_file if bif_file is not None else pl_file, 'r') as f:
+            contents = f.read()
+
+        evidence_contents = None
+        if evidence_file is not None:
+            with open(evidence_file, 'r') as f:
+                evidence_contents = f.read()
+
+        lfi_contents = None
+        if lfi_file is not None:
+            with open(lfi_file, 'r') as f:
+                lfi_contents = f.read()
+
+        self.set_model(contents, bif_file is not None, evidence_contents, lfi_contents)
+
+    def set_model(self, contents, is_bif, evidence_contents=None, lfi_contents=None):
+        """
+            Sets the model to compile and resets all stages,
+            evidence_contents / lfi_contents are problog evidence sets separated by ----
+        """
+        # the model counters don't need the c2d weights of the sdd
+        if (evidence_contents is not None or lfi_contents is not None) and (is_bif or not (self.c2d or self.counter_backend)):
+            raise PipelineError("evidence files require problog input and the c2d cnf type")
+        if lfi_contents is not None and self.counter_backend:
+            raise PipelineError("lfi requires the sdd backend")
+        if contents is not None and self.network_backend and not is_bif:
+            raise PipelineError("the {} backend requires bif input".format(self.backend))
+        if contents is not None and self.network_vtree is not None and not is_bif:
+            raise PipelineError("the network vtree requires bif input")
+
+        self.is_bif = is_bif
+        self.timings = {}
+
+        ev_atoms = []
+
+        self.evidence_sets = None
+        if evidence_contents is not None:
+            self.evidence_sets, atoms = parse_evidence_sets(evidence_contents)
+            ev_atoms += atoms
+
+        self.params = None
+        self.marked = None
+        self.interpretations = None
+        if lfi_contents is not None:
+            contents, initial = mark_learnable(contents)
+            self.params = LearnableParameters(initial)
+            self.marked = contents
+            self.interpretations, atoms = parse_evidence_sets(lfi_contents)
+            ev_atoms += atoms
+
+        # make sure all observed atoms are grounded
+        if len(ev_atoms) > 0:
+            contents += "\n" + "".join(["query({}).\n".format(atom) for atom in ev_atoms])
+        self.contents = contents
+
+        # the artifacts depend on the input, the encoding and the way evidence is applied
+        self.batch = self.evidence_sets is not None or self.interpretations is not None
+        self.model_key = self.artifact_key(contents)
+        self.structure_key = None
+        self.fingerprints = None
+
+        # bif clauses are emitted directly as integers unless sympy is requested
+        self.direct = is_bif and not self.sympy_cnf
+
+        self.symbols = None
+        self.cnf = None
+        self.evidence = None
+        self.queries = None
+        self.ints = None
+        self.model_evidence = None
+        self.mapping = None
+        self.preprocessed = False
+        self.cnf_file = None
+        self.vtree_file = None
+        self.initial_vtree = None
+        self.sdd = None
+        self.root = None
+        self.wmc = None
+        self.circuit = None
+        self.network = None
+        self.state_vars = None
+        self.engine = None
+        self.counter = None
+
+    def artifact_key(self, model):
+        """
+            Returns the cache key of the encoding of the model (contents or structure fingerprint)
+            with the options that change the cnf
+        """
+        return hash_key(model, self.is_bif, self.enc, self.cnf_type, self.sympy_cnf, self.tseitin,
+            self.local_structure, self.preprocessing, self.batch)
+
+    def weights_only(self):
+        """
+            Whether the cpts of the model only change the weights: the clauses of the bif encodings
+            only depend on the graph and the state spaces, unless the local structure encodings
+            or the preprocessing use the values
+        """
+        return self.is_bif and self.local_structure == 0 and not self.preprocessing and not self.network_backend
+
+    def sdd_key(self):
+        """
+            Returns the cache key of the vtree and the sdd: the key of the encoding with the compile options.
+            For bif networks of which the cpts only change the weights the encoding is keyed on the structure
+            fingerprint, so networks that only differ in their cpts share the compiled sdd
+        """
+        if self.structure_key is None:
+            if self.weights_only():
+                key = self.artifact_key(("structure", self.network_fingerprints()[0]))
+            else:
+                key = self.model_key
+            self.structure_key = hash_key(key, self.compiler, self.vtree_type, self.minimize,
+                self.network_vtree, self.elimination)
+        return self.structure_key
+
+    def network_fingerprints(self):
+        """ Returns the (structure, parameter) fingerprints of the bif model, the network is read once per model """
+        if self.fingerprints is None:
+            nodes = read_bif(self.contents)
+            self.fingerprints = (structure_fingerprint(nodes), parameter_fingerprint(nodes))
+        return self.fingerprints
+
+    def update_parameters(self, contents):
+        """
+            Replaces the bif model by one with other cpts. If the graph and the state spaces are the same
+            and the cpts only change the weights (see weights_only), the compiled sdd is kept and only the
+            weights of the symbol table and the wmc manager are updated, otherwise the model is set as with
+            set_model. The model counter of a counter backend is kept the same way, and nothing changes
+            if the cpts are the same. Returns whether the sdd (or counter) was kept
+        """
+        if (self.root is None and self.counter is None) or not self.weights_only():
+            self.set_model(contents, True)
+            return False
+        try:
+            nodes = read_bif(contents)
+        except BIFError as e:
+            raise PipelineError("error parsing bif: {}".format(e))
+        structure, parameters = structure_fingerprint(nodes), parameter_fingerprint(nodes)
+        if structure != self.network_fingerprints()[0]:
+            self.set_model(contents, True)
+            return False
+
+        enc1 = self.enc == 1
+        unchanged = parameters == self.network_fingerprints()[1]
+        if not unchanged:
+            variables, _, weights, _ = create_variables(nodes, enc1)
+            symbols = create_symbol_table(variables, weights, enc1)
+            if symbols.names != self.symbols.names:
+                # the same structure gives the same variables, this only happens if the encoding changed
+                self.set_model(contents, True)
+                return False
+            self.symbols = symbols
+        self.contents = contents
+        self.model_key = self.artifact_key(contents)
+        self.fingerprints = (structure, parameters)
+        if self.wmc is not None and not unchanged:
+            self.set_wmc_weights()
+            # literal_pr uses the last propagation
+            self.wmc.propagate()
+        return True
+
+    def _timed(self, stage, start_time, result):
+        result['time'] = time.time() - start_time
+        self.timings[stage] = result['time']
+        return result
+
+    @profiling.profiled("parse")
+    def parse(self):
+        """ Parses (and grounds) the model into a symbol table and cnf """
+        if self.contents is None:
+            raise PipelineError("no model loaded")
+        start_time = time.time()
+
+        if self.network_backend:
+            try:
+                self.network = read_bif(self.contents)
+            except BIFError as e:
+                raise PipelineError("error parsing bif: {}".format(e))
+            # the queries are the state variables of the encodings
+            self.state_vars = {}
+            for node in self.network:
+                for i, state in enumerate(node.getStates()):
+                    self.state_vars[var_name(node, state)] = (node.getName(), i)
+            self.queries = list(self.state_vars)
+            return self._timed('parse', start_time, {
+                'variables': len(self.network),
+                'queries': self.queries,
+                'evidence': None,
+                'cached': False
+            })
+
+        # lfi needs the parser to register the learnable variables
+        encoding = None
+        if self.cache is not None and self.params is None:
+            encoding = self.cache.get_json(self.model_key, "encoding.json")
+
+        if encoding is not None:
+            self.symbols = SymbolTable.from_dict(encoding['symbols'])
+            self.cnf = None
+            self.ints = encoding['ints']
+            self.evidence = [tuple(ev) for ev in encoding['evidence']] if encoding['evidence'] is not None else None
+            self.queries = encoding['queries']
+        elif self.is_bif:
+            try:
+                self.symbols, self.cnf, self.queries = parse_bif(self.contents, self.enc == 1, self.verbose, self.direct,
+                    self.local_structure)
+            except BIFError as e:
+                raise PipelineError("error parsing bif: {}".format(e))
+        else:
+            grounded = None
+            if self.cache is not None:
+                ground_key = hash_key(self.contents)
+                grounded = self.cache.get_text(ground_key, "grounded.pl")
+                if grounded is None:
+                    with profiling.span("ground program"):
+                        grounded = ground_program(self.contents, self.ground_subprocess)
+                    self.cache.put_text(ground_key, "grounded.pl", grounded)
+            self.symbols, self.cnf, self.evidence, self.queries = parse_srl(self.contents, self.verbose,
+                self.tseitin, self.params, grounded, self.ground_subprocess, self.local_structure > 0)
+
+        return self._timed('parse', start_time, {
+            'variables': len(self.symbols),
+            'queries': self.queries,
+            'evidence': self.evidence,
+            'cached': encoding is not None
+        })
+
+    @profiling.profiled("encode")
+    def encode(self):
+        """ Converts the cnf to integer clauses, the model evidence becomes unit clauses """
+        if self.network_backend:
+            raise PipelineError("the {} backend doesn't use a cnf".format(self.backend))
+        if self.symbols is None:
+            self.parse()
+        start_time = time.time()
+
+        if self.ints is None:
+            if self.direct:
+                self.ints = self.cnf
+            else:
+                with profiling.span("cnf_to_ints"):
+                    self.ints = cnf_to_ints(self.cnf, self.symbols)
+            if self.cache is not None and self.params is None:
+                self.cache.put_json(self.model_key, "encoding.json", {
+                    'symbols': self.symbols.to_dict(),
+                    'ints': self.ints,
+                    'evidence': self.evidence,
+                    'queries': self.queries
+                })
+
+        # with evidence sets the model evidence is applied through the weights
+        self.model_evidence = []
+        if self.batch:
+            self.model_evidence = self.evidence or []
+        elif self.evidence is not None:
+            self.ints = self.ints + [[self.symbols.literal(ev_name, ev_val)] for ev_name, ev_val in self.evidence]
+
+        return self._timed('encode', start_time, {
+            'variables': len(self.symbols),
+            'clauses': len(self.ints)
+        })
+
+    def protected_names(self):
+        """ Returns the names of the variables preprocessing must keep: queries, evidence and learned variables """
+        names = set(self.queries or []) | set([name for name, _ in self.model_evidence])
+        for ev_sets in (self.evidence_sets, self.interpretations):
+            for ev_set in ev_sets or []:
+                names.update([name for name, _ in ev_set])
+        if self.params is not None:
+            names.update(self.params.weights())
+            names.update([body for _, _, body in self.params.choices if body is not None])
+        return names
+
+    @profiling.profiled("preprocess")
+    def preprocess(self):
+        """
+            Simplifies the integer clauses before they are written (see preprocess.CnfPreprocessor),
+            the symbol table is replaced by the one of the kept variables.
+            self.mapping relates the original and the kept variables
+        """
+        if self.model_evidence is None:
+            self.encode()
+        start_time = time.time()
+
+        original = (len(self.symbols), len(self.ints))
+        protected = [self.symbols.id(name) for name in self.protected_names() if name in self.symbols]
+        preprocessed = preprocess_cnf(self.ints, self.symbols, protected)
+        # an unsatisfiable cnf is left as it is
+        if preprocessed is not None:
+            self.ints, self.symbols, self.mapping = preprocessed
+        self.preprocessed = True
+
+        return self._timed('preprocess', start_time, {
+            'variables': original[0],
+            'clauses': original[1],
+            'preprocessed_variables': len(self.symbols),
+            'preprocessed_clauses': len(self.ints),
+            'fixed': len(self.mapping.fixed) if self.mapping is not None else 0,
+            'eliminated': len(self.mapping.eliminated) if self.mapping is not None else 0
+        })
+
+    @profiling.profiled("write")
+    def write(self, cnf_file=None):
+        """ Writes the cnf file, a temporary file is used if no name is given (the apply compiler doesn't need it) """
+        if self.model_evidence is None:
+            self.encode()
+        if self.preprocessing and not self.preprocessed:
+            self.preprocess()
+        start_time = time.time()
+
+        if cnf_file is None:
+            cnf_file = self._work_file("model.cnf")
+        save_cnf(cnf_file, self.ints, self.symbols, self.c2d)
+        self.cnf_file = cnf_file
+
+        return self._timed('write', start_time, {'cnf_file': cnf_file})
+
+    def _work_file(self, name):
+        """ Returns the path of a file in the temporary directory of the pipeline """
+        if self.work_dir is None:
+            self.work_dir = tempfile.mkdtemp(prefix="pipeline")
+        return os.path.join(self.work_dir, name)
+
+    def _plain_cnf(self):
+        """ miniC2D and pySDD only read plain cnf files, returns (file, is temporary) """
+        if not is_compressed(self.cnf_file):
+            return self.cnf_file, False
+        fd, cnf_file = tempfile.mkstemp(suffix=".cnf")
+        os.close(fd)
+        decompress_cnf(self.cnf_file, cnf_file)
+        return cnf_file, True
+
+    @profiling.profiled("vtree")
+    def vtree(self):
+        """
+            Creates the vtree next to the cnf file, from the cache, the vtree report
+            or by running miniC2D. source is 'cache', 'report' or 'minic2d'
+        """
+        if self.counter_backend:
+            raise PipelineError("the {} backend doesn't use a vtree".format(self.backend))
+        if not self.c2d:
+            raise PipelineError("the vtree and sdd stages require the c2d cnf type")
+        if self.network_vtree is not None:
+            return self.bif_vtree()
+        if self.compiler == "apply":
+            return self.apply_vtree()
+        if self.cnf_file is None:
+            self.write()
+        start_time = time.time()
+
+        vtree_name = strip_compression(self.cnf_file) + ".vtree"
+        result = {'vtree_file': vtree_name, 'output': None}
+
+        cached_vtree = None
+        if self.cache is not None:
+            cached_vtree = self.cache.get(self.sdd_key(), "minic2d.vtree")
+
+        if cached_vtree is not None:
+            result['source'] = 'cache'
+            shutil.copyfile(cached_vtree, vtree_name)
+        else:
+            cnf_file, temporary = self._plain_cnf()
+
+            # use the best vtree options of a previous sweep of the same cnf, the cnf is only hashed if there is one
+            report = load_json(self.vtree_report)
+            best = report.get(cnf_hash(cnf_file), {}).get('best_edges') if report else None
+
+            if best is not None and best['vtree'] is not None and os.path.exists(best['vtree']):
+                result['source'] = 'report'
+                result['report_vtree'] = best['vtree']
+                shutil.copyfile(best['vtree'], vtree_name)
+            else:
+                minic2d_args = [MINIC2D_PATH, '-c', cnf_file, '-o', vtree_name]
+                if best is not None:
+                    result['options'] = (best['opt'], best['m'])
+                    minic2d_args += ['-t', best['opt'], '-m', str(best['m'])]
+
+                result['source'] = 'minic2d'
+                with profiling.span("miniC2D"):
+                    minic2d = subprocess.run(minic2d_args, stdout=subprocess.PIPE)
+                result['output'] = minic2d.stdout.decode()
+
+            if temporary:
+                os.remove(cnf_file)
+
+            if result['source'] == 'minic2d':
+                if minic2d.returncode != 0:
+                    raise PipelineError("error creating vtree")
+            if self.cache is not None:
+                self.cache.put_file(self.sdd_key(), "minic2d.vtree", vtree_name)
+
+        self.vtree_file = vtree_name
+        return self._timed('vtree', start_time, result)
+
+    def bif_vtree(self):
+        """
+            Creates the vtree from the bif network (see bif_vtree.network_vtree) next to the cnf file,
+            or in the temporary directory if there is none. source is 'network'
+        """
+        if self.model_evidence is None:
+            self.encode()
+        if self.preprocessing and not self.preprocessed:
+            self.preprocess()
+        start_time = time.time()
+
+        if self.cnf_file is not None:
+            vtree_name = strip_compression(self.cnf_file) + ".vtree"
+        else:
+            vtree_name = self._work_file("model.vtree")
+        nodes = self.network if self.network is not None else read_bif(self.contents)
+        save_vtree(vtree_name, network_vtree(nodes, self.symbols, self.enc == 1, self.local_structure > 0,
+            self.network_vtree, self.elimination))
+        self.vtree_file = vtree_name
+
+        return self._timed('vtree', start_time, {
+            'vtree_file': vtree_name,
+            'source': 'network',
+            'shape': self.network_vtree,
+            'output': None
+        })
+
+    def apply_vtree(self):
+        """ Creates the initial vtree of the apply compiler in memory, source is 'apply' """
+        if self.model_evidence is None:
+            self.encode()
+        if self.preprocessing and not self.preprocessed:
+            self.preprocess()
+        start_time = time.time()
+
+        nvars = len(self.symbols)
+        if nvars == 0:
+            raise PipelineError("the model has no variables, an sdd needs at least one")
+        self.initial_vtree = Vtree(nvars, list(range(1, nvars + 1)), self.vtree_type)
+
+        return self._timed('vtree', start_time, {
+            'vtree_file': None,
+            'source': 'apply',
+            'vtree_type': self.vtree_type,
+            'output': None
+        })
+
+    def compile_network(self):
+        """ Builds the junction tree (ve backend) or belief propagation engine (bp backend) of the bif network """
+        if self.network is None:
+            self.parse()
+        start_time = time.time()
+
+        result = {'source': 'network'}
+        if self.backend == "ve":
+            self.engine = JunctionTree(self.network)
+            result['cliques'] = len(self.engine.cliques)
+            result['width'] = self.engine.width()
+        else:
+            self.engine = LoopyBP(self.network, **self.bp_options)
+            result['edges'] = len(self.engine.edge_var)
+
+        return self._timed('compile', start_time, result)
+
+    def compile_counter(self):
+        """ Creates the model counter (see model_counter.COUNTERS) of the integer clauses of a counter backend """
+        if self.model_evidence is None:
+            self.encode()
+        if self.preprocessing and not self.preprocessed:
+            self.preprocess()
+        start_time = time.time()
+
+        self.counter = COUNTERS[self.backend](self.ints, len(self.symbols))
+
+        return self._timed('compile', start_time, {
+            'source': 'counter',
+            'variables': len(self.symbols),
+            'clauses': len(self.ints)
+        })
+
+    @profiling.profiled("compile")
+    def compile(self):
+        """
+            Compiles the cnf into an sdd, source is 'cache', 'cnf' (miniC2D compiler), 'clauses' (apply compiler),
+            'network' (ve and bp backends) or 'counter' (counter backends)
+        """
+        if self.network_backend:
+            return self.compile_network()
+        if self.counter_backend:
+            return self.compile_counter()
+        if not self.c2d:
+            raise PipelineError("the vtree and sdd stages require the c2d cnf type")
+        start_time = time.time()
+
+        cached_sdd = None
+        cached_sdd_vtree = None
+        if self.cache is not None:
+            cached_sdd = self.cache.get(self.sdd_key(), "model.sdd")
+            cached_sdd_vtree = self.cache.get(self.sdd_key(), "sdd.vtree")
+
+        if cached_sdd is not None and cached_sdd_vtree is not None:
+            source = 'cache'
+            if self.symbols is None:
+                self.parse()
+            vtree = Vtree.from_file(cached_sdd_vtree.encode())
+            self.sdd = SddManager.from_vtree(vtree)
+            with profiling.span("sdd read"):
+                self.root = self.sdd.read_sdd_file(cached_sdd.encode())
+        elif self.compiler == "apply":
+            source = 'clauses'
+            if self.initial_vtree is None and self.vtree_file is None:
+                self.vtree()
+                start_time = time.time()
+            if self.initial_vtree is not None:
+                vtree = self.initial_vtree
+            else:
+                vtree = Vtree.from_file(self.vtree_file.encode())
+            self.sdd = SddManager.from_vtree(vtree)
+            with profiling.span("apply"):
+                self.root = compile_clauses(self.sdd, self.ints, self.minimize)
+        else:
+            source = 'cnf'
+            if self.vtree_file is None:
+                self.vtree()
+                # the time of the previous stages isn't part of this one
+                start_time = time.time()
+            cnf_file, temporary = self._plain_cnf()
+            vtree = Vtree.from_file(self.vtree_file.encode())
+            self.sdd = SddManager.from_vtree(vtree)
+            with profiling.span("sdd read"):
+                self.root = self.sdd.read_cnf_file(cnf_file.encode())
+            if temporary:
+                os.remove(cnf_file)
+
+        if source != 'cache' and self.cache is not None:
+            # the vtree is minimized during compilation, the sdd needs the final one
+            self.sdd.vtree().save(self.cache.reserve(self.sdd_key(), "sdd.vtree").encode())
+            self.cache.commit(self.sdd_key(), "sdd.vtree")
+            self.sdd.save(self.cache.reserve(self.sdd_key(), "model.sdd").encode(), self.root)
+            self.cache.commit(self.sdd_key(), "model.sdd")
+
+        if self.model_evidence is None:
+            self.encode()
+        if self.preprocessing and not self.preprocessed:
+            self.preprocess()
+        self.wmc = None
+        self.circuit = None
+        profiling.record("sdd", lambda: sdd_statistics(self.sdd, self.root))
+
+        return self._timed('compile', start_time, {
+            'source': source,
+            'node_count': self.sdd.count(),
+            'size': self.sdd.size()
+        })
+
+    def set_wmc_weights(self):
+        """ Sets the literal weights of the wmc manager to the weights of the symbol table """
+        for i, _, (w_pos, w_neg) in self.symbols.items():
+            self.wmc.set_literal_weight(self.sdd.literal(i), w_pos)
+            self.wmc.set_literal_weight(self.sdd.literal(-i), w_neg)
+
+    def count_counter(self):
+        """ Returns the model count and the weighted model count of the model counter """
+        if self.counter is None:
+            self.compile()
+        start_time = time.time()
+
+        model_count = self.counter.count([(1, 1)] * len(self.symbols))
+        weighted_count = self.counter.count(self.symbols.weights)
+        if self.mapping is not None:
+            weighted_count *= self.mapping.factor
+        profiling.record(self.backend, self.counter.statistics)
+
+        return self._timed('count', start_time, {
+            'model_count': model_count,
+            'weighted_count': weighted_count
+        })
+
+    @profiling.profiled("count")
+    def count(self):
+        """ Returns the model count and the weighted model count of the sdd (or the model counter) """
+        if self.network_backend:
+            raise PipelineError("the {} backend doesn't count models".format(self.backend))
+        if self.counter_backend:
+            return self.count_counter()
+        if self.root is None:
+            self.compile()
+        start_time = time.time()
+
+        self.wmc = self.root.wmc(log_mode=False)
+        with profiling.span("propagate"):
+            model_count = self.wmc.propagate()
+
+        assert self.sdd.var_count() == len(self.symbols)
+
+        self.set_wmc_weights()
+        with profiling.span("propagate"):
+            weighted_count = self.wmc.propagate()
+        if self.mapping is not None:
+            # the weight of the removed variables
+            weighted_count *= self.mapping.factor
+
+        return self._timed('count', start_time, {
+            'model_count': model_count,
+            'weighted_count': weighted_count
+        })
+
+    @profiling.profiled("learn")
+    def learn(self, max_iter=100, threshold=1e-5):
+        """
+            Learns the t(_) probabilities from the lfi interpretations with expectation maximization,
+            returns the iteration stats (iteration, log likelihood, max change, time) and the learned program
+        """
+        if self.interpretations is None:
+            raise PipelineError("no lfi interpretations loaded")
+        if self.wmc is None:
+            self.count()
+        start_time = time.time()
+
+        stats, converged = learn(self.sdd, self.wmc, self.symbols, self.params,
+            [self.model_evidence + ev_set for ev_set in self.interpretations],
+            max_iter, threshold, self.verbose)
+        self.circuit = None
+
+        return self._timed('learn', start_time, {
+            'parameters': len(self.params.values),
+            'interpretations': len(self.interpretations),
+            'stats': stats,
+            'converged': converged,
+            'program': learned_program(self.marked, self.params)
+        })
+
+    @profiling.profiled("query")
+    def query(self, queries=None, evidence_sets=None):
+        """
+            Returns the probabilities of the queries (the queries of the model by default).
+            Queries and evidence use variable names, evidence sets are lists of (name, value)
+            like the output of parse_evidence_sets.
+            With evidence sets (the loaded ones by default) every unique set is evaluated,
+            the result then contains 'evidence_sets': [(evidence, count, P(evidence), [(query, P)])]
+            and otherwise 'probabilities': [(query, P)]
+        """
+        if self.network_backend:
+            if self.engine is None:
+                self.compile()
+        elif self.counter_backend:
+            if self.counter is None:
+                self.compile()
+        elif self.wmc is None:
+            self.count()
+        start_time = time.time()
+
+        if queries is None:
+            queries = self.queries or []
+        if evidence_sets is None:
+            evidence_sets = self.evidence_sets
+
+        if self.mapping is not None:
+            for name in list(queries) + [name for ev_set in evidence_sets or [] for name, _ in ev_set]:
+                if name not in self.symbols:
+                    raise PipelineError("{} was removed by the cnf preprocessing".format(name))
+
+        if self.network_backend:
+            result = {}
+            if evidence_sets is not None:
+                queries = list(dict.fromkeys(queries))
+                result['evidence_sets'] = evaluate_evidence_sets_network(self.engine, self.state_vars, evidence_sets, queries)
+            else:
+                _, marginals = self.engine.marginals()
+                result['probabilities'] = []
+                for query in queries:
+                    name, i = self.state_vars[query]
+                    result['probabilities'].append((query, float(marginals[self.engine.index[name]][i])))
+            if self.backend == "bp":
+                result['iterations'] = self.engine.iterations
+                result['converged'] = bool(self.engine.converged)
+            return self._timed('query', start_time, result)
+
+        if self.counter_backend:
+            result = {}
+            if evidence_sets is not None:
+                queries = list(dict.fromkeys(queries))
+                ev_sets = [self.model_evidence + ev_set for ev_set in evidence_sets]
+                result['evidence_sets'] = evaluate_evidence_sets_counter(self.counter, self.symbols, ev_sets, queries)
+            else:
+                evidence = [self.symbols.literal(ev_name, ev_val) for ev_name, ev_val in self.model_evidence]
+                total, counts = self.counter.marginals(self.symbols.weights, evidence)
+                if total == 0:
+                    raise PipelineError("the weighted model count is 0")
+                result['probabilities'] = [(query, counts[self.symbols.id(query)] / total) for query in queries]
+            profiling.record(self.backend, self.counter.statistics)
+            return self._timed('query', start_time, result)
+
+        if self.evaluator == "numpy" and self.circuit is None:
+            with profiling.span("circuit"):
+                self.circuit = Circuit.from_sdd(self.root, self.sdd.var_count())
+
+        result = {}
+        if evidence_sets is not None:
+            queries = list(dict.fromkeys(queries))
+            ev_sets = [self.model_evidence + ev_set for ev_set in evidence_sets]
+            if self.evaluator == "numpy":
+                result['evidence_sets'] = evaluate_evidence_sets_circuit(self.circuit, self.symbols, ev_sets, queries)
+            else:
+                result['evidence_sets'] = evaluate_evidence_sets(self.sdd, self.wmc, self.symbols, ev_sets, queries)
+        elif self.evaluator == "numpy":
+            # all marginals in one upward and downward pass
+            _, marginals = self.circuit.marginals(*weight_arrays(self.symbols))
+            result['probabilities'] = [(query, float(marginals[self.symbols.id(query) - 1])) for query in queries]
+        else:
+            result['probabilities'] = [(query, self.wmc.literal_pr(self.sdd.literal(self.symbols.id(query))))
+                for query in queries]
+
+        return self._timed('query', start_time, result)
+
+    def stages(self, cnf_file=None):
+        """ Returns the (stage name, stage) pairs that run calls, in order """
+        if self.network_backend:
+            return [('parse', self.parse), ('compile', self.compile), ('query', self.query)]
+        stages = [('parse', self.parse), ('encode', self.encode)]
+        if self.preprocessing:
+            stages.append(('preprocess', self.preprocess))
+        if self.counter_backend:
+            if cnf_file is not None:
+                stages.append(('write', lambda: self.write(cnf_file)))
+            return stages + [('compile', self.compile), ('count', self.count), ('query', self.query)]
+        # the apply compiler only needs the cnf file if one is asked for
+        if cnf_file is not None or not self.c2d or self.compiler != "apply":
+            stages.append(('write', lambda: self.write(cnf_file)))
+        if self.c2d:
+            stages += [('vtree', self.vtree), ('compile', self.compile), ('count', self.count)]
+            if self.interpretations is not None:
+                stages.append(('learn', self.learn))
+            else:
+                stages.append(('query', self.query))
+        return stages
+
+    def run(self, cnf_file=None):
+        """ Runs all stages, returns a dict of stage name -> result """
+        results = {}
+        for name, stage in self.stages(cnf_file):
+            results[name] = stage()
+        return results
+
+    def close(self):
+        """ Removes the temporary files """
+        if self.work_dir is not None:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+            self.work_dir = None
+
+def compile_program(pl_file, cnf_file, options):
+    """ Parses, encodes and writes one problog program, used by compile_programs """
+    pipe = Pipeline(cnf_type=options.get('cnf_type', "c2d"), tseitin=options.get('tseitin', False),
+        ground_subprocess=options.get('ground_subprocess', False), local_structure=options.get('local_structure', 0),
+        preprocess=options.get('preprocess', False))
+    pipe.load(pl_file=pl_file)
+    result = {'pl_file': pl_file}
+    result.update(pipe.parse())
+    result.update(pipe.encode())
+    if pipe.preprocessing:
+        result.update(pipe.preprocess())
+    result.update(pipe.write(cnf_file))
+    result['time'] = sum(pipe.timings.values())
+    return result
+
+def compile_programs(pl_files, out_dir, jobs=None, **options):
+    """
+        Compiles the problog programs to cnf files in out_dir in a process pool,
+        options are cnf_type, tseitin, ground_subprocess, local_structure and preprocess.
+        Every program gets its own compiler, so the variable numbering doesn't depend on
+        the worker or the other programs. Returns the results in the order of pl_files
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    prefix = options.get('cnf_type', "c2d")
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = []
+        for pl_file in pl_files:
+            name = os.path.splitext(os.path.basename(pl_file))[0]
+            cnf_file = os.path.join(out_dir, prefix + "_" + name + ".cnf")
+            futures.append(pool.submit(compile_program, pl_file, cnf_file, options))
+        return [future.result() for future in futures]
 
 def main():
     arg_parser = argparse.ArgumentParser(description="problog pipeline")
     arg_parser.add_argument("--bif-file", "-b", help="The input bayesian network")
     arg_parser.add_argument("--pl-file", "-p", help="The input problog file")
 
-    arg_parser.add_argument("cnf_file", help="The output cnf file")
+    arg_parser.add_argument("cnf_file", nargs="?", help="The output cnf file (a temporary file if not given)")
 
     arg_parser.add_argument("--enc", "-e", default=1, help="The enc type 1 or 2", type=int)
     arg_parser.add_argument("--cnf-type", "-c", default="c2d", help="The type of cnf file to output (c2d for minic2d or cachet)")
 
-    arg_parser.add_argument("--verbose", "-v", default=False, help="Verbose output", type=bool, nargs='?', const=True)
-
-    args = arg_parser.parse_args()
+    arg_parser.add_argument("--sympy-cnf", default=False, help="Encode bif input through sympy to_cnf instead of emitting clauses directly", action="store_true")
 
-    if (args.bif_file is None and args.pl_file is None) or \
-        (args.bif_file is not None and args.pl_file is not None):
-        print("one input file required")
-        return -1
+    arg_parser.add_argument("--tseitin", default=False, help="Give every rule body of a problog head an auxiliary variable (linear cnf)", action="store_true")
 
-    c2d = True
-    if args.cnf_type == "c2d":
-        c2d = True
-    elif args.cnf_type == "cachet":
-        c2d = False
-    else:
-        print("unknwon cnf type")
-        return -1
+    arg_parser.add_argument("--local-structure", default=0, choices=[0, 1, 2], type=int,
+        help="Encode probabilities 0 and 1 as hard clauses and merge equal bif parameters (1), also merge the bif clauses (2)")
 
-    is_bif = args.bif_file is not None
-    file_name = args.bif_file if is_bif else args.pl_file
+    arg_parser.add_argument("--preprocess", default=False, help="Simplify the cnf before the vtree and sdd are built (unit propagation, subsumption, gate elimination)", action="store_true")
 
-    enc1 = args.enc == 1
-    verbose = args.verbose
+    arg_parser.add_argument("--compiler", default="minic2d", choices=list(COMPILERS),
+        help="Compile the cnf file with a miniC2D vtree (minic2d) or the clauses in-process with sdd apply operations, without files or miniC2D (apply)")
+    arg_parser.add_argument("--vtree-type", default="balanced", choices=list(VTREE_TYPES),
+        help="The initial vtree of the apply compiler")
+    arg_parser.add_argument("--minimize", default=None, dest="minimize", action="store_true",
+        help="Minimize the vtree dynamically while the apply compiler runs (the default unless --network-vtree is given)")
+    arg_parser.add_argument("--no-minimize", dest="minimize", action="store_false", help="Don't minimize the vtree during apply compilation")
 
-    contents = None
-    with open(file_name, 'r') as f:
-        contents = f.read()
+    arg_parser.add_argument("--network-vtree", choices=list(VTREE_SHAPES),
+        help="Build the vtree from the bif network instead of miniC2D / --vtree-type: a dtree of the elimination order with the variables of every node grouped (balanced) or right-linear in that order (right)")
+    arg_parser.add_argument("--elimination", default="min-fill", choices=list(ELIMINATION_HEURISTICS),
+        help="The elimination order heuristic of --network-vtree on the moral graph")
 
-    variables = None
-    cnf = None
-    weights = None
-    evidence = None
-    queries = None
+    arg_parser.add_argument("--evidence-file", help="Problog file with evidence sets separated by ----, the model is compiled once and evaluated for every set")
 
-    start_time = time.time()
+    arg_parser.add_argument("--lfi", help="Learn the t(_) probabilities of the problog file from the interpretations in this file (separated by ----)")
+    arg_parser.add_argument("--lfi-iterations", default=100, help="Maximum number of EM iterations", type=int)
+    arg_parser.add_argument("--lfi-threshold", default=1e-5, help="EM stops when the log likelihood changes less than this", type=float)
 
-    if is_bif:
-        variables, cnf, weights, queries = parse_bif(contents, enc1, verbose)
-    else:
-        variables, cnf, weights, evidence, queries = parse_srl(contents, verbose)
+    arg_parser.add_argument("--vtree-report", default=DEFAULT_REPORT, help="Report of knowledge_opts.py, the best vtree is used if the cnf was swept")
 
-    cnf_time = time.time()
+    arg_parser.add_argument("--evaluator", default="pysdd", choices=["pysdd", "numpy"],
+        help="Evaluate the queries with pysdd or on a numpy circuit (all marginals and evidence sets in one batch)")
+    arg_parser.add_argument("--cache-dir", help="Cache the ground program, cnf, vtree and sdd in this directory")
+    arg_parser.add_argument("--cache-size", default=512, help="Maximum size of the cache in MB", type=int)
 
-#    if verbose:
-#        print("cnf latex:")
-#        print(len(cnf.args))
-#        clauses = cnf.args
-#        for clause in clauses:
-#            print("$", latex_print(clause), "$")
-#            print()
+    arg_parser.add_argument("--backend", default="sdd", choices=["sdd"] + list(NETWORK_BACKENDS) + list(COUNTER_BACKENDS),
+        help="Compile the cnf to an sdd, (bif only) run inference on the network: exact with variable elimination / a junction tree (ve) or approximate with loopy belief propagation (bp), or count the cnf with the built-in component caching dpll counter, without miniC2D or cachet (dpll)")
+    arg_parser.add_argument("--bp-damping", default=0.0, help="Damping of the bp messages (0 is no damping)", type=float)
+    arg_parser.add_argument("--bp-tolerance", default=1e-6, help="bp stops when no message changes more than this", type=float)
+    arg_parser.add_argument("--bp-iterations", default=100, help="Maximum number of bp iterations", type=int)
 
-    ints = cnf_to_ints(cnf, variables)
+    arg_parser.add_argument("--ground-subprocess", default=False, help="Ground problog programs with a problog ground subprocess instead of in-process", action="store_true")
 
-    if evidence is not None:
-        for ev_name, ev_val in evidence:
-            idx = variables.index(ev_name)+1
-            if not ev_val:
-                idx = -idx
-            ints.append([idx])
+    arg_parser.add_argument("--profile", nargs="?", const="profile.json", metavar="TRACE_FILE",
+        help="Time the (nested) stages and trace their peak memory, prints a summary and writes a chrome trace (profile.json by default)")
 
-    save_cnf(args.cnf_file, ints, variables, weights, c2d)
+    arg_parser.add_argument("--verbose", "-v", default=False, help="Verbose output", type=bool, nargs='?', const=True)
 
-    vtree_time = None
+    args = arg_parser.parse_args()
 
-    if c2d:
-        vtree_name = args.cnf_file + ".vtree"
-        print("miniC2D:")
-        minic2d = subprocess.run(
-            [MINIC2D_PATH, '-c', args.cnf_file, '-o', vtree_name])
+    try:
+        pipe = Pipeline(enc=args.enc, cnf_type=args.cnf_type, sympy_cnf=args.sympy_cnf, tseitin=args.tseitin,
+            evaluator=args.evaluator, vtree_report=args.vtree_report, cache_dir=args.cache_dir,
+            cache_size=args.cache_size, ground_subprocess=args.ground_subprocess, backend=args.backend,
+            bp_damping=args.bp_damping, bp_tolerance=args.bp_tolerance, bp_iterations=args.bp_iterations,
+            local_structure=args.local_structure, preprocess=args.preprocess, compiler=args.compiler,
+            vtree_type=args.vtree_type, minimize=args.minimize, network_vtree=args.network_vtree,
+            elimination=args.elimination, verbose=args.verbose)
+        pipe.load(args.bif_file, args.pl_file, args.evidence_file, args.lfi)
+        if args.profile is None:
+            return run_cli(pipe, args)
+        profiling.start()
+        try:
+            result = run_cli(pipe, args)
+        finally:
+            profiler = profiling.stop()
+        print_profile(profiler, args.profile)
+        return result
+    except PipelineError as e:
+        print(e)
+        return -1
 
-        if minic2d.returncode != 0:
-            print("error creating vtree")
-            return -1
+def print_profile(profiler, trace_file):
+    """ Prints the spans, counters and statistics of the profiler and saves its chrome trace """
+    print()
+    print("profile:")
+    for line in profiler.summary():
+        print(line)
+    for name, value in sorted(profiler.counters.items()):
+        print("{}: {}".format(name, value))
+    for name, stats in profiler.stats.items():
+        print(name + ":", ", ".join(["{} {}".format(key, value) for key, value in stats.items()]))
+    profiler.save(trace_file)
+    print("trace written to", trace_file)
 
-        vtree_time = time.time()
+def run_cli(pipe, args):
+    """ Runs all stages of the pipeline and prints their results """
+    verbose = args.verbose
 
-        print("calculating sdd")
-        vtree = Vtree.from_file(vtree_name.encode())
-        sdd = SddManager.from_vtree(vtree)
-        root = sdd.read_cnf_file(args.cnf_file.encode())
+    start_time = time.time()
 
-        print("sdd node count:", sdd.count())
-        print("sdd size:", sdd.size())
-        if verbose:
-            sdd.print_stdout()
+    if pipe.network_backend:
+        pipe.parse()
+        compiled = pipe.compile()
+        if pipe.backend == "ve":
+            print("junction tree cliques:", compiled['cliques'], "width:", compiled['width'])
+        else:
+            print("factor graph edges:", compiled['edges'])
+        print()
+        queried = pipe.query()
+        if pipe.backend == "bp":
+            print("bp iterations:", queried['iterations'], "converged:", queried['converged'])
+            print()
+        print("queries:")
+        for query, pr in queried['probabilities']:
+            print("P(", query, ") =\t", pr)
+        print()
+        print("total time:\t", time.time() - start_time)
+        return 0
 
+    if pipe.parse()['cached']:
+        print("using cached encoding")
+    encoded = pipe.encode()
+    if pipe.preprocessing:
+        preprocessed = pipe.preprocess()
+        print("preprocessed cnf variables:", preprocessed['variables'], "->", preprocessed['preprocessed_variables'],
+            "clauses:", preprocessed['clauses'], "->", preprocessed['preprocessed_clauses'])
         print()
 
-        wmc = root.wmc(log_mode=False)
-        w = wmc.propagate()
-        print("model count:", w)
+    cnf_time = time.time()
 
-        nlits = sdd.var_count()
-        assert nlits == len(variables)
+    if args.cnf_file is not None or (not pipe.counter_backend and (not pipe.c2d or pipe.compiler != "apply")):
+        pipe.write(args.cnf_file)
+
+    vtree_time = None
+
+    if pipe.c2d or pipe.counter_backend:
+        if pipe.counter_backend:
+            vtree_time = time.time()
+            pipe.compile()
+            print("counting with the", pipe.backend, "counter")
+        else:
+            vtree = pipe.vtree()
+            if vtree['source'] == 'cache':
+                print("using cached vtree")
+            elif vtree['source'] == 'report':
+                print("using vtree from report:", vtree['report_vtree'])
+            elif vtree['source'] == 'apply':
+                print("using a", vtree['vtree_type'], "vtree")
+            elif vtree['source'] == 'network':
+                print("using the", vtree['shape'], "vtree of the network")
+            else:
+                if 'options' in vtree:
+                    print("using vtree options from report:", *vtree['options'])
+                print("miniC2D:")
+                print(vtree['output'], end="")
+
+            vtree_time = time.time()
+
+            compiled = pipe.compile()
+            if compiled['source'] == 'cache':
+                print("using cached sdd")
+            elif compiled['source'] == 'clauses':
+                print("compiling the clauses")
+            else:
+                print("calculating sdd")
+
+            print("sdd node count:", compiled['node_count'])
+            print("sdd size:", compiled['size'])
+            if verbose:
+                pipe.sdd.print_stdout()
 
-        for idx in range(nlits):
-            i = idx + 1
-            w_pos = weights[variables[idx]][0]
-            w_neg = weights[variables[idx]][1]
-            wmc.set_literal_weight(sdd.literal(i), w_pos)
-            wmc.set_literal_weight(sdd.literal(-i), w_neg)
-        w = wmc.propagate()
-        print("weighted count:", w)
         print()
-        print("queries:")
-        if queries is not None:
-            for query in queries:
-                idx = variables.index(query)+1
-                pr = wmc.literal_pr(sdd.literal(idx))
-                print("P(", query, ") =\t", pr)
 
+        counts = pipe.count()
+        print("model count:", counts['model_count'])
+        print("weighted count:", counts['weighted_count'])
+        print()
+
+        if pipe.interpretations is not None:
+            print("learning", len(pipe.params.values), "parameters from", len(pipe.interpretations), "interpretations")
+            learned = pipe.learn(args.lfi_iterations, args.lfi_threshold)
+            stats = learned['stats']
+            if verbose:
+                print("iteration\tlog likelihood\tmax change\ttime")
+                for iteration, ll, delta, it_time in stats:
+                    print("{}\t\t{}\t{}\t{}".format(iteration, ll, delta, it_time))
+            print("converged:", learned['converged'], "after", len(stats), "iterations",
+                "(threshold {})".format(args.lfi_threshold))
+            print("log likelihood:", stats[-1][1], "max change:", stats[-1][2])
+            print("em time:", sum([st[3] for st in stats]),
+                "per iteration:", sum([st[3] for st in stats]) / len(stats))
+            print()
+            print("learned program:")
+            print(learned['program'])
+            print()
+        elif pipe.evidence_sets is not None:
+            results = pipe.query()['evidence_sets']
+            print("evidence sets:", len(pipe.evidence_sets), "unique:", len(results))
+            for i, (ev_set, count, p_ev, probs) in enumerate(results):
+                print()
+                print("evidence set", i+1, "(x{}):".format(count),
+                    ", ".join(["{}={}".format(n, v) for n, v in ev_set]))
+                print("P( evidence ) =\t", p_ev)
+                if p_ev == 0:
+                    print("inconsistent evidence")
+                for query, pr in probs:
+                    print("P(", query, ") =\t", pr)
+        else:
+            print("queries:")
+            for query, pr in pipe.query()['probabilities']:
+                print("P(", query, ") =\t", pr)
 
     end_time = time.time()
 
     print()
-    print("cnf variables:", len(variables), "clauses: ", len(ints))
+    print("cnf variables:", encoded['variables'], "clauses: ", encoded['clauses'])
     print()
     print("total time:\t", end_time - start_time)
     print("cnf time:\t", cnf_time - start_time)
     if vtree_time is not None:
-        print("vtree time:\t", vtree_time - cnf_time)
+        if not pipe.counter_backend:
+            print("vtree time:\t", vtree_time - cnf_time)
         print("count time:\t", end_time - vtree_time)
 
     return 0
@@ -0,0 +1,279 @@
+#!/usr/bin/python3
+
+from symbols import SymbolTable
+
+# gate elimination is skipped for variables with more resolution pairs than this
+MAX_RESOLUTION_PAIRS = 1024
+
+class CnfMapping:
+    """
+        Maps the variables of a cnf to those of its preprocessed cnf.
+        ids maps the original ids to the new ids of the kept variables, fixed the removed
+        variables to their value and eliminated holds the removed variables that were summed out.
+        The weighted count of the original cnf is factor times that of the preprocessed cnf
+    """
+
+    def __init__(self, symbols, new_symbols, fixed, eliminated, factor):
+        self.symbols = symbols
+        self.new_symbols = new_symbols
+        self.ids = dict((symbols.id(name), idx) for idx, name in enumerate(new_symbols, 1))
+        self.fixed = fixed
+        self.eliminated = eliminated
+        self.factor = factor
+
+    def literal(self, lit):
+        """ Returns the literal of the preprocessed cnf, True / False if the variable was fixed and None if eliminated """
+        var = abs(lit)
+        if var in self.ids:
+            return self.ids[var] if lit > 0 else -self.ids[var]
+        if var in self.fixed:
+            return self.fixed[var] == (lit > 0)
+        return None
+
+class CnfPreprocessor:
+    """
+        Simplifies integer clauses while keeping the weighted model count:
+        unit propagation, removal of duplicate and subsumed clauses, fixing literals of which the
+        negation has weight 0 (a sound pure literal rule for weighted counting), summing out variables
+        that are in no clause, and bounded elimination of variables with equal weights that are
+        defined by a gate (and / or / equivalence), for which resolution keeps the count.
+        Protected variables are never removed, fixed protected variables keep a unit clause.
+        Clauses are sorted tuples indexed by an occurrence list per literal, removed clauses are None
+    """
+
+    def __init__(self, ints, symbols, protected=()):
+        self.symbols = symbols
+        self.protected = set(protected)
+        self.clauses = []
+        self.occurs = {}
+        self.units = []
+        # clauses added since the last subsumption check
+        self.added = []
+        # variables of which the clauses changed since the last gate elimination, None is all
+        self.touched = None
+        self.fixed = {}
+        self.eliminated = set()
+        self.factor = 1.0
+        self.conflict = False
+        for clause in ints:
+            self.add(clause)
+
+    def weight(self, lit):
+        w_pos, w_neg = self.symbols.weight(abs(lit))
+        return w_pos if lit > 0 else w_neg
+
+    def add(self, clause):
+        """ Adds a clause, tautologies are dropped and unit clauses are queued for propagation """
+        clause = tuple(sorted(set(clause), key=abs))
+        if len(set(map(abs, clause))) != len(clause):
+            return
+        if len(clause) == 0:
+            self.conflict = True
+        elif len(clause) == 1:
+            self.units.append(clause[0])
+        else:
+            idx = len(self.clauses)
+            self.clauses.append(clause)
+            self.added.append(idx)
+            for lit in clause:
+                self.occurs.setdefault(lit, set()).add(idx)
+                if self.touched is not None:
+                    self.touched.add(abs(lit))
+
+    def remove(self, idx):
+        for lit in self.clauses[idx]:
+            self.occurs[lit].discard(idx)
+            if self.touched is not None:
+                self.touched.add(abs(lit))
+        self.clauses[idx] = None
+
+    def occurrences(self, lit):
+        return self.occurs.get(lit, ())
+
+    def assign(self, lit):
+        """ Fixes the literal to true, the clauses are simplified """
+        var = abs(lit)
+        if var in self.fixed:
+            if self.fixed[var] != (lit > 0):
+                self.conflict = True
+            return
+        self.fixed[var] = lit > 0
+        if var not in self.protected:
+            self.factor *= self.weight(lit)
+        for idx in list(self.occurrences(lit)):
+            self.remove(idx)
+        for idx in list(self.occurrences(-lit)):
+            clause = self.clauses[idx]
+            self.remove(idx)
+            self.add([l for l in clause if l != -lit])
+
+    def propagate(self):
+        """ Unit propagation, returns whether anything changed """
+        changed = False
+        while self.units and not self.conflict:
+            self.assign(self.units.pop())
+            changed = True
+        return changed
+
+    def subsume(self):
+        """
+            Removes the clauses that are subsumed by (or duplicates of) a clause added since the last call,
+            returns whether anything changed
+        """
+        changed = False
+        occurs = self.occurs
+        order = sorted([i for i in self.added if self.clauses[i] is not None], key=lambda i: len(self.clauses[i]))
+        self.added = []
+        for idx in order:
+            clause = self.clauses[idx]
+            if clause is None:
+                continue
+            # every clause that contains this one also contains its rarest literal
+            rarest = min(clause, key=lambda lit: len(occurs[lit]))
+            for other in list(occurs[rarest]):
+                lits = self.clauses[other]
+                if other != idx and len(lits) >= len(clause) and all([lit in lits for lit in clause]):
+                    self.remove(other)
+                    changed = True
+        return changed
+
+    def eliminate_pure(self):
+        """
+            Fixes literals of which the negation has weight 0 and sums out the variables
+            that are in no clause, returns whether anything changed
+        """
+        changed = False
+        for var in range(1, len(self.symbols) + 1):
+            if var in self.protected or var in self.fixed or var in self.eliminated:
+                continue
+            w_pos, w_neg = self.symbols.weight(var)
+            if not self.occurrences(var) and not self.occurrences(-var):
+                self.eliminated.add(var)
+                self.factor *= w_pos + w_neg
+                changed = True
+            elif w_neg == 0 or w_pos == 0:
+                # only models with the other value count
+                self.assign(var if w_neg == 0 else -var)
+                self.propagate()
+                changed = True
+            if self.conflict:
+                break
+        return changed
+
+    def find_gate(self, var):
+        """
+            Returns the clauses of a gate defining var: a clause (x | l_1 | ... | l_k) and
+            the binary clauses (-x | -l_i) for x = var or -var, None if there is none
+        """
+        for x in (var, -var):
+            binaries = {}
+            for idx in self.occurrences(-x):
+                clause = self.clauses[idx]
+                if len(clause) == 2:
+                    other = clause[0] if clause[1] == -x else clause[1]
+                    binaries[-other] = idx
+            if not binaries:
+                continue
+            for idx in self.occurrences(x):
+                inputs = [lit for lit in self.clauses[idx] if lit != x]
+                if all([lit in binaries for lit in inputs]):
+                    return set([idx] + [binaries[lit] for lit in inputs])
+        return None
+
+    def resolvents(self, var, gate, limit):
+        """
+            Returns the resolvents of the gate clauses with the other clauses of var, tautologies are dropped.
+            None if there are more than limit
+        """
+        pos = self.occurrences(var)
+        neg = self.occurrences(-var)
+        # resolvents of two gate or two non gate clauses are implied by the others
+        pairs = [(p, n) for p in pos & gate for n in neg - gate] + [(p, n) for p in pos - gate for n in neg & gate]
+        result = []
+        for p, n in pairs:
+            lits = set(self.clauses[p]) | set(self.clauses[n])
+            lits.discard(var)
+            lits.discard(-var)
+            if not any([-lit in lits for lit in lits]):
+                result.append(lits)
+                if len(result) > limit:
+                    return None
+        return result
+
+    def eliminate_gates(self):
+        """
+            Eliminates variables with equal positive and negative weight that are defined by a gate,
+            if the resolvents aren't more clauses than the clauses they replace.
+            A defined variable has one value per model of the other variables,
+            so the count is its weight times the count of the resolvents. Returns whether anything changed
+        """
+        changed = False
+        candidates = range(1, len(self.symbols) + 1) if self.touched is None else sorted(self.touched)
+        self.touched = set()
+        for var in candidates:
+            if var in self.protected or var in self.fixed or var in self.eliminated:
+                continue
+            w_pos, w_neg = self.symbols.weight(var)
+            npos = len(self.occurrences(var))
+            nneg = len(self.occurrences(-var))
+            if w_pos != w_neg or npos == 0 or nneg == 0 or npos * nneg > MAX_RESOLUTION_PAIRS:
+                continue
+            gate = self.find_gate(var)
+            if gate is None:
+                continue
+            resolvents = self.resolvents(var, gate, npos + nneg)
+            if resolvents is None:
+                continue
+            for idx in list(self.occurrences(var)) + list(self.occurrences(-var)):
+                self.remove(idx)
+            for lits in resolvents:
+                self.add(lits)
+            self.eliminated.add(var)
+            self.factor *= w_pos
+            self.propagate()
+            changed = True
+            if self.conflict:
+                break
+        return changed
+
+    def run(self, max_rounds=10):
+        """ Applies all steps until nothing changes, returns False if the cnf is unsatisfiable """
+        self.propagate()
+        for _ in range(max_rounds):
+            if self.conflict:
+                break
+            changed = self.subsume()
+            changed = self.eliminate_pure() or changed
+            changed = self.eliminate_gates() or changed
+            if not changed:
+                break
+        return not self.conflict
+
+    def result(self):
+        """ Returns (clauses, symbol table, CnfMapping) of the preprocessed cnf, the kept variables are renumbered in order """
+        new_symbols = SymbolTable()
+        for idx, name, weight in self.symbols.items():
+            if idx in self.protected or (idx not in self.fixed and idx not in self.eliminated):
+                new_symbols.add(name, weight)
+        mapping = CnfMapping(self.symbols, new_symbols, dict([(var, value) for var, value in self.fixed.items()
+            if var not in self.protected]), self.eliminated, self.factor)
+
+        ints = []
+        for var, value in sorted(self.fixed.items()):
+            if var in self.protected:
+                ints.append([mapping.literal(var if value else -var)])
+        for clause in self.clauses:
+            if clause is not None:
+                ints.append([mapping.literal(lit) for lit in clause])
+        return ints, new_symbols, mapping
+
+def preprocess_cnf(ints, symbols, protected=(), max_rounds=10):
+    """
+        Preprocesses the integer clauses (see CnfPreprocessor), protected are the ids of the
+        variables that must stay (queries, evidence, learned weights).
+        Returns (clauses, symbol table, CnfMapping), or None if the cnf is unsatisfiable
+    """
+    preprocessor = CnfPreprocessor(ints, symbols, protected)
+    if not preprocessor.run(max_rounds):
+        return None
+    return preprocessor.result()
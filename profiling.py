@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+
+import os
+import json
+import time
+import functools
+import tracemalloc
+
+from contextlib import nullcontext
+
+# the active profiler, None when profiling is off
+_profiler = None
+
+# returned by span when profiling is off
+NULL_SPAN = nullcontext()
+
+class Span:
+    """ A timed section of a profiler, nested spans are timed separately and as part of their parent """
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.profiler.enter(self)
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.exit(self)
+        return False
+
+class Profiler:
+    """
+        Collects nested spans and counters. A span records its start, duration and depth
+        and with trace_memory the peak traced memory (tracemalloc) while it ran and the memory
+        it left allocated. tracemalloc has one peak for the whole process, so the peak is reset
+        when a span starts and the peak of every parent is updated when a child ends.
+        Counters are numbers that are added up, stats are dicts of values (like the sdd manager
+        statistics), both are only computed when profiling is on.
+    """
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.events = []
+        self.counters = {}
+        self.stats = {}
+        self.stack = []
+        self.started_tracing = False
+        self.origin = time.perf_counter()
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        self.origin = time.perf_counter()
+
+    def stop(self):
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def enter(self, span):
+        span.depth = len(self.stack)
+        span.peak = 0
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.stack:
+                self.stack[-1].peak = max(self.stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            span.memory = current
+        self.stack.append(span)
+        span.start = time.perf_counter()
+
+    def exit(self, span):
+        end = time.perf_counter()
+        self.stack.pop()
+        event = {
+            'name': span.name,
+            'start': span.start - self.origin,
+            'duration': end - span.start,
+            'depth': span.depth,
+            'args': span.args
+        }
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            span.peak = max(span.peak, peak)
+            event['peak_mb'] = span.peak / 2**20
+            event['allocated_mb'] = (current - span.memory) / 2**20
+            if self.stack:
+                self.stack[-1].peak = max(self.stack[-1].peak, span.peak)
+            tracemalloc.reset_peak()
+        self.events.append(event)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def record(self, name, values):
+        self.stats[name] = values
+
+    def summary(self):
+        """ Returns the spans in start order as lines of an indented table """
+        lines = ["{:<40} {:>10}".format("span", "time (s)") + (" {:>10} {:>10}".format("peak MB", "alloc MB")
+            if self.trace_memory else "")]
+        for event in sorted(self.events, key=lambda e: (e['start'], e['depth'])):
+            label = "  " * event['depth'] + " ".join([event['name']] + [str(v) for v in event['args'].values()])
+            line = "{:<40} {:>10.4f}".format(label[:40], event['duration'])
+            if self.trace_memory:
+                line += " {:>10.2f} {:>10.2f}".format(event['peak_mb'], event['allocated_mb'])
+            lines.append(line)
+        return lines
+
+    def chrome_trace(self):
+        """
+            Returns the spans as complete events of the chrome trace event format,
+            which chrome://tracing and Perfetto can load. Times are in microseconds
+        """
+        pid = os.getpid()
+        events = []
+        for event in self.events:
+            args = dict(event['args'])
+            if self.trace_memory:
+                args['peak_mb'] = event['peak_mb']
+                args['allocated_mb'] = event['allocated_mb']
+            events.append({
+                'name': event['name'],
+                'ph': 'X',
+                'ts': event['start'] * 1e6,
+                'dur': event['duration'] * 1e6,
+                'pid': pid,
+                'tid': 0,
+                'args': args
+            })
+        end = max([e['start'] + e['duration'] for e in self.events]) if self.events else 0
+        if self.counters:
+            events.append({'name': 'counters', 'ph': 'C', 'ts': end * 1e6, 'pid': pid, 'tid': 0, 'args': self.counters})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': self.stats}
+
+    def save(self, fname):
+        with open(fname, 'w') as f:
+            json.dump(self.chrome_trace(), f, indent=1)
+
+def start(trace_memory=True):
+    """ Turns profiling on, returns the profiler """
+    global _profiler
+    _profiler = Profiler(trace_memory)
+    _profiler.start()
+    return _profiler
+
+def stop():
+    """ Turns profiling off, returns the profiler that was active """
+    global _profiler
+    profiler = _profiler
+    _profiler = None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+def enabled():
+    return _profiler is not None
+
+def span(name, **args):
+    """ Returns a context manager that times its block, a shared no-op when profiling is off """
+    if _profiler is None:
+        return NULL_SPAN
+    return Span(_profiler, name, args)
+
+def profiled(name):
+    """ Decorator that runs the function in a span """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return fn(*args, **kwargs)
+            with Span(_profiler, name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name, n=1):
+    """ Adds n to a counter, n can be a function that is only called when profiling is on """
+    if _profiler is not None:
+        _profiler.count(name, n() if callable(n) else n)
+
+def record(name, values):
+    """ Records statistics, values is a function returning a dict that is only called when profiling is on """
+    if _profiler is not None:
+        _profiler.record(name, values())
@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+
+from pysdd.sdd import SddManager, Vtree
+
+# the initial vtree shapes of the in-process compiler
+VTREE_TYPES = ("balanced", "right", "left", "vertical")
+
+def vtree_nodes(vtree):
+    """
+        Returns the nodes of the vtree in post order as (position, variable, left, right),
+        variable is None for internal nodes and left / right are None for leaves
+    """
+    nodes = []
+    todo = [(vtree, False)]
+    while todo:
+        node, expanded = todo.pop()
+        if node.is_leaf():
+            nodes.append((node.position(), node.var(), None, None))
+        elif expanded:
+            nodes.append((node.position(), None, node.left().position(), node.right().position()))
+        else:
+            todo.append((node, True))
+            todo.append((node.right(), False))
+            todo.append((node.left(), False))
+    return nodes
+
+def clause_groups(ints, nodes):
+    """
+        Assigns every clause to the lca of its variables in the vtree (the nodes of vtree_nodes),
+        returns position -> clauses, shortest first. Positions are in-order, so the lca is the
+        node where the smallest and largest position of the clause go to different sides
+    """
+    leaf = dict((var, pos) for pos, var, _, _ in nodes if var is not None)
+    children = dict((pos, (left, right)) for pos, var, left, right in nodes if var is None)
+    root = nodes[-1][0]
+
+    groups = {}
+    for clause in ints:
+        positions = [leaf[abs(lit)] for lit in clause]
+        lo, hi = min(positions), max(positions)
+        node = root
+        while node in children and (hi < node or lo > node):
+            node = children[node][0] if hi < node else children[node][1]
+        groups.setdefault(node, []).append(clause)
+    for clauses in groups.values():
+        clauses.sort(key=len)
+    return groups
+
+def compile_clauses(manager, ints, minimize=False):
+    """
+        Compiles the integer clauses with the apply operations of the manager.
+        The clauses are conjoined bottom up along the vtree: the sdd of a vtree node is the
+        conjunction of the sdds of its children and of the clauses that have it as lca, so
+        every conjoin works on the variables of one subtree. With minimize set the manager
+        garbage collects and minimizes the vtree dynamically during compilation. The grouping and
+        the order of the conjoins follow the initial vtree, after a minimization they are only an
+        order of the clauses (the result is the same). Returns the root sdd node (referenced)
+    """
+    if minimize:
+        manager.auto_gc_and_minimize_on()
+    else:
+        manager.auto_gc_and_minimize_off()
+
+    if any([len(clause) == 0 for clause in ints]):
+        root = manager.false()
+        root.ref()
+        return root
+
+    # nodes are referenced while they are used, so garbage collection keeps them
+    def apply(op, a, b):
+        if a is None:
+            return b
+        result = op(a, b)
+        result.ref()
+        a.deref()
+        b.deref()
+        return result
+
+    def clause_sdd(clause):
+        result = None
+        for lit in clause:
+            literal = manager.literal(lit)
+            literal.ref()
+            result = apply(manager.disjoin, result, literal)
+        return result
+
+    nodes = vtree_nodes(manager.vtree())
+    groups = clause_groups(ints, nodes)
+
+    sdds = {}
+    for pos, _, left, right in nodes:
+        result = None
+        for child in (left, right):
+            if child is not None and sdds.get(child) is not None:
+                result = apply(manager.conjoin, result, sdds.pop(child))
+        for clause in groups.get(pos, []):
+            result = apply(manager.conjoin, result, clause_sdd(clause))
+        sdds[pos] = result
+
+    root = sdds[nodes[-1][0]]
+    if root is None:
+        root = manager.true()
+        root.ref()
+    if not minimize:
+        # the intermediate sdds are dead now
+        manager.garbage_collect()
+    return root
+
+def compile_cnf(ints, nvars, vtree_type="balanced", var_order=None, minimize=False):
+    """ Returns (manager, root) of the clauses compiled on a new vtree of the given type and variable order """
+    if var_order is None:
+        var_order = list(range(1, nvars + 1))
+    vtree = Vtree(nvars, var_order, vtree_type)
+    manager = SddManager.from_vtree(vtree)
+    return manager, compile_clauses(manager, ints, minimize)
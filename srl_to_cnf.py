@@ -6,267 +6,488 @@ import subprocess
 import problog
 import sympy
 
+from problog.program import PrologString, ExtendedPrologFactory
+from problog.parser import DefaultPrologParser
+from problog.formula import LogicFormula
+
 from sympy.logic.boolalg import Not, And, Or, Equivalent, to_cnf
 
-variables = {}
+from symbols import SymbolTable
+from profiling import span, profiled
 
 def term_to_var_name(term):
     return term.functor + '_' + '_'.join(map(str, term.args))
 
-curVarId = 1
-def get_var(name, prob=None):
-    global curVarId
-    if name in variables:
-        if prob is not None:
-            variables[name] = (variables[name][0], prob)
-        return variables[name]
-    else:
-        ret = (sympy.Symbol(name), prob)
-        variables[name] = ret
-        curVarId += 1
-        return ret
-
 def add_clause(clauses, name, form):
     if name in clauses:
         clauses[name].append(form)
     else:
         clauses[name] = [form]
 
-def parse_formula(formula):
-    if type(formula) is problog.logic.Term:
-        name = term_to_var_name(formula)
-        return get_var(name)[0]
-    elif type(formula) is problog.logic.And:
-        f1 = parse_formula(formula.op1)
-        f2 = parse_formula(formula.op2)
-        return f1 & f2
-    elif type(formula) is problog.logic.Or:
-        f1 = parse_formula(formula.op1)
-        f2 = parse_formula(formula.op2)
-        return f1 | f2
-    elif type(formula) is problog.logic.Not:
-        f1 = parse_formula(formula.child)
-        return ~f1
-    else:
-        raise Exception("unknown formula: " + str(formula))
-
-def parse_srl(contents, verbose):
-    grounded = subprocess.run(['problog', 'ground', '-'],
-        stdout=subprocess.PIPE, input=contents.encode())
-    grounded_str = grounded.stdout.decode()
-    #grounded_str = ""
-
-    # TODO: first variable pass and then built clauses as order isn't preserved
-    #with open(pl_file_name, "r") as f:
-    #    grounded_str = f.read()
-
+def evidence_literal(term):
+    """
+        Returns (atom, var_name, value) of an evidence(atom), evidence(\\+atom)
+        or evidence(atom, true/false) term
+    """
+    func = term.args[0]
+    value = True
+    if func.functor == '\\+':
+        func = func.args[0]
+        value = False
+    if len(term.args) > 1 and term.args[1].functor == 'false':
+        value = not value
+    return func, term_to_var_name(func), value
+
+def parse_evidence_sets(contents):
+    """
+        Parses a file of evidence blocks separated by lines starting with ----,
+        returns the list of evidence sets (lists of (var_name, value)) and the list of observed atoms
+    """
     factory = problog.program.PrologFactory()
     parser = problog.parser.PrologParser(factory)
-    parsed = parser.parseString(grounded_str)
-
-    clauses = {} # map of name to list of formulas, which need to be ored
-
-    disjunctions = [] # list of disjunctions: list of list of var names that are xor [['a1', 'a2'], ['b1', 'b2', 'b3']]
 
-    evidence = [] # list of evidence (var_name, evidence = true or false)
-    queries = [] # list of variables to query
-
-    for clause in parsed:
-        if verbose:
-            print(type(clause))
-            print(clause)
-
-        if type(clause) is problog.logic.Clause:
-            head = clause.head
-            if verbose:
-                print(head)
-            head_name = term_to_var_name(head)
-
-            body = clause.body
-            if verbose:
-                print(body)
-                print(type(body))
-
-            bform = parse_formula(body)
-
-            # handle probability
-            if head.probability is not None:
-                temp_name = head_name + "_p" + str(curVarId)
-                v = get_var(temp_name, head.probability)
-                bform &= v[0]
-
-            if head_name in clauses:
-                clauses[head_name].append(bform)
-            else:
-                if head_name not in variables:
-                    get_var(head_name, None) # No probability, handled above
-                clauses[head_name] = [bform]
-
-        elif type(clause) is problog.logic.Or:
-            # disjunction with probabilities
-            disj = []
-            ors = [clause]
-            terms = []
-
-            while len(ors) > 0:
-                cur_or = ors.pop()
-                e1 = cur_or.op1
-                e2 = cur_or.op2
-
-                if type(e1) is problog.logic.Or:
-                    ors.append(e1)
-                else:
-                    terms.append(e1)
-
-                if type(e2) is problog.logic.Or:
-                    ors.append(e2)
+    blocks = [[]]
+    for line in contents.splitlines():
+        if line.startswith('----'):
+            blocks.append([])
+        else:
+            blocks[-1].append(line)
+
+    evidence_sets = []
+    atoms = {}
+    for block in blocks:
+        block_str = "\n".join(block)
+        if block_str.strip() == "":
+            continue
+        ev_set = []
+        for clause in parser.parseString(block_str):
+            if type(clause) is problog.logic.Term and clause.functor == "evidence":
+                atom, name, value = evidence_literal(clause)
+                atoms[name] = atom
+                ev_set.append((name, value))
+        evidence_sets.append(ev_set)
+    return evidence_sets, list(atoms.values())
+
+def unique_evidence_sets(evidence_sets):
+    """
+        Groups identical evidence sets (in any order of their literals),
+        returns a list of (evidence set, number of occurrences) in order of first occurrence
+    """
+    unique = {}
+    for ev_set in evidence_sets:
+        key = frozenset(ev_set)
+        if key in unique:
+            unique[key][1] += 1
+        else:
+            unique[key] = [ev_set, 1]
+    return [(ev_set, count) for ev_set, count in unique.values()]
+
+def is_literal(formula):
+    return type(formula) is sympy.Symbol or \
+        (type(formula) is Not and type(formula.args[0]) is sympy.Symbol)
+
+def learnable_param(lfi, prob):
+    """ Returns the learnable parameter of the probability, None if it is fixed """
+    return lfi.param(prob) if lfi is not None else None
+
+@profiled("ground")
+def ground_formula(contents):
+    """ Grounds the problog program in-process with the options of problog ground """
+    program = PrologString(contents, parser=DefaultPrologParser(ExtendedPrologFactory()))
+    return LogicFormula.create_from(program, label_all=True, avoid_name_clash=True, keep_order=True)
+
+def ground_clauses(formula):
+    """
+        Yields the clauses of the ground program as PrologParser would parse
+        the output of problog ground (LogicFormula.to_prolog)
+    """
+    fail = problog.logic.Term('fail')
+    for clause in formula.enum_clauses():
+        # annotated disjunctions with a body are clauses with a disjunction as head
+        if type(clause) is problog.logic.Clause and type(clause.head) is problog.logic.Or:
+            yield problog.logic.AnnotatedDisjunction(clause.head.to_list(), clause.body)
+        else:
+            yield clause
+
+    for qn, qi in formula.queries():
+        if not problog.logic.is_ground(qn):
+            continue
+        if formula.is_true(qi):
+            yield problog.logic.Clause(-qn, fail) if qn.is_negated() else qn
+        elif formula.is_false(qi):
+            yield -qn if qn.is_negated() else problog.logic.Clause(qn, fail)
+        yield problog.logic.Term('query', qn)
+
+    for qn, qi in formula.evidence():
+        if formula.is_true(qi):
+            yield problog.logic.Clause(-qn, fail) if qn.is_negated() else qn
+        elif formula.is_false(qi):
+            yield -qn if qn.is_negated() else problog.logic.Clause(qn, fail)
+        elif qi < 0:
+            yield problog.logic.Term('evidence', problog.logic.Not('\\+', qn))
+            continue
+        yield problog.logic.Term('evidence', qn)
+
+def ground_program(contents, use_subprocess=False):
+    """
+        Grounds the problog program, returns the ground program as text,
+        with use_subprocess problog ground is run in a separate process
+    """
+    if not use_subprocess:
+        return ground_formula(contents).to_prolog()
+    with span("ground subprocess"):
+        grounded = subprocess.run(['problog', 'ground', '-'],
+            stdout=subprocess.PIPE, input=contents.encode())
+    return grounded.stdout.decode()
+
+class SrlCompiler:
+    """
+        Translates a ground problog program into cnf. Every compiler owns its variables
+        and id counter, so separate compilers (and parse_srl calls) don't share state
+        and the same program always gets the same variable names and numbering.
+    """
+
+    def __init__(self, verbose=False, tseitin=False, lfi=None, determinism=False):
+        """
+            with tseitin set heads with multiple rule bodies get an auxiliary variable per body,
+            the variables of learnable probabilities (lfi_t(k)) are registered in lfi,
+            with determinism set probabilities 0 and 1 get no variable (see deterministic)
+        """
+        self.variables = {} # var name -> (sympy symbol, probability)
+        self.cur_var_id = 1
+        self.verbose = verbose
+        self.tseitin = tseitin
+        self.lfi = lfi
+        self.determinism = determinism
+
+    def deterministic(self, prob):
+        """
+            Returns sympy.true / sympy.false if determinism is set and the fixed probability is 1 / 0,
+            the probabilistic variable is then replaced by that constant. None otherwise
+        """
+        if not self.determinism or prob is None:
+            return None
+        p = float(prob)
+        if p == 1:
+            return sympy.true
+        if p == 0:
+            return sympy.false
+        return None
+
+    def get_var(self, name, prob=None):
+        if name in self.variables:
+            if prob is not None:
+                self.variables[name] = (self.variables[name][0], prob)
+            return self.variables[name]
+        else:
+            ret = (sympy.Symbol(name), prob)
+            self.variables[name] = ret
+            self.cur_var_id += 1
+            return ret
+
+    def parse_formula(self, formula):
+        if type(formula) is problog.logic.Term:
+            name = term_to_var_name(formula)
+            return self.get_var(name)[0]
+        elif type(formula) is problog.logic.And:
+            f1 = self.parse_formula(formula.op1)
+            f2 = self.parse_formula(formula.op2)
+            return f1 & f2
+        elif type(formula) is problog.logic.Or:
+            f1 = self.parse_formula(formula.op1)
+            f2 = self.parse_formula(formula.op2)
+            return f1 | f2
+        elif type(formula) is problog.logic.Not:
+            f1 = self.parse_formula(formula.child)
+            return ~f1
+        else:
+            raise Exception("unknown formula: " + str(formula))
+
+    def tseitin_body(self, head_name, body, formulas):
+        """
+            Returns an auxiliary variable equivalent to the rule body (or the body itself if it is a literal),
+            the definition is added to formulas. The auxiliary variable has neutral weights.
+        """
+        if is_literal(body):
+            return body
+        aux = self.get_var(head_name + "_b" + str(self.cur_var_id))[0]
+        formulas.append(Equivalent(aux, body))
+        return aux
+
+    def compile(self, parsed):
+        """
+            Encodes the clauses of a ground program (parsed problog clauses),
+            returns (symbols, cnf, evidence, queries)
+        """
+        clauses = {} # map of name to list of formulas, which need to be ored
+
+        disjunctions = [] # list of disjunctions: list of list of var names that are xor [['a1', 'a2'], ['b1', 'b2', 'b3']]
+
+        evidence = [] # list of evidence (var_name, evidence = true or false)
+        queries = [] # list of variables to query
+
+        for clause in parsed:
+            if self.verbose:
+                print(type(clause))
+                print(clause)
+
+            if type(clause) is problog.logic.Clause:
+                head = clause.head
+                if self.verbose:
+                    print(head)
+                head_name = term_to_var_name(head)
+
+                body = clause.body
+                if self.verbose:
+                    print(body)
+                    print(type(body))
+
+                bform = self.parse_formula(body)
+
+                # handle probability
+                if head.probability is not None:
+                    temp_name = head_name + "_p" + str(self.cur_var_id)
+                    prob = head.probability
+                    param = learnable_param(self.lfi, prob)
+                    const = self.deterministic(prob) if param is None else None
+                    if const is not None:
+                        bform &= const
+                    else:
+                        if param is not None:
+                            prob = self.lfi.value(param, 0.5)
+                            self.lfi.add_fact(temp_name, param)
+                        v = self.get_var(temp_name, prob)
+                        bform &= v[0]
+
+                if head_name in clauses:
+                    clauses[head_name].append(bform)
                 else:
-                    terms.append(e2)
-
-            if verbose:
-                print("terms: ", terms)
-
-            disj = []
-            for term in terms:
-                name = term_to_var_name(term)
-                name_alter = name + "_a" + str(curVarId)
-                get_var(name)
-                get_var(name_alter, term.probability)
-                add_clause(clauses, name, variables[name_alter][0]) # equivalance between vars
-                disj.append((name, name_alter))
-            disjunctions.append((disj, None))
-
-        elif type(clause) is problog.logic.AnnotatedDisjunction:
-            # create variable for clause:
-            head_name = "temp_" + str(curVarId)
-            get_var(head_name)
-
-            sum_prob = 0
-            # create var for each head:
-            disj = []
-            for head in clause.heads:
-                name = term_to_var_name(head)
-                name_alter = name + "_a" + str(curVarId)
-                get_var(name)
-                get_var(name_alter, head.probability)
-                add_clause(clauses, name, variables[name_alter][0])
-                disj.append((name, name_alter))
-                sum_prob += float(head.probability)
-
-            if sum_prob < 1:
-                rest = 1 - sum_prob
-                name = "temp_" + str(curVarId)
-                get_var(name, rest)
-                disj.append((None, name))
-
-            disjunctions.append((disj, head_name))
-
-            if verbose:
-                print("heads: ", disj)
-
-            bodyf = parse_formula(clause.body)
-            clauses[head_name] = [bodyf]
-        elif type(clause) is problog.logic.Term:
-            if clause.functor == "query":
-                queries.append(term_to_var_name(clause.args[0]))
-            elif clause.functor == "evidence":
-                func = clause.args[0]
-                if func.functor == '\\+':
-                    evidence.append((term_to_var_name(func.args[0]), False))
+                    if head_name not in self.variables:
+                        self.get_var(head_name, None) # No probability, handled above
+                    clauses[head_name] = [bform]
+
+            elif type(clause) is problog.logic.Or:
+                # disjunction with probabilities
+                disj = []
+                ors = [clause]
+                terms = []
+
+                while len(ors) > 0:
+                    cur_or = ors.pop()
+                    e1 = cur_or.op1
+                    e2 = cur_or.op2
+
+                    if type(e1) is problog.logic.Or:
+                        ors.append(e1)
+                    else:
+                        terms.append(e1)
+
+                    if type(e2) is problog.logic.Or:
+                        ors.append(e2)
+                    else:
+                        terms.append(e2)
+
+                if self.verbose:
+                    print("terms: ", terms)
+
+                disj = []
+                for term in terms:
+                    name = term_to_var_name(term)
+                    name_alter = name + "_a" + str(self.cur_var_id)
+                    prob = term.probability
+                    param = learnable_param(self.lfi, prob)
+                    if param is None and self.deterministic(prob) is sympy.false:
+                        # the alternative never holds
+                        self.get_var(name)
+                        add_clause(clauses, name, sympy.false)
+                        continue
+                    if param is not None:
+                        prob = self.lfi.value(param, 1 / len(terms))
+                        self.lfi.add_choice(name_alter, param, None)
+                    self.get_var(name)
+                    self.get_var(name_alter, prob)
+                    add_clause(clauses, name, self.variables[name_alter][0]) # equivalance between vars
+                    disj.append((name, name_alter))
+                disjunctions.append((disj, None))
+
+            elif type(clause) is problog.logic.AnnotatedDisjunction:
+                # create variable for clause:
+                head_name = "temp_" + str(self.cur_var_id)
+                self.get_var(head_name)
+
+                sum_prob = 0
+                learned = False
+                # create var for each head:
+                disj = []
+                for head in clause.heads:
+                    name = term_to_var_name(head)
+                    name_alter = name + "_a" + str(self.cur_var_id)
+                    prob = head.probability
+                    param = learnable_param(self.lfi, prob)
+                    if param is None and self.deterministic(prob) is sympy.false:
+                        self.get_var(name)
+                        add_clause(clauses, name, sympy.false)
+                        continue
+                    if param is not None:
+                        prob = self.lfi.value(param, 1 / (len(clause.heads) + 1))
+                        self.lfi.add_choice(name_alter, param, head_name)
+                        learned = True
+                    self.get_var(name)
+                    self.get_var(name_alter, prob)
+                    add_clause(clauses, name, self.variables[name_alter][0])
+                    disj.append((name, name_alter))
+                    sum_prob += float(prob)
+
+                # learned disjunctions always get a rest variable
+                if sum_prob < 1 or learned:
+                    rest = max(1 - sum_prob, 0)
+                    name = "temp_" + str(self.cur_var_id)
+                    self.get_var(name, rest)
+                    disj.append((None, name))
+                    if learned:
+                        self.lfi.add_rest(name, [alter for _, alter in disj[:-1]])
+
+                disjunctions.append((disj, head_name))
+
+                if self.verbose:
+                    print("heads: ", disj)
+
+                bodyf = self.parse_formula(clause.body)
+                clauses[head_name] = [bodyf]
+            elif type(clause) is problog.logic.Term:
+                if clause.functor == "query":
+                    queries.append(term_to_var_name(clause.args[0]))
+                elif clause.functor == "evidence":
+                    evidence.append(evidence_literal(clause)[1:])
                 else:
-                    evidence.append((term_to_var_name(func), True))
-            else:
-                name = term_to_var_name(clause)
-                prob = clause.probability
-                name_alter = name + "_a" + str(curVarId)
+                    name = term_to_var_name(clause)
+                    prob = clause.probability
+                    name_alter = name + "_a" + str(self.cur_var_id)
+
+                    if self.verbose:
+                        print(name, prob)
+
+                    if prob is None:
+                        prob = 1.0
+
+                    param = learnable_param(self.lfi, prob)
+                    const = self.deterministic(prob) if param is None else None
+                    if param is not None:
+                        prob = self.lfi.value(param, 0.5)
+                        self.lfi.add_fact(name_alter, param)
+
+                    self.get_var(name)
+                    if const is not None:
+                        add_clause(clauses, name, const)
+                    else:
+                        self.get_var(name_alter, prob)
+                        add_clause(clauses, name, self.variables[name_alter][0])
+            if self.verbose:
+                print()
+
+        if self.verbose:
+            print("varialbes: \t", self.variables)
+            print("disjunctions: \t", disjunctions)
+            print("clauses: \t", clauses)
+            print("evidence: \t", evidence)
+            print("queries: \t", queries)
+            print()
 
-                if verbose:
-                    print(name, prob)
+        formulas = []
 
-                if prob is None:
-                    prob = 1.0
+        # generate disjunctions:
+        for disj_tuple in disjunctions:
+            disj = disj_tuple[0]
+            head_name = disj_tuple[1]
+            head_sym = self.variables[head_name][0] if head_name is not None else None
 
-                get_var(name)
-                get_var(name_alter, prob)
-                add_clause(clauses, name, variables[name_alter][0])
-        if verbose:
-            print()
+            syms = [self.variables[x[1]][0] for x in disj]
+            # add head_name to a v b v c
+            ors = None
+            if head_name is not None:
+                ors = Or(*(syms + [~head_sym]))
+            else:
+                ors = Or(*syms)
 
-    if verbose:
-        print("varialbes: \t", variables)
-        print("disjunctions: \t", disjunctions)
-        print("clauses: \t", clauses)
-        print("evidence: \t", evidence)
-        print("queries: \t", queries)
-        print()
-
-    total = True
-
-    # generate disjunctions:
-    for disj_tuple in disjunctions:
-        disj = disj_tuple[0]
-        head_name = disj_tuple[1]
-        head_sym = variables[head_name][0] if head_name is not None else None
-
-        syms = [variables[x[1]][0] for x in disj]
-        # add head_name to a v b v c
-        ors = None
-        if head_name is not None:
-            ors = Or(*(syms + [~head_sym]))
-        else:
-            ors = Or(*syms)
+            formulas.append(ors)
 
-        total &= ors
+            l = len(syms)
 
-        l = len(syms)
+            # add clauses to assert that all syms are diffrent
+            for j in range(l):
+                for i in range(j):
+                    formulas.append(~syms[i] | ~syms[j])
 
-        # add clauses to assert that all syms are diffrent
-        for j in range(l):
-            for i in range(j):
-                total &= ~syms[i] | ~syms[j]
+            # add clauses to make all false in case of head_name == false
+            if head_sym is not None:
+                for sym in syms:
+                    formulas.append(head_sym | ~sym)
 
-        # add clauses to make all false in case of head_name == false
-        if head_sym is not None:
-            for sym in syms:
-                total &= head_sym | ~sym
+        # add clauses:
+        for head_name in clauses:
+            bodies = clauses[head_name]
+            sym = self.variables[head_name][0]
+            if self.tseitin and len(bodies) > 1:
+                bodies = [self.tseitin_body(head_name, body, formulas) for body in bodies]
+            formulas.append(Equivalent(sym, Or(*bodies)))
 
-    # add clauses:
-    for head_name in clauses:
-        bodies = clauses[head_name]
-        ors = Or(*bodies)
-        sym = variables[head_name][0]
-        total &= Equivalent(sym, ors)
+        total = And(*formulas)
 
-    if verbose:
-        print("total: ", total)
-        print()
+        if self.verbose:
+            print("total: ", total)
+            print()
 
 
-    cnf_total = to_cnf(total)
-    if verbose:
-        print("cnf: ", cnf_total)
-        print()
+        with span("to_cnf"):
+            cnf_total = to_cnf(total)
+        if self.verbose:
+            print("cnf: ", cnf_total)
+            print()
 
-    # weights:
-    weights = {} # var name to tuple (prob true, prob false)
+        # weights:
+        weights = {} # var name to tuple (prob true, prob false)
 
-    for disj in disjunctions:
-        for var in disj[0]:
-            alter_name = var[1]
-            vtuple = variables[alter_name]
-            weights[alter_name] = (float(vtuple[1]), 1)
+        for disj in disjunctions:
+            for var in disj[0]:
+                alter_name = var[1]
+                vtuple = self.variables[alter_name]
+                weights[alter_name] = (float(vtuple[1]), 1)
 
-    for var_name in variables:
-        vtuple = variables[var_name]
-        if var_name in weights:
-            continue # disjunction
+        symbols = SymbolTable()
+        for var_name in self.variables:
+            if var_name in weights:
+                symbols.add(var_name, weights[var_name]) # disjunction
+                continue
 
-        prob = vtuple[1]
-        if prob is None:
-            weights[var_name] = (1, 1)
-        else:
-            p = float(prob)
-            weights[var_name] = (p, 1 - p)
+            prob = self.variables[var_name][1]
+            if prob is None:
+                symbols.add(var_name)
+            else:
+                p = float(prob)
+                symbols.add(var_name, (p, 1 - p))
+
+        return symbols, cnf_total, evidence, queries
+
+def parse_srl(contents, verbose, tseitin=False, lfi=None, grounded_str=None, ground_subprocess=False, determinism=False):
+    """
+        Grounds the problog program and encodes it as cnf,
+        with tseitin set heads with multiple rule bodies get an auxiliary variable per body
+        so the completion stays linear in the program size.
+        The variables of learnable probabilities (lfi_t(k)) are registered in lfi.
+        The program is grounded in-process unless ground_subprocess is set (problog ground),
+        if grounded_str is given it is used as the ground program.
+        With determinism set the probabilities 0 and 1 become constants instead of variables.
+    """
+    if grounded_str is None and ground_subprocess:
+        grounded_str = ground_program(contents, True)
+
+    if grounded_str is not None:
+        factory = problog.program.PrologFactory()
+        parser = problog.parser.PrologParser(factory)
+        with span("read ground program"):
+            parsed = parser.parseString(grounded_str)
+    else:
+        parsed = ground_clauses(ground_formula(contents))
 
-    vars = list(variables.keys())
-    return vars, cnf_total, weights, evidence, queries
+    with span("compile program"):
+        return SrlCompiler(verbose, tseitin, lfi, determinism).compile(parsed)
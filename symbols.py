@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+
+class SymbolTable:
+    """
+        Maps variable names to DIMACS ids (starting at 1) and back,
+        every variable also has a weight tuple (positive weight, negative weight)
+    """
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+        self.weights = []
+
+    def add(self, name, weight=(1, 1)):
+        """ Adds the variable if it is new and returns its id """
+        idx = self.ids.get(name)
+        if idx is None:
+            self.names.append(name)
+            self.weights.append(weight)
+            idx = len(self.names)
+            self.ids[name] = idx
+        return idx
+
+    def id(self, name):
+        """ Returns the id of the given variable name """
+        return self.ids[name]
+
+    def name(self, idx):
+        """ Returns the variable name of the given id """
+        return self.names[idx-1]
+
+    def literal(self, name, value=True):
+        """ Returns the literal of the variable with the given truth value """
+        idx = self.ids[name]
+        return idx if value else -idx
+
+    def weight(self, idx):
+        """ Returns the weight tuple of the variable with the given id """
+        return self.weights[idx-1]
+
+    def set_weight(self, name, weight):
+        self.weights[self.ids[name]-1] = weight
+
+    def __getitem__(self, name):
+        return self.ids[name]
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def items(self):
+        """ Yields (id, name, weight) for all variables in id order """
+        for i, name in enumerate(self.names):
+            yield i+1, name, self.weights[i]
+
+    def to_dict(self):
+        """ Returns the table as a json serializable dict """
+        return {'names': self.names, 'weights': self.weights}
+
+    @staticmethod
+    def from_dict(data):
+        """ Creates a table from the output of to_dict """
+        symbols = SymbolTable()
+        for name, weight in zip(data['names'], data['weights']):
+            symbols.add(name, tuple(weight))
+        return symbols
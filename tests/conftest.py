@@ -0,0 +1,12 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+@pytest.fixture(autouse=True)
+def repo_dir(monkeypatch):
+    """ The models (and MINIC2D_PATH) are relative to the repository """
+    monkeypatch.chdir(ROOT)
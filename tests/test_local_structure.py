@@ -0,0 +1,59 @@
+import pytest
+
+from pipeline import Pipeline
+
+BIF_MODELS = ['bif/cancer.bif', 'bif/bulglary.bif', 'bif/alarm.bif']
+PL_MODELS = ['problog/montyhall.pl', 'problog/cancer.pl', 'problog/coins.pl', 'problog/grounded.pl']
+
+def run(bif_file=None, pl_file=None, contents=None, **options):
+    """ Returns (weighted count, {query: P}) of the model compiled in-process """
+    options.setdefault('compiler', "apply")
+    pipe = Pipeline(vtree_report=None, **options)
+    try:
+        if contents is not None:
+            pipe.set_model(contents, False)
+        else:
+            pipe.load(bif_file=bif_file, pl_file=pl_file)
+        results = pipe.run()
+    finally:
+        pipe.close()
+    return results['count']['weighted_count'], dict(results['query']['probabilities'])
+
+def assert_same(expected, actual):
+    assert actual[0] == pytest.approx(expected[0], abs=1e-9)
+    assert set(actual[1]) == set(expected[1])
+    for query, pr in expected[1].items():
+        assert actual[1][query] == pytest.approx(pr, abs=1e-9), query
+
+@pytest.mark.parametrize("bif_file", BIF_MODELS)
+@pytest.mark.parametrize("enc", [1, 2])
+@pytest.mark.parametrize("level", [1, 2])
+def test_bif_levels_match_plain_encoding(bif_file, enc, level):
+    plain = run(bif_file=bif_file, enc=enc, network_vtree="balanced")
+    assert_same(plain, run(bif_file=bif_file, enc=enc, network_vtree="balanced", local_structure=level))
+
+@pytest.mark.parametrize("pl_file", PL_MODELS)
+@pytest.mark.parametrize("level", [1, 2])
+def test_problog_levels_match_plain_encoding(pl_file, level):
+    assert_same(run(pl_file=pl_file), run(pl_file=pl_file, local_structure=level))
+
+def test_montyhall_unit_clauses():
+    count, probs = run(pl_file='problog/montyhall.pl', local_structure=1)
+    assert count == pytest.approx(1.0)
+    assert probs['win_switch_'] == pytest.approx(2 / 3)
+    assert probs['win_keep_'] == pytest.approx(1 / 3)
+
+def test_deterministic_fact_and_rule():
+    contents = "0.0::a. 0.4::b. c :- a. c :- b.\nquery(a). query(c).\n"
+    for level in (0, 1):
+        count, probs = run(contents=contents, local_structure=level)
+        assert count == pytest.approx(1.0)
+        assert probs['a_'] == pytest.approx(0.0)
+        assert probs['c_'] == pytest.approx(0.4)
+
+def test_certain_fact():
+    contents = "1.0::a. 0.3::b. c :- a, b.\nquery(a). query(c).\n"
+    count, probs = run(contents=contents, local_structure=1)
+    assert count == pytest.approx(1.0)
+    assert probs['a_'] == pytest.approx(1.0)
+    assert probs['c_'] == pytest.approx(0.3)
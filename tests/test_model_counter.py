@@ -0,0 +1,57 @@
+import pytest
+
+from model_counter import ComponentCounter
+from test_local_structure import BIF_MODELS, PL_MODELS, run, assert_same
+from test_preprocess import table, brute_force
+
+def check_counter(ints, weights, assumptions=()):
+    """ Checks the count and marginals of ComponentCounter against a brute force count """
+    symbols = table(weights)
+    counter = ComponentCounter(ints, len(weights))
+    total, counts = counter.marginals(weights, assumptions)
+    assert total == pytest.approx(brute_force(ints, symbols, assumptions))
+    assert counter.count(weights, assumptions) == pytest.approx(total)
+    for var in range(1, len(weights) + 1):
+        for lit in (var, -var):
+            assert counts[lit] == pytest.approx(brute_force(ints, symbols, list(assumptions) + [lit])), lit
+    return total
+
+def test_disconnected():
+    # two components and a variable in no clause
+    weights = [(0.3, 0.7), (0.6, 0.4), (0.2, 0.8), (0.5, 0.5), (0.9, 0.1), (1.5, 2.5)]
+    ints = [[1, 2], [-1, -2, 3], [4, 5], [-4, -5]]
+    check_counter(ints, weights)
+    check_counter(ints, weights, [-3])
+    check_counter(ints, weights, [1, 4])
+
+def test_unsatisfiable():
+    weights = [(0.3, 0.7), (0.6, 0.4), (0.2, 0.8)]
+    assert check_counter([[1, 2], [-1, 2], [1, -2], [-1, -2], [3]], weights) == 0
+    assert check_counter([[1, 2], [3]], weights, [-1, -2]) == 0
+    assert check_counter([[1], []], weights) == 0
+
+def test_zero_weights():
+    weights = [(0.9, 0), (0, 1), (0.2, 0.8), (0.5, 0.5)]
+    ints = [[-1, 2, 3], [1, -3, 4], [2, 4], [-3, -4]]
+    check_counter(ints, weights)
+    assert check_counter(ints, weights, [-1]) == 0
+
+def test_negative_weights():
+    weights = [(0.5, -0.25), (-1, 2), (0.2, 0.8)]
+    check_counter([[1, 2], [-2, 3], [1, -3]], weights)
+
+def test_tautology_and_weights_change():
+    weights = [(0.3, 0.7), (0.6, 0.4)]
+    counter = ComponentCounter([[1, -1], [1, 2]], 2)
+    assert counter.count(weights) == pytest.approx(1 - 0.7 * 0.4)
+    assert counter.count([(1, 1), (1, 1)]) == 3
+
+@pytest.mark.parametrize("bif_file", BIF_MODELS)
+@pytest.mark.parametrize("enc", [1, 2])
+def test_bif_counter_matches_sdd(bif_file, enc):
+    sdd = run(bif_file=bif_file, enc=enc, network_vtree="balanced")
+    assert_same(sdd, run(bif_file=bif_file, enc=enc, backend="dpll"))
+
+@pytest.mark.parametrize("pl_file", PL_MODELS)
+def test_problog_counter_matches_sdd(pl_file):
+    assert_same(run(pl_file=pl_file), run(pl_file=pl_file, backend="dpll"))
@@ -0,0 +1,115 @@
+import itertools
+
+import pytest
+
+from symbols import SymbolTable
+from preprocess import preprocess_cnf
+from test_local_structure import BIF_MODELS, PL_MODELS, run, assert_same
+
+def table(weights):
+    symbols = SymbolTable()
+    for i, weight in enumerate(weights, 1):
+        symbols.add("x{}".format(i), weight)
+    return symbols
+
+def brute_force(ints, symbols, assumptions=()):
+    """ Weighted count of the clauses by enumerating all assignments """
+    total = 0
+    nvars = len(symbols)
+    for values in itertools.product((True, False), repeat=nvars):
+        lits = set([var if value else -var for var, value in enumerate(values, 1)])
+        if not lits.issuperset(assumptions) or not all([lits.intersection(clause) for clause in ints]):
+            continue
+        product = 1
+        for lit in lits:
+            w_pos, w_neg = symbols.weight(abs(lit))
+            product *= w_pos if lit > 0 else w_neg
+        total += product
+    return total
+
+def check_mapping(ints, symbols, protected=()):
+    """
+        Preprocesses the clauses and checks the count of every literal of the original cnf
+        against that of its literal in the preprocessed cnf, returns the CnfMapping
+    """
+    new_ints, new_symbols, mapping = preprocess_cnf(ints, symbols, [symbols.id(name) for name in protected])
+    total = brute_force(ints, symbols)
+    assert mapping.factor * brute_force(new_ints, new_symbols) == pytest.approx(total)
+    for name in protected:
+        assert name in new_symbols
+    for var in range(1, len(symbols) + 1):
+        for lit in (var, -var):
+            new_lit = mapping.literal(lit)
+            if new_lit is None:
+                assert var in mapping.eliminated
+                continue
+            expected = brute_force(ints, symbols, [lit])
+            if new_lit is True:
+                assert expected == pytest.approx(total)
+            elif new_lit is False:
+                assert expected == pytest.approx(0)
+            else:
+                assert new_symbols.name(abs(new_lit)) == symbols.name(var)
+                assert mapping.factor * brute_force(new_ints, new_symbols, [new_lit]) == pytest.approx(expected)
+    return mapping
+
+def test_unit_propagation():
+    symbols = table([(0.3, 0.7), (0.6, 0.4), (0.2, 0.8), (0.5, 0.5)])
+    mapping = check_mapping([[1], [-1, 2], [-2, 3, 4], [3, -4]], symbols)
+    assert mapping.fixed[1] is True and mapping.fixed[2] is True
+
+def test_protected_unit():
+    symbols = table([(0.3, 0.7), (0.6, 0.4), (0.2, 0.8)])
+    mapping = check_mapping([[1], [-1, 2, 3], [-2, -3]], symbols, protected=["x1"])
+    assert 1 not in mapping.fixed
+    assert 1 in mapping.ids and mapping.literal(1) == mapping.ids[1]
+
+def test_pure_literal():
+    # x1 with negative weight 0 is true in every model that counts
+    symbols = table([(0.9, 0), (0.6, 0.4), (0.2, 0.8)])
+    mapping = check_mapping([[-1, 2, 3], [1, -2], [2, -3]], symbols)
+    assert mapping.fixed[1] is True
+
+def test_free_variable():
+    symbols = table([(0.3, 0.7), (0.6, 0.4), (1.5, 2.5)])
+    mapping = check_mapping([[1, 2], [-1, -2]], symbols)
+    assert 3 in mapping.eliminated
+    assert mapping.factor == pytest.approx(4.0)
+
+@pytest.mark.parametrize("gate", ["and", "or"])
+def test_gate_elimination(gate):
+    # x3 = x1 & x2 or x3 = x1 | x2, used by the clauses with x4
+    symbols = table([(0.3, 0.7), (0.6, 0.4), (1, 1), (0.2, 0.8)])
+    if gate == "and":
+        ints = [[-3, 1], [-3, 2], [3, -1, -2], [3, 4], [-3, -4]]
+    else:
+        ints = [[3, -1], [3, -2], [-3, 1, 2], [3, 4], [-3, -4]]
+    mapping = check_mapping(ints, symbols)
+    assert 3 in mapping.eliminated
+
+def test_unequal_weights_are_kept():
+    symbols = table([(0.3, 0.7), (0.6, 0.4), (0.1, 0.9)])
+    mapping = check_mapping([[-3, 1], [-3, 2], [3, -1, -2]], symbols)
+    assert 3 in mapping.ids and mapping.literal(-3) == -mapping.ids[3]
+
+def test_unsatisfiable():
+    symbols = table([(0.3, 0.7), (0.6, 0.4)])
+    assert preprocess_cnf([[1], [-1, 2], [-2]], symbols) is None
+    assert preprocess_cnf([[1, 2], []], symbols) is None
+
+@pytest.mark.parametrize("bif_file", BIF_MODELS)
+@pytest.mark.parametrize("enc", [1, 2])
+def test_bif_preprocessing(bif_file, enc):
+    plain = run(bif_file=bif_file, enc=enc, network_vtree="balanced")
+    assert_same(plain, run(bif_file=bif_file, enc=enc, network_vtree="balanced", preprocess=True))
+
+@pytest.mark.parametrize("pl_file", PL_MODELS)
+@pytest.mark.parametrize("level", [0, 1])
+def test_problog_preprocessing(pl_file, level):
+    assert_same(run(pl_file=pl_file), run(pl_file=pl_file, local_structure=level, preprocess=True))
+
+def test_deterministic_fact_and_rule():
+    contents = "0.0::a. 0.4::b. c :- a. c :- b. d :- c.\nquery(d).\n"
+    count, probs = run(contents=contents, preprocess=True)
+    assert count == pytest.approx(1.0)
+    assert probs['d_'] == pytest.approx(0.4)
@@ -0,0 +1,303 @@
+#!/usr/bin/python3
+
+import sys
+import time
+import heapq
+
+import numpy as np
+
+from bif_reader import read_bif
+
+# minimal size of the joint table of a contraction before einsum searches a contraction path
+OPTIMIZE_SIZE = 1 << 12
+
+def cpt_factors(nodes, index):
+    """ Returns the cpt of every node as a factor (variables, table), the variables are node indices """
+    return [(tuple([index[p.getName()] for p in node.getParents()]) + (i,), node.getCPT())
+        for i, node in enumerate(nodes)]
+
+def moral_graph(factors, nvars):
+    """ Returns the adjacency sets of the graph connecting all variables that share a factor """
+    adj = [set() for _ in range(nvars)]
+    for variables, _ in factors:
+        for v in variables:
+            adj[v].update(variables)
+    for v in range(nvars):
+        adj[v].discard(v)
+    return adj
+
+def min_fill_order(adj, cards, variables=None, min_degree=False):
+    """
+        Greedy min-fill elimination order of the given variables (all by default),
+        ties are broken by the size of the clique the elimination creates.
+        With min_degree set the variable with the fewest neighbours goes first instead.
+        adj is not modified, only the edges between the given variables are used
+    """
+    if variables is None:
+        variables = range(len(adj))
+    variables = set(variables)
+    adj = dict((v, adj[v] & variables) for v in variables)
+    log_cards = np.log(cards)
+
+    def score(v):
+        nbs = adj[v]
+        if min_degree:
+            return (len(nbs), log_cards[v] + sum([log_cards[u] for u in nbs]), v)
+        fill = 0
+        for u in nbs:
+            fill += len(nbs - adj[u]) - 1
+        return (fill // 2, log_cards[v] + sum([log_cards[u] for u in nbs]), v)
+
+    # lazy heap: an entry is stale if the score of its variable changed since it was pushed
+    scores = dict((v, score(v)) for v in variables)
+    heap = list(scores.values())
+    heapq.heapify(heap)
+
+    order = []
+    while heap:
+        entry = heapq.heappop(heap)
+        v = entry[2]
+        if scores.get(v) != entry:
+            continue
+        del scores[v]
+        order.append(v)
+
+        nbs = adj.pop(v)
+        for u in nbs:
+            adj[u].discard(v)
+            adj[u].update(nbs - {u})
+
+        # the fill of the neighbours and of their neighbours can change
+        changed = set(nbs)
+        for u in nbs:
+            changed.update(adj[u])
+        for u in changed:
+            new_score = score(u)
+            if new_score != scores[u]:
+                scores[u] = new_score
+                heapq.heappush(heap, new_score)
+    return order
+
+def contract(factors, keep, cards):
+    """
+        Multiplies the factors and sums out all variables that aren't in keep, returns the table over keep.
+        Variables of keep that aren't in any factor get a constant axis
+    """
+    labels = {}
+    args = []
+    for variables, table in factors:
+        args.append(table)
+        args.append([labels.setdefault(v, len(labels)) for v in variables])
+    for v in keep:
+        if v not in labels:
+            args.append(np.ones(cards[v]))
+            args.append([labels.setdefault(v, len(labels))])
+    if not args:
+        return np.ones(())
+    args.append([labels[v] for v in keep])
+    # finding a contraction path only pays off for large tables
+    size = int(np.prod([cards[v] for v in labels]))
+    return np.einsum(*args, optimize=len(args) > 5 and size > OPTIMIZE_SIZE)
+
+def rescale(table):
+    """
+        Divides the table by its maximum to avoid underflow, returns (scaled table, log of the scale).
+        A new table is returned as einsum can return a view of a cpt
+    """
+    m = table.max() if table.size > 0 else 0
+    if m <= 0:
+        return table, 0.0
+    return table / m, np.log(m)
+
+class BayesNet:
+    """ The nodes of a parsed bif network as factors over node indices """
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.index = dict((node.getName(), i) for i, node in enumerate(nodes))
+        self.cards = [len(node.getStates()) for node in nodes]
+        self.factors = cpt_factors(nodes, self.index)
+
+    def evidence_factors(self, evidence):
+        """
+            Returns the evidence as unary factors, evidence maps node names to
+            a state name (observed) or a likelihood vector over the states of the node
+        """
+        factors = []
+        for name, value in (evidence or {}).items():
+            i = self.index[name]
+            if isinstance(value, str):
+                vec = np.zeros(self.cards[i])
+                vec[self.nodes[i].getStateIndex(value)] = 1
+            else:
+                vec = np.array(value, dtype=np.float64)
+            factors.append(((i,), vec))
+        return factors
+
+    def ancestors(self, variables):
+        """ Returns the given variables and all their ancestors """
+        result = set()
+        todo = list(variables)
+        while todo:
+            v = todo.pop()
+            if v in result:
+                continue
+            result.add(v)
+            todo += [self.index[p.getName()] for p in self.nodes[v].getParents()]
+        return result
+
+class VariableElimination(BayesNet):
+    """
+        Exact inference by variable elimination with a min-fill order,
+        nodes that aren't ancestors of the query or evidence are pruned first
+        (which assumes every cpt row sums to 1).
+        Factors are rescaled after every elimination, the scale is kept in log space
+    """
+
+    def eliminate(self, keep, evidence):
+        """ Eliminates all relevant variables except keep, returns (remaining factors, log scale) """
+        ev_factors = self.evidence_factors(evidence)
+        relevant = self.ancestors(set(keep) | set([f[0][0] for f in ev_factors]))
+        factors = [f for f in self.factors if f[0][-1] in relevant] + ev_factors
+
+        adj = moral_graph(factors, len(self.nodes))
+        order = min_fill_order(adj, self.cards, relevant - set(keep))
+
+        log_scale = 0.0
+        for v in order:
+            bucket = [f for f in factors if v in f[0]]
+            factors = [f for f in factors if v not in f[0]]
+            variables = tuple(sorted(set([u for f in bucket for u in f[0]]) - {v}))
+            table, scale = rescale(contract(bucket, variables, self.cards))
+            log_scale += scale
+            factors.append((variables, table))
+        return factors, log_scale
+
+    def probability(self, evidence=None):
+        """ Returns the probability of the evidence """
+        factors, log_scale = self.eliminate((), evidence)
+        return float(contract(factors, (), self.cards) * np.exp(log_scale))
+
+    def marginal(self, name, evidence=None):
+        """
+            Returns (P(evidence), P(name | evidence)), the marginal is an array over the states
+            of the node and nan if the evidence has probability 0
+        """
+        v = self.index[name]
+        factors, log_scale = self.eliminate((v,), evidence)
+        table = contract(factors, (v,), self.cards)
+        total = table.sum()
+        if total == 0:
+            return 0.0, np.full(self.cards[v], np.nan)
+        return float(total * np.exp(log_scale)), table / total
+
+class JunctionTree(BayesNet):
+    """
+        Junction tree of the cliques of a min-fill elimination order, calibrated with
+        Shafer-Shenoy message passing to get the marginals of all nodes at once.
+        Clique i is created by eliminating order[i], its parent is the clique of the first
+        eliminated variable of its separator, so children always come before their parent.
+    """
+
+    def __init__(self, nodes, order=None):
+        BayesNet.__init__(self, nodes)
+        n = len(nodes)
+        adj = moral_graph(self.factors, n)
+        if order is None:
+            order = min_fill_order(adj, self.cards)
+        self.order = order
+
+        adj = [set(nbs) for nbs in adj]
+        position = [0] * n
+        self.cliques = []
+        self.separators = []
+        for i, v in enumerate(order):
+            position[v] = i
+            nbs = adj[v]
+            for u in nbs:
+                adj[u].discard(v)
+                adj[u].update(nbs - {u})
+            self.separators.append(tuple(sorted(nbs)))
+            self.cliques.append((v,) + self.separators[-1])
+
+        self.parents = [min([position[u] for u in sep]) if sep else None for sep in self.separators]
+        self.children = [[] for _ in range(n)]
+        for i, parent in enumerate(self.parents):
+            if parent is not None:
+                self.children[parent].append(i)
+
+        # every cpt goes to the clique of the first eliminated variable of its family
+        self.assigned = [[] for _ in range(n)]
+        for factor in self.factors:
+            self.assigned[min([position[v] for v in factor[0]])].append(factor)
+        self.position = position
+
+    def width(self):
+        return max([len(c) for c in self.cliques]) - 1 if self.cliques else 0
+
+    def marginals(self, evidence=None):
+        """
+            Returns (P(evidence), marginals) where marginals[i] is the array P(node i | evidence),
+            all nan if the evidence has probability 0
+        """
+        n = len(self.nodes)
+        local = [list(factors) for factors in self.assigned]
+        for factor in self.evidence_factors(evidence):
+            local[self.position[factor[0][0]]].append(factor)
+
+        # upward pass, the root messages are scalars
+        up = [None] * n
+        log_scale = 0.0
+        p_evidence = 1.0
+        for i in range(n):
+            factors = local[i] + [(self.separators[c], up[c]) for c in self.children[i]]
+            up[i], scale = rescale(contract(factors, self.separators[i], self.cards))
+            log_scale += scale
+            if self.parents[i] is None:
+                p_evidence *= float(up[i])
+        p_evidence = float(p_evidence * np.exp(log_scale))
+
+        if p_evidence == 0:
+            return 0.0, [np.full(c, np.nan) for c in self.cards]
+
+        # downward pass
+        down = [None] * n
+        for i in reversed(range(n)):
+            incoming = [(self.separators[c], up[c]) for c in self.children[i]]
+            if self.parents[i] is not None:
+                incoming.append((self.separators[i], down[i]))
+            for j, c in enumerate(self.children[i]):
+                down[c], _ = rescale(contract(local[i] + incoming[:j] + incoming[j+1:], self.separators[c], self.cards))
+
+        marginals = [None] * n
+        for i, v in enumerate(self.order):
+            factors = local[i] + [(self.separators[c], up[c]) for c in self.children[i]]
+            if self.parents[i] is not None:
+                factors.append((self.separators[i], down[i]))
+            table = contract(factors, (v,), self.cards)
+            marginals[v] = table / table.sum()
+        return p_evidence, marginals
+
+    def marginals_batch(self, evidence_sets):
+        """
+            Returns (P(evidence), marginals) for a list of evidence sets, P(evidence) has shape (batch,)
+            and marginals[i] shape (batch, cardinality of node i). The tree is calibrated once per set
+        """
+        results = [self.marginals(evidence) for evidence in evidence_sets]
+        p_evidence = np.array([p for p, _ in results])
+        return p_evidence, [np.array([m[v] for _, m in results]) for v in range(len(self.nodes))]
+
+def main():
+    with open(sys.argv[1], "r") as f:
+        nodes = read_bif(f.read())
+    start = time.time()
+    tree = JunctionTree(nodes)
+    _, marginals = tree.marginals()
+    print("width:", tree.width())
+    for node, marginal in zip(nodes, marginals):
+        print(node.getName(), ", ".join(["{}: {}".format(s, p) for s, p in zip(node.getStates(), marginal)]))
+    print("time: {:.3f}s".format(time.time() - start))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())